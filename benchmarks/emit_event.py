@@ -0,0 +1,56 @@
+"""
+Per-iteration overhead of callback event dispatch in `Loop.iterate_dataloader`
+
+Compares precomputed dispatch table with naive dispatch calling every callback
+for every event (behaviour before dispatch table was introduced).
+
+Usage::
+
+    python -m benchmarks.emit_event
+"""
+import time
+from tempfile import TemporaryDirectory
+
+from matches.callbacks import Callback
+from matches.loop import Loop
+
+ITERATIONS = 200_000
+NUM_NOOP_CALLBACKS = 5
+
+
+class BatchCounter(Callback):
+    def __init__(self):
+        self.batches = 0
+
+    def on_iteration_end(self, loop: "Loop", batch_no: int):
+        self.batches += 1
+
+
+class NaiveDispatchLoop(Loop):
+    def _emit_event(self, event: str, **event_kwargs):
+        for c in self.callbacks:
+            getattr(c, event)(self, **event_kwargs)
+
+
+def _measure(loop_cls) -> float:
+    with TemporaryDirectory() as logdir:
+        callbacks = [Callback() for _ in range(NUM_NOOP_CALLBACKS)] + [BatchCounter()]
+        loop = loop_cls(logdir, callbacks)
+        loader = range(ITERATIONS)
+
+        start = time.perf_counter()
+        for _ in loop.iterate_dataloader(loader, move_to_default_device=False):
+            pass
+        return (time.perf_counter() - start) / ITERATIONS
+
+
+def main():
+    naive = _measure(NaiveDispatchLoop)
+    table = _measure(Loop)
+    print(f"naive dispatch:    {naive * 1e6:.2f} us/iteration")
+    print(f"dispatch table:    {table * 1e6:.2f} us/iteration")
+    print(f"overhead removed:  {(naive - table) * 1e6:.2f} us/iteration")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Epoch time of CIFAR10 train pipeline from `examples/ddp_cifar` with and without
+memory-mapped sample cache
+
+Uncached pipeline decodes PIL images and runs full transform every epoch.
+Cached pipeline runs deterministic part (ToTensor, Normalize) only in the first
+epoch, later epochs read tensors from `MemmapCachedDataset` and apply random
+augmentations (Pad, RandomCrop, RandomHorizontalFlip) to tensors.
+
+Requires torchvision, CIFAR10 is downloaded to `--data` if absent.
+
+Usage::
+
+    python -m benchmarks.memmap_cache_cifar --data data/cifar --epochs 3
+"""
+import argparse
+import time
+from tempfile import TemporaryDirectory
+
+from torch.utils.data import DataLoader
+from torchvision.transforms import Compose, Pad, RandomCrop, RandomHorizontalFlip
+
+from examples.ddp_cifar.utils import get_train_test_datasets, test_transform
+from matches.data import MemmapCachedDataset
+
+tensor_augment = Compose([Pad(4), RandomCrop(32), RandomHorizontalFlip()])
+
+
+def augment(sample):
+    image, label = sample
+    return tensor_augment(image), label
+
+
+def epoch_times(dataset, epochs: int, batch_size: int, num_workers: int):
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=True,
+        num_workers=num_workers,
+        persistent_workers=num_workers > 0,
+    )
+    times = []
+    for _ in range(epochs):
+        start = time.perf_counter()
+        for _ in loader:
+            pass
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", default="data/cifar")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--num-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    train_ds, _ = get_train_test_datasets(args.data)
+    settings = (args.epochs, args.batch_size, args.num_workers)
+
+    uncached = epoch_times(train_ds, *settings)
+
+    train_ds.transform = test_transform
+    with TemporaryDirectory() as cache_dir:
+        cached_ds = MemmapCachedDataset(
+            train_ds, cache_dir, key=repr(test_transform), transform=augment
+        )
+        cached = epoch_times(cached_ds, *settings)
+
+    print(f"{'epoch':>6} {'uncached, s':>12} {'memmap cache, s':>16}")
+    for epoch, (u, c) in enumerate(zip(uncached, cached)):
+        print(f"{epoch:>6} {u:>12.2f} {c:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Cost of train/eval switching and requires_grad toggling on a deep synthetic model
+
+Compares cached flat implementation from `matches.shortcuts.module` with
+tree-walking implementation (behaviour before caching was introduced).
+
+Usage::
+
+    python -m benchmarks.module_mode
+"""
+import time
+from contextlib import contextmanager
+
+from torch import nn
+
+from matches.shortcuts.module import module_train, no_grad_for_module
+
+DEPTH = 500
+REPEATS = 50
+
+
+def make_deep_model(depth: int) -> nn.Module:
+    block = nn.Sequential(nn.Linear(4, 4), nn.BatchNorm1d(4), nn.ReLU(), nn.Dropout())
+    model = block
+    for _ in range(depth - 1):
+        model = nn.Sequential(
+            nn.Linear(4, 4), nn.BatchNorm1d(4), nn.ReLU(), nn.Dropout(), model
+        )
+    return model
+
+
+@contextmanager
+def tree_walk_module_train(*modules: nn.Module, train=True):
+    old_states = []
+    try:
+        for module in modules:
+            old_state = {}
+            for name, child in module.named_modules():
+                old_state[name] = child.training
+                child.training = train
+            old_states.append(old_state)
+        yield
+    finally:
+        for module, old_state in zip(modules, old_states):
+            for name, child in module.named_modules():
+                child.training = old_state[name]
+
+
+@contextmanager
+def tree_walk_no_grad_for_module(mod: nn.Module):
+    old_state = {}
+    try:
+        for name, tensor in mod.named_parameters():
+            old_state[name] = tensor.requires_grad
+            tensor.requires_grad_(False)
+        yield
+    finally:
+        for name, tensor in mod.named_parameters():
+            tensor.requires_grad_(old_state[name])
+
+
+def _measure(context_factory, model: nn.Module) -> float:
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        with context_factory(model):
+            pass
+    return (time.perf_counter() - start) / REPEATS
+
+
+def main():
+    model = make_deep_model(DEPTH)
+    print(
+        f"{len(list(model.modules()))} modules, "
+        f"{len(list(model.parameters()))} parameters"
+    )
+    cases = [
+        ("module_train", tree_walk_module_train, module_train),
+        ("no_grad_for_module", tree_walk_no_grad_for_module, no_grad_for_module),
+    ]
+    for name, before, after in cases:
+        # Warm up cache
+        _measure(after, model)
+        print(
+            f"{name:20s} tree walk: {_measure(before, model) * 1e3:7.2f} ms  "
+            f"cached: {_measure(after, model) * 1e3:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
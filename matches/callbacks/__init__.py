@@ -5,3 +5,5 @@ from .progress import TqdmProgressCallback
 from .wandb import WandBLoggingSink
 from .tensorboard import TensorboardMetricWriterCallback
 from .metrics import BestMetricsReporter
+from .async_callback import AsyncCallback
+from .profiler import ProfilerCallback
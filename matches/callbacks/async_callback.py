@@ -0,0 +1,211 @@
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from ..loop import Loop
+from ..loop.iteration import IterationCounter
+from ..loop.metric_manager import MetricEntry, MetricManager
+from .callback import EVENTS, Callback
+
+LOG = logging.getLogger(__name__)
+
+# Frequent per-step events which can be dropped under "drop-oldest" policy.
+# Epoch/dataloader/train events are never dropped
+_DROPPABLE_EVENTS = {
+    "on_iteration_start",
+    "on_iteration_end",
+    "on_after_backward",
+    "on_before_optimizer_step",
+    "on_after_optimizer_step",
+}
+
+_STOP = object()
+
+
+class _MetricsView:
+    """MetricManager proxy with `latest` and new entries frozen at event emission time
+
+    `collect_new_entries` returns entries frozen at emission which weren't returned
+    to the same :obj:`AsyncCallback` yet, so entries are not lost if loop resets
+    metrics before worker processes the event.
+    """
+
+    def __init__(self, metrics: MetricManager, owner: "AsyncCallback"):
+        self._metrics = metrics
+        self._owner = owner
+        self.latest: Dict[str, MetricEntry] = dict(metrics.latest)
+        self._new_entries = metrics.collect_new_entries(reset=False)
+
+    def collect_new_entries(self, reset=True) -> List[MetricEntry]:
+        entries = self._new_entries
+        delivered = self._owner._last_delivered_entry
+        for i, entry in enumerate(entries):
+            if entry is delivered:
+                entries = entries[i + 1 :]
+                break
+        if reset and entries:
+            self._owner._last_delivered_entry = entries[-1]
+            self._metrics.discard_entries(entries)
+        return list(entries)
+
+    def __getattr__(self, item):
+        return getattr(self._metrics, item)
+
+
+def _copy_iterations(iterations: IterationCounter) -> IterationCounter:
+    copy = IterationCounter()
+    copy.load_state_dict(iterations.state_dict())
+    return copy
+
+
+class _LoopView:
+    """Loop proxy passed to handlers executed in background thread"""
+
+    def __init__(self, loop: Loop, owner: "AsyncCallback"):
+        self._loop = loop
+        self.metrics = _MetricsView(loop.metrics, owner)
+        self.iterations = _copy_iterations(loop.iterations)
+
+    def __getattr__(self, item):
+        return getattr(self._loop, item)
+
+
+class AsyncCallback(Callback):
+    """
+    Wrapper executing event handlers of callback in dedicated worker thread
+
+    Useful for I/O-heavy metric sinks which shouldn't stall training. Events are
+    put into bounded queue and processed in emission order.
+
+    Handlers receive proxy of the loop: `loop.metrics.latest`, new metric entries
+    and `loop.iterations` are frozen at emission time, everything else (models,
+    optimizers etc) is live loop state. So don't wrap checkpoint savers, as they
+    would save state changed by training in the meantime, use
+    `StateManager(async_write=True)` (see :obj:`AsyncStateWriter`) instead.
+
+    Queue is drained on `on_train_end`. Exception raised in worker is re-raised
+    in main thread on next emitted event or on drain. Events after failed one are skipped.
+
+    Examples::
+
+        loop = Loop(logdir, [AsyncCallback(TensorboardMetricWriterCallback())])
+    """
+
+    def __init__(
+        self,
+        callback: Callback,
+        max_queue_size: int = 64,
+        backpressure: str = "block",
+    ):
+        """
+
+        Args:
+            callback: callback to run asynchronously
+            max_queue_size: maximum number of pending events
+            backpressure: what to do when queue is full. "block" waits for worker,
+                "drop-oldest" drops oldest pending per-step event (iteration/backward/step)
+                and blocks only if there are no such events
+        """
+        assert backpressure in (
+            "block",
+            "drop-oldest",
+        ), f"Unknown backpressure policy {backpressure}"
+        assert max_queue_size > 0, "Queue size must be positive"
+
+        self.callback = callback
+        self.max_queue_size = max_queue_size
+        self.backpressure = backpressure
+        self.dropped_events = 0
+
+        self._events: Deque[Any] = deque()
+        self._cond = threading.Condition()
+        self._error: Optional[BaseException] = None
+        self._thread: Optional[threading.Thread] = None
+        self._last_delivered_entry: Optional[MetricEntry] = None
+
+    def handled_events(self) -> Set[str]:
+        # on_train_end is always handled to drain the queue
+        return self.callback.handled_events() | {"on_train_end"}
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._events) > 0)
+                item = self._events.popleft()
+                self._cond.notify_all()
+
+            if item is _STOP:
+                break
+
+            event, loop, kwargs = item
+            if self._error is None:
+                try:
+                    getattr(self.callback, event)(loop, **kwargs)
+                except BaseException as e:
+                    LOG.error("Async callback %s failed on %s", self.callback, event)
+                    self._error = e
+
+    def _drop_oldest(self) -> bool:
+        for i, item in enumerate(self._events):
+            if item is not _STOP and item[0] in _DROPPABLE_EVENTS:
+                del self._events[i]
+                self.dropped_events += 1
+                return True
+        return False
+
+    def _raise_pending_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _submit(self, item: Tuple[str, _LoopView, Dict[str, Any]]):
+        self._raise_pending_error()
+        self._ensure_worker()
+        with self._cond:
+            if len(self._events) >= self.max_queue_size:
+                if not (self.backpressure == "drop-oldest" and self._drop_oldest()):
+                    self._cond.wait_for(
+                        lambda: len(self._events) < self.max_queue_size
+                    )
+            self._events.append(item)
+            self._cond.notify_all()
+
+    def _enqueue(self, event: str, loop: Loop, **kwargs):
+        self._submit((event, _LoopView(loop, self), kwargs))
+
+    def drain(self):
+        """Wait until all pending events are processed and stop worker thread.
+
+        Re-raises exception occurred in worker, if any
+        """
+        if self._thread is not None:
+            with self._cond:
+                self._events.append(_STOP)
+                self._cond.notify_all()
+            self._thread.join()
+            self._thread = None
+        self._raise_pending_error()
+
+    def on_train_end(self, loop: "Loop"):
+        if "on_train_end" in self.callback.handled_events():
+            self._enqueue("on_train_end", loop)
+        self.drain()
+
+
+def _make_handler(event: str):
+    def _handler(self: AsyncCallback, loop: "Loop", **kwargs):
+        self._enqueue(event, loop, **kwargs)
+
+    _handler.__name__ = event
+    return _handler
+
+
+for _event in EVENTS:
+    if _event not in vars(AsyncCallback):
+        setattr(AsyncCallback, _event, _make_handler(_event))
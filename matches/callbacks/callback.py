@@ -1,4 +1,5 @@
 import typing
+from typing import Set
 
 from torch.optim import Optimizer
 from torch.utils.data import DataLoader
@@ -8,6 +9,19 @@ if typing.TYPE_CHECKING:
 
 
 class Callback:
+    def handled_events(self) -> Set[str]:
+        """Names of events this callback reacts on.
+
+        By default these are events which handlers are overridden in subclass or instance.
+        `Loop` doesn't emit other events to this callback at all.
+        """
+        return {
+            event
+            for event in EVENTS
+            if event in self.__dict__
+            or getattr(type(self), event) is not getattr(Callback, event)
+        }
+
     def on_epoch_start(self, loop: "Loop", epoch_no: int, total_epochs: int):
         pass
 
@@ -40,3 +54,6 @@ class Callback:
 
     def on_after_optimizer_step(self, loop: "Loop", optimizer: Optimizer):
         pass
+
+
+EVENTS = tuple(name for name in vars(Callback) if name.startswith("on_"))
@@ -1,6 +1,6 @@
 import logging
 
-from ignite.distributed import one_rank_only
+import ignite.distributed as idist
 
 from ..loop import Loop
 from ..shortcuts.metrics import MetricBestSetup
@@ -10,6 +10,12 @@ LOG = logging.getLogger(__name__)
 
 
 class BestModelSaver(Callback):
+    """Saves `best.pth` checkpoint when metric improves
+
+    Checkpoint is saved by rank 0, or by all ranks if state manager writes
+    distributed checkpoints. In this case decision is made by metric value of rank 0.
+    """
+
     def __init__(
         self, metric_name: str, metric_mode: str = "min", logdir_suffix: str = ""
     ):
@@ -18,11 +24,18 @@ class BestModelSaver(Callback):
         self.metric_mode = metric_mode
         self.metric_best_setup = MetricBestSetup(metric_name, metric_mode)
 
-    @one_rank_only()
     def on_epoch_end(self, loop: "Loop", epoch_no: int, total_epochs: int):
-        if self.metric_best_setup.update(
-            loop.metrics.latest[self.metric_name].value, epoch_no
-        ):
+        distributed = loop.state_manager.distributed
+        if not distributed and idist.get_rank() > 0:
+            return
+
+        value = None
+        if idist.get_rank() == 0:
+            value = loop.metrics.latest[self.metric_name].value
+        if distributed and idist.get_world_size() > 1:
+            value = idist.broadcast(value, src=0, safe_mode=True)
+
+        if self.metric_best_setup.update(value, epoch_no):
             LOG.info(
                 "Metric %s reached new best value %g at epoch %d -> updating checkpoint",
                 self.metric_best_setup.name,
@@ -31,6 +44,12 @@ class BestModelSaver(Callback):
             )
             self.save_model(loop)
 
+    def state_dict(self):
+        return self.metric_best_setup.state_dict()
+
+    def load_state_dict(self, state_dict):
+        self.metric_best_setup.load_state_dict(state_dict)
+
     def save_model(self, loop: Loop):
         checkpoint_path = loop.logdir / self.logdir_suffix / "best.pth"
         checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
@@ -44,12 +63,18 @@ class BestModelSaver(Callback):
 
 
 class LastModelSaverCallback(Callback):
+    """Saves `last.pth` checkpoint every epoch
+
+    Checkpoint is saved by rank 0, or by all ranks if state manager writes
+    distributed checkpoints.
+    """
+
     def __init__(self, logdir_suffix: str = ""):
         self.logdir_suffix = logdir_suffix
 
-    @one_rank_only()
     def on_epoch_end(self, loop: "Loop", epoch_no: int, total_epochs: int):
-        self.save_model(loop)
+        if loop.state_manager.distributed or idist.get_rank() == 0:
+            self.save_model(loop)
 
     def save_model(self, loop: Loop):
         checkpoint_path = loop.logdir / self.logdir_suffix / "last.pth"
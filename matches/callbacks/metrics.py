@@ -1,6 +1,6 @@
 import logging
 from collections import defaultdict
-from typing import Callable, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Union
 from warnings import warn
 
 import pandas as pd
@@ -56,6 +56,21 @@ class BestMetricsReporter(Callback):
             (loop.logdir / "best_metrics_summary.txt").write_text(str(summary_df))
         # dump_json(summary, loop.logdir / "best_metrics_summary.json", indent=2)
 
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "epochs_elapsed_num": self.epochs_elapsed_num,
+            "metrics": {
+                name: setup.state_dict()
+                for name, setup in self.metric_best_setups_dict.items()
+            },
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        self.epochs_elapsed_num = state_dict["epochs_elapsed_num"]
+        for name, setup_state in state_dict["metrics"].items():
+            if name in self.metric_best_setups_dict:
+                self.metric_best_setups_dict[name].load_state_dict(setup_state)
+
     def get_summary(self) -> Dict[str, List[Union[str, float, int]]]:
         if get_rank() != 0:
             warn("get_summary() was called in process with non-zero rank")
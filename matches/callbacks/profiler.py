@@ -0,0 +1,135 @@
+import logging
+from pathlib import Path
+from typing import Optional
+
+from ignite.distributed import get_rank
+from torch.profiler import ProfilerAction, profile, schedule
+
+from ..loop import Loop
+from .callback import Callback
+
+LOG = logging.getLogger(__name__)
+
+_RECORDING_ACTIONS = (
+    ProfilerAction.WARMUP,
+    ProfilerAction.RECORD,
+    ProfilerAction.RECORD_AND_SAVE,
+)
+
+
+class ProfilerCallback(Callback):
+    """
+    Runs `torch.profiler` on schedule and writes results under `loop.logdir`
+
+    Profiler steps on every train batch (or every epoch if `step_on="epoch"`).
+    Schedule is the standard `torch.profiler.schedule`: skip `skip_first` steps, then
+    `repeat` cycles of `wait` idle steps, `warmup` steps and `active` recorded steps.
+
+    While profiler is recording, Loop phases (data wait, transfer, backward,
+    optimizer step) and callback events are labeled as `matches/<name>` ranges.
+
+    For every recorded cycle chrome trace `trace_rank<R>_step<N>.json` and
+    key averages table `key_averages_rank<R>_step<N>.txt` are written to
+    `loop.logdir / logdir_suffix`.
+
+    Profiler is stopped on train end, or in :meth:`drain` called by `Loop.run`
+    if training fails, so cycle recorded at the moment of failure is written too.
+    """
+
+    def __init__(
+        self,
+        wait: int = 1,
+        warmup: int = 1,
+        active: int = 3,
+        repeat: int = 1,
+        skip_first: int = 0,
+        step_on: str = "batch",
+        all_ranks: bool = False,
+        logdir_suffix: str = "profiler",
+        sort_by: str = "self_cpu_time_total",
+        row_limit: int = 50,
+        **profiler_kwargs,
+    ):
+        """
+
+        Args:
+            wait: idle steps in the beginning of every cycle
+            warmup: steps profiler is running, but results are discarded
+            active: recorded steps
+            repeat: number of cycles, 0 means repeat until training end
+            skip_first: steps skipped before the first cycle
+            step_on: "batch" (train batches) or "epoch"
+            all_ranks: profile on all ranks. Only rank 0 is profiled by default
+            logdir_suffix: output dir relative to `loop.logdir`
+            sort_by: key averages table sorting key
+            row_limit: key averages table row limit
+            **profiler_kwargs: passed to `torch.profiler.profile`,
+                eg `record_shapes`, `profile_memory`, `with_stack`
+        """
+        assert step_on in ("batch", "epoch"), f"Unknown step_on value {step_on}"
+
+        self.schedule = schedule(
+            wait=wait, warmup=warmup, active=active, repeat=repeat, skip_first=skip_first
+        )
+        self.step_on = step_on
+        self.all_ranks = all_ranks
+        self.logdir_suffix = logdir_suffix
+        self.sort_by = sort_by
+        self.row_limit = row_limit
+        self.profiler_kwargs = profiler_kwargs
+
+        self.profiler: Optional[profile] = None
+        self._output_dir: Optional[Path] = None
+        self._loop: Optional["Loop"] = None
+
+    def _trace_ready(self, prof: profile):
+        rank = get_rank()
+        name = f"rank{rank}_step{prof.step_num}"
+        prof.export_chrome_trace(str(self._output_dir / f"trace_{name}.json"))
+        table = prof.key_averages().table(sort_by=self.sort_by, row_limit=self.row_limit)
+        (self._output_dir / f"key_averages_{name}.txt").write_text(table)
+        LOG.info("Profiler trace saved to %s", self._output_dir)
+
+    def _update_recording(self, loop: "Loop"):
+        loop.record_phases = self.profiler.current_action in _RECORDING_ACTIONS
+
+    def _step(self, loop: "Loop"):
+        if self.profiler is None:
+            return
+        self.profiler.step()
+        self._update_recording(loop)
+
+    def on_train_start(self, loop: "Loop"):
+        if not self.all_ranks and get_rank() != 0:
+            return
+
+        self._output_dir = loop.logdir / self.logdir_suffix
+        self._output_dir.mkdir(parents=True, exist_ok=True)
+        self.profiler = profile(
+            schedule=self.schedule,
+            on_trace_ready=self._trace_ready,
+            **self.profiler_kwargs,
+        )
+        self._loop = loop
+        self.profiler.start()
+        self._update_recording(loop)
+
+    def on_iteration_end(self, loop: "Loop", batch_no: int):
+        if self.step_on == "batch" and loop._mode == "train":
+            self._step(loop)
+
+    def on_epoch_end(self, loop: "Loop", epoch_no: int, total_epochs: int):
+        if self.step_on == "epoch":
+            self._step(loop)
+
+    def on_train_end(self, loop: "Loop"):
+        self.drain()
+
+    def drain(self):
+        """Stop profiler if it's running"""
+        if self.profiler is None:
+            return
+        profiler, self.profiler = self.profiler, None
+        self._loop.record_phases = False
+        self._loop = None
+        profiler.stop()
@@ -0,0 +1,4 @@
+from .cache import CachedDataset
+from .memmap import MemmapCachedDataset
+from .shared import NodeSharedDataset
+from .sampler import BucketBatchSampler
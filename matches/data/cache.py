@@ -0,0 +1,335 @@
+import multiprocessing
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+if TYPE_CHECKING:
+    from matches.loop import Loop
+
+# Python scalars are stored as 0-dim tensors of these types
+_SCALAR_DTYPES = {bool: torch.bool, int: torch.int64, float: torch.float64}
+# Leaves are stored at aligned offsets to be viewed with their dtype
+_ALIGNMENT = 16
+
+
+def _aligned(nbytes: int) -> int:
+    return -(-nbytes // _ALIGNMENT) * _ALIGNMENT
+
+
+class _Leaf:
+    """Placeholder of sample leaf in structure template"""
+
+    def __init__(self, kind: str, dtype: torch.dtype, shape: Tuple[int, ...]):
+        self.kind = kind
+        self.dtype = dtype
+        self.shape = shape
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64)) * self.dtype.itemsize
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, _Leaf)
+            and self.kind == other.kind
+            and self.dtype == other.dtype
+            and self.shape == other.shape
+        )
+
+
+def _as_tensor(value) -> Tuple[str, torch.Tensor]:
+    if isinstance(value, torch.Tensor):
+        return "tensor", value
+    if isinstance(value, np.ndarray):
+        return "ndarray", torch.from_numpy(value)
+    if type(value) in _SCALAR_DTYPES:
+        kind = type(value).__name__
+        return kind, torch.tensor(value, dtype=_SCALAR_DTYPES[type(value)])
+    raise TypeError(f"Can't cache sample leaf of type {type(value)}")
+
+
+def flatten_sample(sample) -> Tuple[Any, List[torch.Tensor]]:
+    """Split sample into structure template and list of tensors
+
+    Samples can be (nested) tuples, lists and dicts of tensors, numpy arrays
+    and python scalars.
+    """
+    tensors = []
+
+    def _flatten(value):
+        if isinstance(value, dict):
+            return {k: _flatten(v) for k, v in value.items()}
+        if isinstance(value, (tuple, list)):
+            return type(value)(_flatten(v) for v in value)
+        kind, tensor = _as_tensor(value)
+        tensors.append(tensor)
+        return _Leaf(kind, tensor.dtype, tuple(tensor.shape))
+
+    return _flatten(sample), tensors
+
+
+def unflatten_sample(template, tensors: List[torch.Tensor]):
+    """Inverse of :func:`flatten_sample`"""
+    tensors = iter(tensors)
+
+    def _unflatten(value):
+        if isinstance(value, dict):
+            return {k: _unflatten(v) for k, v in value.items()}
+        if isinstance(value, (tuple, list)):
+            return type(value)(_unflatten(v) for v in value)
+        tensor = next(tensors)
+        if value.kind == "tensor":
+            return tensor
+        if value.kind == "ndarray":
+            return tensor.numpy()
+        return tensor.item()
+
+    return _unflatten(template)
+
+
+def _leaves(template) -> List[_Leaf]:
+    if isinstance(template, dict):
+        template = list(template.values())
+    if isinstance(template, (tuple, list)):
+        return [leaf for value in template for leaf in _leaves(value)]
+    return [template]
+
+
+class SampleLayout:
+    """
+    Layout of fixed-structure samples packed into flat byte buffers
+
+    Leaves are placed at aligned offsets, so unpacked tensors are views
+    of the buffer.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.leaves = _leaves(template)
+        self.offsets = []
+        self.nbytes = 0
+        for leaf in self.leaves:
+            self.offsets.append(self.nbytes)
+            self.nbytes += _aligned(leaf.nbytes)
+        self.nbytes = max(self.nbytes, 1)
+
+    @classmethod
+    def of(cls, sample) -> "SampleLayout":
+        template, _ = flatten_sample(sample)
+        return cls(template)
+
+    def pack(
+        self, sample, out: Optional[torch.Tensor] = None
+    ) -> Optional[torch.Tensor]:
+        """Pack sample into uint8 tensor (or `out`)
+
+        Returns:
+            Packed sample or `None` if sample doesn't match layout
+        """
+        try:
+            template, tensors = flatten_sample(sample)
+        except TypeError:
+            return None
+        if template != self.template:
+            return None
+
+        if out is None:
+            out = torch.zeros(self.nbytes, dtype=torch.uint8)
+        for tensor, offset in zip(tensors, self.offsets):
+            data = tensor.detach().cpu().contiguous().view(-1).view(torch.uint8)
+            out[offset : offset + data.numel()] = data
+        return out
+
+    def unpack(self, buffer: torch.Tensor):
+        """Sample with tensors viewing `buffer`"""
+        tensors = [
+            buffer[offset : offset + leaf.nbytes].view(leaf.dtype).view(leaf.shape)
+            for leaf, offset in zip(self.leaves, self.offsets)
+        ]
+        return unflatten_sample(self.template, tensors)
+
+    def to_json(self):
+        def _to_json(value):
+            if isinstance(value, dict):
+                return {"dict": {k: _to_json(v) for k, v in value.items()}}
+            if isinstance(value, (tuple, list)):
+                return {type(value).__name__: [_to_json(v) for v in value]}
+            return {"leaf": [value.kind, str(value.dtype), list(value.shape)]}
+
+        return _to_json(self.template)
+
+    @classmethod
+    def from_json(cls, data) -> "SampleLayout":
+        def _from_json(value):
+            [(kind, content)] = value.items()
+            if kind == "dict":
+                return {k: _from_json(v) for k, v in content.items()}
+            if kind in ("tuple", "list"):
+                return {"tuple": tuple, "list": list}[kind](map(_from_json, content))
+            leaf_kind, dtype, shape = content
+            dtype = getattr(torch, dtype[len("torch.") :])
+            return _Leaf(leaf_kind, dtype, tuple(shape))
+
+        return cls(_from_json(data))
+
+
+class CachedDataset(Dataset):
+    """
+    Dataset wrapper caching samples in shared memory with CLOCK eviction
+
+    Wrapped dataset should return samples after deterministic preprocessing
+    (decoding, resizing, normalization). Random augmentations go to `transform`,
+    which is applied on every access after the cache.
+
+    Cache storage is allocated in shared memory when wrapper is created, so all
+    DataLoader workers (and main process) use the same cache: sample decoded by
+    one worker is a hit for others in the next epochs. Storage is split into
+    equal slots sized by the first sample, samples with different structure or
+    shapes bypass the cache. When cache is full, CLOCK (second chance)
+    approximation of LRU chooses evicted sample in amortized constant time.
+
+    Storage of ``min(len(dataset), max_bytes // slot_bytes)`` slots is committed
+    in `/dev/shm` right away, so `/dev/shm` must be large enough to hold it
+    (Docker limits it to 64MB by default, use ``--shm-size`` or ``--ipc=host``).
+
+    Examples::
+
+        dataset = CIFAR10(root, transform=Compose([ToTensor(), Normalize(mean, std)]))
+        dataset = CachedDataset(
+            dataset,
+            max_bytes=2 * 1024**3,
+            transform=lambda sample: (augment(sample[0]), sample[1]),
+        )
+        ...
+        for _ in loop.iterate_epochs(epochs):
+            for batch in loop.iterate_dataloader(DataLoader(dataset, num_workers=4)):
+                ...
+            dataset.log_metrics(loop)
+    """
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        max_bytes: int,
+        transform: Optional[Callable[[Any], Any]] = None,
+    ):
+        """
+
+        Args:
+            dataset: map-style dataset returning deterministic samples
+            max_bytes: memory budget of the cache
+            transform: random transform applied to samples after the cache
+        """
+        self.dataset = dataset
+        self.transform = transform
+
+        self._layout = SampleLayout.of(dataset[0])
+        self.slot_bytes = self._layout.nbytes
+        self.num_slots = min(len(dataset), max_bytes // self.slot_bytes)
+        assert self.num_slots > 0, "Memory budget is less than a single sample"
+
+        # share_memory_() moves storage to /dev/shm and commits all of it
+        self._data = torch.empty((self.num_slots, self.slot_bytes), dtype=torch.uint8)
+        self._slot_of = torch.full((len(dataset),), -1, dtype=torch.int64)
+        self._index_of = torch.full((self.num_slots,), -1, dtype=torch.int64)
+        # Slot was hit since clock hand passed it
+        self._referenced = torch.zeros(self.num_slots, dtype=torch.bool)
+        # clock hand, used slots, hits, misses
+        self._counters = torch.zeros(4, dtype=torch.int64)
+        for tensor in (
+            self._data,
+            self._slot_of,
+            self._index_of,
+            self._referenced,
+            self._counters,
+        ):
+            tensor.share_memory_()
+        self._lock = multiprocessing.Lock()
+
+    def __len__(self):
+        return len(self.dataset)
+
+    @property
+    def hits(self) -> int:
+        return int(self._counters[2])
+
+    @property
+    def misses(self) -> int:
+        return int(self._counters[3])
+
+    @property
+    def cached_samples(self) -> int:
+        return int(self._counters[1])
+
+    def _lookup(self, index: int) -> Optional[torch.Tensor]:
+        with self._lock:
+            slot = int(self._slot_of[index])
+            if slot < 0:
+                self._counters[3] += 1
+                return None
+            self._counters[2] += 1
+            self._referenced[slot] = True
+            # Copy, so slot can be reused by other process after lock release
+            return self._data[slot].clone()
+
+    def _store(self, index: int, packed: torch.Tensor):
+        with self._lock:
+            if self._slot_of[index] >= 0:
+                # Stored by other worker meanwhile
+                return
+            if self._counters[1] < self.num_slots:
+                slot = int(self._counters[1])
+                self._counters[1] += 1
+            else:
+                slot = self._evict()
+
+            self._data[slot].copy_(packed)
+            self._referenced[slot] = False
+            self._slot_of[index] = slot
+            self._index_of[slot] = index
+
+    def _evict(self) -> int:
+        """Advance clock hand to the first slot not hit since the last pass, free it"""
+        hand = int(self._counters[0])
+        while self._referenced[hand]:
+            self._referenced[hand] = False
+            hand = (hand + 1) % self.num_slots
+        self._counters[0] = (hand + 1) % self.num_slots
+        self._slot_of[self._index_of[hand]] = -1
+        return hand
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self)
+
+        buffer = self._lookup(index)
+        if buffer is not None:
+            sample = self._layout.unpack(buffer)
+        else:
+            sample = self.dataset[index]
+            packed = self._layout.pack(sample)
+            if packed is not None:
+                self._store(index, packed)
+
+        if self.transform is not None:
+            sample = self.transform(sample)
+        return sample
+
+    def log_metrics(self, loop: "Loop", prefix: str = "data/cache", reset: bool = True):
+        """Log hit rate and number of cached samples to `loop.metrics`
+
+        Args:
+            loop: loop to log metrics to
+            prefix: metric names prefix
+            reset: reset hit/miss counters after logging
+        """
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            if reset:
+                self._counters[2:] = 0
+
+        if hits + misses > 0:
+            loop.metrics.log(f"{prefix}/hit_rate", hits / (hits + misses))
+        loop.metrics.log(f"{prefix}/cached_samples", self.cached_samples)
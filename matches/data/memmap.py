@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+
+import ignite.distributed as idist
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from .cache import SampleLayout
+
+LOG = logging.getLogger(__name__)
+
+_FORMAT_VERSION = 1
+
+
+def content_key(config: Any) -> str:
+    """Stable hash of JSON-serializable preprocessing config"""
+    dumped = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(dumped.encode()).hexdigest()
+
+
+class MemmapCachedDataset(Dataset):
+    """
+    Dataset wrapper caching samples in memory-mapped files on disk
+
+    During the first epoch samples of wrapped dataset are written into sharded
+    flat binary files. After that samples are read from memory-mapped files
+    without copying and without accessing wrapped dataset, so DataLoader workers
+    do almost no CPU work. Unlike :obj:`CachedDataset` cache may be larger than RAM
+    and survives between runs.
+
+    All samples must have the same structure and shapes (eg resized images).
+    Random augmentations go to `transform`, which is applied after the cache.
+
+    Cache directory layout::
+
+        cache_dir/
+            meta.json            # content key, length, sample layout
+            written.npy          # per-sample flags of written samples
+            shard_00000.bin      # samples [0, shard_size)
+            shard_00001.bin      # samples [shard_size, 2 * shard_size)
+            ...
+
+    Cache is rebuilt if `key` (eg preprocessing config) or dataset length changes.
+
+    Examples::
+
+        dataset = MemmapCachedDataset(
+            CIFAR10(root, transform=test_transform),
+            cache_dir=logdir / "cache" / "cifar_train",
+            key={"normalize": [mean, std]},
+            transform=lambda sample: (augment(sample[0]), sample[1]),
+        )
+    """
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        cache_dir: Union[str, Path],
+        key: Any = None,
+        transform: Optional[Callable[[Any], Any]] = None,
+        shard_size: int = 8192,
+    ):
+        """
+
+        Args:
+            dataset: map-style dataset returning deterministic fixed-shape samples
+            cache_dir: cache directory. In distributed mode it's created by local
+                rank 0, so it must be node-local or unique per node
+            key: JSON-serializable description of `dataset` preprocessing,
+                cache is invalidated when it changes
+            transform: random transform applied to samples after the cache
+            shard_size: number of samples in single cache file
+        """
+        self.dataset = dataset
+        self.cache_dir = Path(cache_dir)
+        self.transform = transform
+        self.key = content_key(key)
+
+        if idist.get_local_rank() == 0:
+            self._prepare(shard_size)
+        if idist.get_world_size() > 1:
+            idist.barrier()
+
+        with open(self.cache_dir / "meta.json") as f:
+            meta = json.load(f)
+        self.shard_size = meta["shard_size"]
+        self._layout = SampleLayout.from_json(meta["layout"])
+
+        # Memory maps are opened lazily in every process (eg DataLoader worker)
+        self._written: Optional[np.ndarray] = None
+        self._read_shards: Dict[int, np.ndarray] = {}
+        self._write_shards: Dict[int, np.ndarray] = {}
+
+    def _prepare(self, shard_size: int):
+        meta_path = self.cache_dir / "meta.json"
+        if meta_path.exists():
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if (
+                meta["version"] == _FORMAT_VERSION
+                and meta["key"] == self.key
+                and meta["length"] == len(self.dataset)
+            ):
+                return
+            LOG.info("Sample cache %s is outdated, rebuilding", self.cache_dir)
+            meta_path.unlink()
+            for path in self.cache_dir.glob("shard_*.bin"):
+                path.unlink()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        layout = SampleLayout.of(self.dataset[0])
+        length = len(self.dataset)
+
+        # Files are sparse until samples are written
+        np.lib.format.open_memmap(
+            self.cache_dir / "written.npy", mode="w+", dtype=np.uint8, shape=(length,)
+        ).flush()
+        for shard in range(-(-length // shard_size)):
+            samples = min(shard_size, length - shard * shard_size)
+            with open(self._shard_path(shard), "wb") as f:
+                f.truncate(samples * layout.nbytes)
+
+        # Written last, cache without meta is rebuilt
+        meta = {
+            "version": _FORMAT_VERSION,
+            "key": self.key,
+            "length": length,
+            "shard_size": shard_size,
+            "layout": layout.to_json(),
+        }
+        with open(meta_path, "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def _shard_path(self, shard: int) -> Path:
+        return self.cache_dir / f"shard_{shard:05d}.bin"
+
+    def _shard(self, shard: int, write: bool) -> np.ndarray:
+        shards = self._write_shards if write else self._read_shards
+        if shard not in shards:
+            path = self._shard_path(shard)
+            # Copy-on-write mapping for reading: in-place transforms
+            # of returned tensors don't modify the cache
+            shards[shard] = np.memmap(
+                path, dtype=np.uint8, mode="r+" if write else "c"
+            ).reshape(-1, self._layout.nbytes)
+        return shards[shard]
+
+    @property
+    def written(self) -> np.ndarray:
+        if self._written is None:
+            self._written = np.load(self.cache_dir / "written.npy", mmap_mode="r+")
+        return self._written
+
+    @property
+    def complete(self) -> bool:
+        """Whether all samples are cached"""
+        return bool(self.written.all())
+
+    def __len__(self):
+        return len(self.written)
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self)
+        shard, row = divmod(index, self.shard_size)
+
+        if self.written[index]:
+            buffer = torch.from_numpy(self._shard(shard, write=False)[row])
+            sample = self._layout.unpack(buffer)
+        else:
+            sample = self.dataset[index]
+            out = torch.from_numpy(self._shard(shard, write=True)[row])
+            if self._layout.pack(sample, out=out) is None:
+                raise ValueError(
+                    f"Sample {index} has structure or shapes different from sample 0"
+                )
+            self.written[index] = 1
+
+        if self.transform is not None:
+            sample = self.transform(sample)
+        return sample
+
+    def __getstate__(self):
+        # Memory maps are reopened after pickling to DataLoader workers
+        state = self.__dict__.copy()
+        state.update(_written=None, _read_shards={}, _write_shards={})
+        return state
+
+    def flush(self):
+        """Flush written samples to disk"""
+        for shard in self._write_shards.values():
+            shard.flush()
+        if self._written is not None:
+            self._written.flush()
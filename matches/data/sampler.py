@@ -0,0 +1,181 @@
+from typing import TYPE_CHECKING, Iterator, List, Optional, Sequence
+
+import ignite.distributed as idist
+import torch
+from torch.utils.data import Sampler
+
+if TYPE_CHECKING:
+    from matches.loop import Loop
+
+
+class BucketBatchSampler(Sampler[List[int]]):
+    """
+    Batch sampler grouping samples of similar length to reduce padding
+
+    Every epoch samples are sorted by length (ties are broken randomly) and split
+    into `num_buckets` buckets of consecutive lengths. Samples are shuffled within
+    buckets, batched, and batches are shuffled across buckets. Order depends
+    only on `seed` and epoch set by :meth:`set_epoch`, so it's reproducible and
+    the same on all processes.
+
+    Batches are either of fixed `batch_size` or limited by `max_tokens`: number of
+    tokens in padded batch (`len(batch) * max(lengths)`).
+
+    In distributed run batches are sharded between processes like
+    `DistributedSampler` does: every process gets the same number of batches.
+
+    Padding ratio of yielded batches is logged by :meth:`log_metrics`.
+
+    Examples::
+
+        sampler = BucketBatchSampler(lengths, max_tokens=16384)
+        loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=pad_collate)
+
+        for epoch in loop.iterate_epochs(epochs):
+            sampler.set_epoch(epoch)
+            for batch in loop.iterate_dataloader(loader, mode="train"):
+                ...
+            sampler.log_metrics(loop)
+    """
+
+    def __init__(
+        self,
+        lengths: Sequence[int],
+        batch_size: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        num_buckets: int = 10,
+        shuffle: bool = True,
+        drop_last: bool = False,
+        seed: int = 0,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+    ):
+        """
+
+        Args:
+            lengths: length of every sample of the dataset
+            batch_size: number of samples in batch (maximum, if `max_tokens` is set)
+            max_tokens: maximum number of tokens in padded batch
+            num_buckets: number of buckets
+            shuffle: shuffle samples and batches. If `False` batches go in order
+                of increasing length
+            drop_last: drop incomplete last batch of every bucket (fixed size
+                batches) and batches not divisible between processes
+            seed: random seed, must be the same on all processes
+            num_replicas: number of processes, world size by default
+            rank: rank of current process, global rank by default
+        """
+        assert (
+            batch_size is not None or max_tokens is not None
+        ), "Set batch_size or max_tokens"
+        assert num_buckets > 0, "num_buckets must be positive"
+
+        self.lengths = torch.as_tensor(lengths, dtype=torch.int64)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.num_buckets = num_buckets
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.num_replicas = (
+            idist.get_world_size() if num_replicas is None else num_replicas
+        )
+        self.rank = idist.get_rank() if rank is None else rank
+        self.epoch = 0
+
+        self._batches_epoch: Optional[int] = None
+        self._batches: List[List[int]] = []
+        self._tokens = 0
+        self._padded_tokens = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _split(self, indices: torch.Tensor) -> List[List[int]]:
+        if self.max_tokens is None:
+            batches = list(torch.split(indices, self.batch_size))
+            if self.drop_last and len(batches[-1]) < self.batch_size:
+                batches = batches[:-1]
+            return [batch.tolist() for batch in batches]
+
+        batches = []
+        batch: List[int] = []
+        longest = 0
+        for index, length in zip(indices.tolist(), self.lengths[indices].tolist()):
+            new_longest = max(longest, length)
+            too_long = (len(batch) + 1) * new_longest > self.max_tokens
+            too_many = self.batch_size is not None and len(batch) == self.batch_size
+            if batch and (too_long or too_many):
+                batches.append(batch)
+                batch, new_longest = [], length
+            batch.append(index)
+            longest = new_longest
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _all_batches(self) -> List[List[int]]:
+        """Batches of all processes for current epoch"""
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        if self.shuffle:
+            order = torch.randperm(len(self.lengths), generator=generator)
+        else:
+            order = torch.arange(len(self.lengths))
+        order = order[torch.sort(self.lengths[order], stable=True).indices]
+
+        batches = []
+        for bucket in torch.tensor_split(order, self.num_buckets):
+            if len(bucket) == 0:
+                continue
+            if self.shuffle:
+                bucket = bucket[torch.randperm(len(bucket), generator=generator)]
+            batches.extend(self._split(bucket))
+
+        if self.shuffle:
+            permutation = torch.randperm(len(batches), generator=generator).tolist()
+            batches = [batches[i] for i in permutation]
+        return batches
+
+    def _replica_batches(self) -> List[List[int]]:
+        if self._batches_epoch != self.epoch:
+            batches = self._all_batches()
+            if len(batches) % self.num_replicas != 0:
+                if self.drop_last:
+                    batches = batches[: len(batches) - len(batches) % self.num_replicas]
+                else:
+                    padding = self.num_replicas - len(batches) % self.num_replicas
+                    batches += (batches * padding)[:padding]
+            self._batches = batches[self.rank :: self.num_replicas]
+            self._batches_epoch = self.epoch
+        return self._batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        for batch in self._replica_batches():
+            lengths = self.lengths[batch]
+            self._tokens += int(lengths.sum())
+            self._padded_tokens += int(lengths.max()) * len(batch)
+            yield batch
+
+    def __len__(self):
+        return len(self._replica_batches())
+
+    @property
+    def padding_ratio(self) -> Optional[float]:
+        """Share of padding tokens in batches yielded since last :meth:`log_metrics`"""
+        if self._padded_tokens == 0:
+            return None
+        return 1 - self._tokens / self._padded_tokens
+
+    def log_metrics(self, loop: "Loop", prefix: str = "data/bucketing"):
+        """Log padding ratio (over all processes) and reset it
+
+        Must be called on all processes in distributed run.
+        """
+        tokens = torch.tensor([self._tokens, self._padded_tokens], dtype=torch.float64)
+        if idist.get_world_size() > 1:
+            tokens = idist.all_reduce(tokens)
+        self._tokens = self._padded_tokens = 0
+
+        if tokens[1] > 0:
+            padding_ratio = float(1 - tokens[0] / tokens[1])
+            loop.metrics.log(f"{prefix}/padding_ratio", padding_ratio)
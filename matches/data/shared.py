@@ -0,0 +1,150 @@
+import atexit
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Union
+
+import ignite.distributed as idist
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from .cache import SampleLayout
+
+LOG = logging.getLogger(__name__)
+
+# Data starts at page boundary after JSON header
+_HEADER_BYTES = 4096
+
+
+class NodeSharedDataset(Dataset):
+    """
+    Dataset materialized once per node in POSIX shared memory
+
+    In distributed run local rank 0 loads all samples of wrapped dataset into
+    shared memory file, other ranks of the node attach to it after barrier.
+    Every rank and DataLoader worker then reads the same physical memory instead
+    of holding its own copy of the dataset.
+
+    All samples must have the same structure and shapes. Returned samples are
+    copies, so in-place transforms are safe. Apply random augmentations after
+    this wrapper (eg with `transform`).
+
+    Shared memory file is removed at exit of the process which created it.
+
+    Examples::
+
+        train_ds = NodeSharedDataset(
+            TensorDataset(images, labels), name="cifar_train", transform=augment
+        )
+    """
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        name: str,
+        transform=None,
+        shm_dir: Union[str, Path] = "/dev/shm",
+    ):
+        """
+
+        Args:
+            dataset: map-style dataset with deterministic fixed-shape samples.
+                It's accessed only on local rank 0
+            name: name of shared memory file, must be the same on all ranks
+                and unique among concurrent runs on the node
+            transform: transform applied to samples read from shared memory
+            shm_dir: directory of shared memory files
+        """
+        self.path = Path(shm_dir) / f"matches_{name}"
+        self.transform = transform
+
+        if idist.get_local_rank() == 0:
+            self._materialize(dataset)
+        if idist.get_world_size() > 1:
+            idist.barrier()
+        self._open()
+
+    def _materialize(self, dataset: Dataset):
+        layout = SampleLayout.of(dataset[0])
+        header = json.dumps({"length": len(dataset), "layout": layout.to_json()})
+        header = header.encode()
+        assert len(header) <= _HEADER_BYTES - 8, "Sample structure is too complex"
+
+        # Written under temporary name, so partially written file is never attached
+        tmp_path = self.path.with_name(self.path.name + f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            f.truncate(_HEADER_BYTES + len(dataset) * layout.nbytes)
+
+        if len(dataset) > 0:
+            data = np.memmap(
+                tmp_path,
+                dtype=np.uint8,
+                mode="r+",
+                offset=_HEADER_BYTES,
+                shape=(len(dataset), layout.nbytes),
+            )
+            for index in range(len(dataset)):
+                out = torch.from_numpy(data[index])
+                if layout.pack(dataset[index], out=out) is None:
+                    raise ValueError(
+                        f"Sample {index} structure or shapes differ from sample 0"
+                    )
+            data.flush()
+            del data
+
+        os.replace(tmp_path, self.path)
+        atexit.register(self.unlink)
+        LOG.info(
+            "Dataset of %d samples materialized in %s (%.1f MiB)",
+            len(dataset),
+            self.path,
+            len(dataset) * layout.nbytes / 2**20,
+        )
+
+    def _open(self):
+        with open(self.path, "rb") as f:
+            header_len = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_len))
+
+        self._length = header["length"]
+        self._layout = SampleLayout.from_json(header["layout"])
+        self._data = None
+        if self._length > 0:
+            self._data = np.memmap(
+                self.path,
+                dtype=np.uint8,
+                mode="r",
+                offset=_HEADER_BYTES,
+                shape=(self._length, self._layout.nbytes),
+            )
+
+    def unlink(self):
+        """Remove shared memory file. Already attached processes keep access"""
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index: int):
+        buffer = torch.from_numpy(self._data[index].copy())
+        sample = self._layout.unpack(buffer)
+        if self.transform is not None:
+            sample = self.transform(sample)
+        return sample
+
+    def __getstate__(self):
+        # Spawned DataLoader workers reattach instead of receiving a copy of data
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
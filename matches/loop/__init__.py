@@ -1,2 +1,5 @@
 from .loop import Loop
 from .iteration import IterationType
+from .timing import StepTimer
+from .loader_scheduling import InterleavedLoader, ResumableLoader
+from .worker_tuner import WorkerTuner
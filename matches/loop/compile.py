@@ -0,0 +1,90 @@
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Optional
+
+import torch
+from torch import nn
+
+if TYPE_CHECKING:
+    from matches.loop import Loop
+
+LOG = logging.getLogger(__name__)
+
+
+def _compiled_graphs_count() -> int:
+    try:
+        from torch._dynamo.utils import counters
+    except ImportError:
+        return 0
+    return counters["stats"]["unique_graphs"]
+
+
+class CompiledModule:
+    """
+    Callable running `torch.compile`-d version of module and measuring compilation cost
+
+    Original module is kept untouched, so it's still used for `state_dict()` and
+    train/eval mode switching. Attribute access is forwarded to original module.
+
+    Logs following metrics with `loop.metrics`:
+
+    * `compile/<name>/compile_time` -- duration of the first call (compilation included)
+    * `compile/<name>/recompilations` -- number of recompilations, logged on every
+      recompilation (eg when last batch is shorter)
+    * `compile/<name>/call_time` -- mean duration of calls without compilation,
+      logged at the end of every train dataloader pass
+
+    Note:
+        Durations are measured on host without device synchronization.
+    """
+
+    def __init__(self, loop: "Loop", module: nn.Module, name: str, **compile_kwargs):
+        self.module = module
+        self.name = name
+        self._loop = loop
+        self._compiled = torch.compile(module, **compile_kwargs)
+
+        self.compile_time: Optional[float] = None
+        self.recompilations = 0
+        self._calls = 0
+        self._calls_time = 0.0
+
+    def __call__(self, *args, **kwargs) -> Any:
+        graphs_before = _compiled_graphs_count()
+        start = time.perf_counter()
+        result = self._compiled(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        compiled = _compiled_graphs_count() > graphs_before
+
+        if self.compile_time is None:
+            self.compile_time = elapsed
+            LOG.info("Module %s compiled in %.2f s", self.name, elapsed)
+            self._loop.metrics.log(f"compile/{self.name}/compile_time", elapsed)
+        elif compiled:
+            self.recompilations += 1
+            LOG.info("Module %s recompiled in %.2f s", self.name, elapsed)
+            self._loop.metrics.log(
+                f"compile/{self.name}/recompilations", self.recompilations
+            )
+        else:
+            self._calls += 1
+            self._calls_time += elapsed
+
+        return result
+
+    @property
+    def mean_call_time(self) -> Optional[float]:
+        """Mean duration of calls without compilation since last :meth:`log_call_time`"""
+        if self._calls == 0:
+            return None
+        return self._calls_time / self._calls
+
+    def log_call_time(self):
+        mean_call_time = self.mean_call_time
+        if mean_call_time is not None:
+            self._loop.metrics.log(f"compile/{self.name}/call_time", mean_call_time)
+        self._calls = 0
+        self._calls_time = 0.0
+
+    def __getattr__(self, item):
+        return getattr(self.module, item)
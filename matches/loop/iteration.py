@@ -65,8 +65,23 @@ class IterationCounter:
 
     @property
     def current_samples(self) -> _ManagedInt:
+        """Train samples processed by current process"""
         return self[IterationType.SAMPLES]
 
     @property
     def global_steps(self) -> _ManagedInt:
         return self[IterationType.GLOBAL_STEPS]
+
+    @property
+    def global_epochs(self) -> _ManagedInt:
+        return self[IterationType.GLOBAL_EPOCHS]
+
+    @property
+    def global_batches(self) -> _ManagedInt:
+        """Train batches processed by all processes"""
+        return self[IterationType.GLOBAL_BATCHES]
+
+    @property
+    def global_samples(self) -> _ManagedInt:
+        """Train samples processed by all processes"""
+        return self[IterationType.GLOBAL_SAMPLES]
@@ -1,21 +1,226 @@
-from copy import deepcopy
+import inspect
+import logging
+import random
+import time
 from itertools import islice
-from typing import Generic, Iterable, TypeVar, Union
-
-from torch.utils.data import DataLoader
+from typing import (
+    Any,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import ignite.distributed as idist
+import torch
+from ignite.utils import apply_to_tensor, convert_tensor
+from torch.utils.data import DataLoader, IterableDataset, Sampler
 
 T_co = TypeVar("T_co", covariant=True)
 
+LOG = logging.getLogger(__name__)
+
+_NO_BATCH = object()
+
+# DataLoader arguments defining how batches are formed
+_BATCHING_ARGS = ("batch_size", "shuffle", "sampler", "batch_sampler", "drop_last")
+
+
+def is_clonable(loader) -> bool:
+    """Whether :func:`clone_dataloader` can recreate `loader`
+
+    DataLoader subclasses are clonable only if they don't override `__init__`,
+    otherwise their constructor arguments are unknown.
+    """
+    return (
+        isinstance(loader, DataLoader)
+        and type(loader).__init__ is DataLoader.__init__
+    )
+
+
+def clone_dataloader(loader: DataLoader, **overrides) -> DataLoader:
+    """Create new DataLoader of the same class with the same settings as `loader`
+
+    Args:
+        loader: dataloader to clone
+        **overrides: DataLoader arguments to replace. If none of batching arguments
+            (batch_size, shuffle, sampler, batch_sampler, drop_last) is overridden,
+            batch_sampler of `loader` is reused
+
+    Returns:
+        New DataLoader
+
+    Raises:
+        TypeError: if loader is not clonable, see :func:`is_clonable`
+    """
+    if not is_clonable(loader):
+        raise TypeError(
+            f"Can't clone {type(loader).__name__}, it overrides DataLoader.__init__"
+        )
+    params = [
+        name
+        for name in inspect.signature(DataLoader.__init__).parameters
+        if name != "self" and name not in _BATCHING_ARGS
+    ]
+    kwargs = {name: getattr(loader, name) for name in params if hasattr(loader, name)}
+    if not any(name in overrides for name in _BATCHING_ARGS):
+        if loader.batch_sampler is not None:
+            kwargs["batch_sampler"] = loader.batch_sampler
+        else:
+            kwargs["batch_size"] = None
+            kwargs["sampler"] = loader.sampler
+    kwargs.update(overrides)
+
+    if kwargs.get("num_workers", 0) == 0:
+        kwargs.pop("prefetch_factor", None)
+        kwargs["persistent_workers"] = False
+
+    return type(loader)(**kwargs)
+
+
+class ResumableBatchSampler(Sampler[List[int]]):
+    """
+    Batch sampler wrapper which can restart pass from arbitrary batch
+
+    Random state of the wrapped sampler (`sampler.generator`, eg in `RandomSampler`)
+    is captured at the beginning of every pass. On resume it's restored, so the same
+    permutation is generated, and skipped batches are dropped on index level,
+    without loading samples. After the pass (see :meth:`end_pass`) state of the
+    next pass is saved, so resume from the end of epoch starts a new permutation.
+
+    Note:
+        Sampler gets its own generator (seeded from the original one), because
+        DataLoader draws worker seeds from the same generator between
+        start of the pass and the first sampled index.
+    """
+
+    def __init__(self, batch_sampler: Iterable[List[int]]):
+        self.batch_sampler = batch_sampler
+        self._generator: Optional[torch.Generator] = None
+        self._pass_state: Optional[torch.Tensor] = None
+        self._resume_state: Optional[torch.Tensor] = None
+        self._skip = 0
+
+    def _sampler_generator(self) -> Optional[torch.Generator]:
+        sampler = getattr(self.batch_sampler, "sampler", None)
+        if sampler is None or not hasattr(sampler, "generator"):
+            return None
+        if self._generator is None or sampler.generator is not self._generator:
+            seed = torch.empty((), dtype=torch.int64)
+            seed.random_(generator=sampler.generator)
+            self._generator = torch.Generator().manual_seed(int(seed.item()))
+            sampler.generator = self._generator
+        return self._generator
+
+    def __iter__(self) -> Iterator[List[int]]:
+        # Generator function: state is applied on the first requested batch, as
+        # DataLoader iterators may create and drop sampler iterators before that
+        generator = self._sampler_generator()
+        if generator is not None:
+            if self._resume_state is not None:
+                generator.set_state(self._resume_state)
+            self._pass_state = generator.get_state()
+        self._resume_state = None
+
+        skip, self._skip = self._skip, 0
+        yield from islice(iter(self.batch_sampler), skip, None)
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+    def state_dict(self) -> Dict[str, Any]:
+        """Random state at the beginning of the current (or resumed) pass"""
+        if self._resume_state is not None:
+            return {"pass_state": self._resume_state}
+        return {"pass_state": self._pass_state}
+
+    def end_pass(self):
+        """Make saved state start the next pass instead of replaying finished one.
+        Called by loader after its last batch, as sampler iterator is consumed
+        ahead of batches by prefetching"""
+        if self._generator is not None:
+            self._pass_state = self._generator.get_state()
+
+    def resume(self, state_dict: Dict[str, Any], skip: int):
+        """Make next pass repeat pass from `state_dict` starting from batch `skip`"""
+        self._resume_state = state_dict["pass_state"]
+        self._skip = skip
+
+
+class ResumableLoader(Generic[T_co]):
+    """
+    DataLoader wrapper able to save and restore position inside the pass
+
+    Wrapped dataloader is cloned with :obj:`ResumableBatchSampler`,
+    so only map-style datasets and clonable loaders (see :func:`is_clonable`)
+    are supported. Attach it to loop to have
+    its position saved in checkpoints::
+
+        train_loader = ResumableLoader(train_loader)
+        loop.attach(train_loader=train_loader)
+    """
+
+    def __init__(self, dataloader: DataLoader[T_co]):
+        if isinstance(dataloader.dataset, IterableDataset):
+            raise ValueError("ResumableLoader supports only map-style datasets")
+        if dataloader.batch_sampler is None:
+            raise ValueError("ResumableLoader requires dataloader with batching")
+
+        self.batch_sampler = ResumableBatchSampler(dataloader.batch_sampler)
+        self.dataloader = clone_dataloader(dataloader, batch_sampler=self.batch_sampler)
+        self._position = 0
+        self._init_done = True
+
+    def __iter__(self) -> Iterator[T_co]:
+        try:
+            for batch in self.dataloader:
+                self._position += 1
+                yield batch
+        finally:
+            self._position = 0
+            self.batch_sampler.end_pass()
+
+    def __len__(self):
+        return len(self.dataloader)
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {"position": self._position, "sampler": self.batch_sampler.state_dict()}
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        """Next pass will continue saved pass. Skipped batches are not loaded"""
+        self._position = state_dict["position"]
+        self.batch_sampler.resume(state_dict["sampler"], skip=self._position)
+
+    def __getattr__(self, item):
+        return getattr(self.dataloader, item)
+
+    def __setattr__(self, key, value):
+        if "_init_done" in self.__dict__ and key not in self.__dict__:
+            setattr(self.dataloader, key, value)
+        else:
+            object.__setattr__(self, key, value)
+
 
 class DataloaderSchedulerWrapper(Generic[T_co]):
     """
-    Dataloader wrapper allowing to truncate dataloader and\or run validation
+    Dataloader wrapper allowing to truncate dataloader and/or run validation
     only after multiple full or single partial dataloader pass
 
     For example, with for dataloader with length=10_000
     single_pass_length=0.1 dataloader will return first 1k batches, second 1k batches on second
     pass etc.
     Truncated length allows to use only beginning samples from dataloader
+
+    Underlying loader iterator is kept alive between passes, and multiprocess
+    DataLoader is switched to persistent workers, so partial passes don't
+    restart worker pool. Time to the first batch after worker pool start
+    is stored in `worker_startup_time`.
     """
 
     def __init__(
@@ -24,6 +229,8 @@ class DataloaderSchedulerWrapper(Generic[T_co]):
         *,
         single_pass_length: Union[int, float] = 1.0,
         truncated_length: Union[int, float] = 1.0,
+        resumable: bool = False,
+        persistent_workers: bool = True,
     ):
         """
 
@@ -32,8 +239,28 @@ class DataloaderSchedulerWrapper(Generic[T_co]):
             single_pass_length: Consume only single_pass_length batches in single pass
             truncated_length: Consume only first truncated_length batches
               (or len(dataloader) * truncated_length) if it's float
+            resumable: wrap dataloader in :obj:`ResumableLoader`, so restoring
+              from `state_dict` doesn't load skipped batches
+            persistent_workers: recreate multiprocess DataLoader with
+              `persistent_workers=True` to keep worker pool between loader passes.
+              Loaders which are not clonable (see :func:`is_clonable`) are kept
         """
 
+        if (
+            persistent_workers
+            and isinstance(dataloader, DataLoader)
+            and dataloader.num_workers > 0
+            and not dataloader.persistent_workers
+        ):
+            if is_clonable(dataloader):
+                dataloader = clone_dataloader(dataloader, persistent_workers=True)
+            else:
+                LOG.warning(
+                    "%s can't be recreated with persistent workers, using it as is",
+                    type(dataloader).__name__,
+                )
+        if resumable:
+            dataloader = ResumableLoader(dataloader)
         self.dataloader = dataloader
         if isinstance(truncated_length, float):
             truncated_length = int(truncated_length * len(dataloader))
@@ -52,30 +279,97 @@ class DataloaderSchedulerWrapper(Generic[T_co]):
 
         self._internal_loader_full_passes = 0
         self._internal_iteration = 0
+        # Batches consumed in current pass of underlying loader and in own current pass
+        self._internal_position = 0
+        self._position = 0
+        self._resume_internal_position = 0
+
+        self.worker_startup_time: Optional[float] = None
+        self.worker_starts = 0
         self._init_done = True
 
+    def _starts_workers(self) -> bool:
+        """Whether next pass over dataloader will start new worker pool"""
+        loader = self.dataloader
+        if isinstance(loader, ResumableLoader):
+            loader = loader.dataloader
+        if not isinstance(loader, DataLoader) or loader.num_workers == 0:
+            return False
+        return not loader.persistent_workers or loader._iterator is None
+
     def _internal_loader_iter(self):
-        for i, batch in islice(enumerate(self.dataloader), self.truncated_len):
+        start, self._resume_internal_position = self._resume_internal_position, 0
+        starts_workers = self._starts_workers()
+        started = time.perf_counter()
+        batches = iter(self.dataloader)
+        if start > 0 and not isinstance(self.dataloader, ResumableLoader):
+            LOG.warning(
+                "Dataloader is not resumable, loading %d skipped batches", start
+            )
+            batches = islice(batches, start, None)
+
+        self._internal_position = start
+        for i, batch in enumerate(islice(batches, self.truncated_len - start), start):
+            if starts_workers:
+                starts_workers = False
+                self.worker_startup_time = time.perf_counter() - started
+                self.worker_starts += 1
+                LOG.debug(
+                    "Dataloader workers started in %.2f s", self.worker_startup_time
+                )
             self._internal_iteration = i
+            self._internal_position = i + 1
             yield batch
+        self._internal_position = 0
         self._internal_loader_full_passes += 1
 
     def __iter__(self) -> Iterable[T_co]:
-        for it in range(self.single_pass_len):
-            batch = None
-            while not batch:
-                if not self._internal_iterator:
-                    self._internal_iterator = iter(self._internal_loader_iter())
-                try:
-                    batch = next(self._internal_iterator)
-                except StopIteration:
-                    self._internal_iterator = None
-
-            yield batch
+        start = self._position
+        try:
+            for it in range(start, self.single_pass_len):
+                batch = _NO_BATCH
+                while batch is _NO_BATCH:
+                    fresh = self._internal_iterator is None
+                    if fresh:
+                        fresh = self._resume_internal_position == 0
+                        self._internal_iterator = self._internal_loader_iter()
+                    try:
+                        batch = next(self._internal_iterator)
+                    except StopIteration:
+                        self._internal_iterator = None
+                        if fresh:
+                            # Underlying loader is empty
+                            return
+
+                self._position = it + 1
+                yield batch
+        finally:
+            self._position = 0
 
     def __len__(self):
         return self.single_pass_len
 
+    def state_dict(self) -> Dict[str, Any]:
+        state = {
+            "position": self._position,
+            "internal_position": self._internal_position,
+            "internal_full_passes": self._internal_loader_full_passes,
+        }
+        if isinstance(self.dataloader, ResumableLoader):
+            state["dataloader"] = self.dataloader.state_dict()
+        return state
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        """Next pass will continue saved pass"""
+        self._position = state_dict["position"]
+        self._internal_loader_full_passes = state_dict["internal_full_passes"]
+        self._resume_internal_position = state_dict["internal_position"]
+        if self._internal_iterator is not None:
+            self._internal_iterator.close()
+            self._internal_iterator = None
+        if "dataloader" in state_dict:
+            self.dataloader.load_state_dict(state_dict["dataloader"])
+
     def __getattr__(self, item):
         return getattr(self.dataloader, item)
 
@@ -86,13 +380,143 @@ class DataloaderSchedulerWrapper(Generic[T_co]):
             object.__setattr__(self, key, value)
 
 
+class InterleavedLoader(Generic[T_co]):
+    """
+    Iterates several dataloaders in a single pass yielding `(name, batch)` tuples
+
+    Iterators of all dataloaders are created at the beginning of the pass, so workers of
+    all dataloaders prefetch concurrently. Pass ends when all dataloaders are exhausted,
+    so its length is sum of dataloaders lengths.
+
+    Strategies:
+
+    * "round_robin" -- dataloaders take turns
+    * "proportional" -- random dataloader is chosen with probability proportional to
+      its remaining batches, so all dataloaders are spread evenly over the pass.
+      Requires dataloaders with `len()`
+    * "weighted" -- random dataloader is chosen with probability proportional to
+      `weights`. Exhausted dataloaders are skipped
+
+    Random choices are reproducible: every pass uses `seed + pass_number` as seed.
+
+    Examples::
+
+        loader = InterleavedLoader({"cls": cls_loader, "seg": seg_loader}, "proportional")
+        for epoch in loop.iterate_epochs(epochs):
+            for task, batch in loop.iterate_dataloader(loader, mode="train"):
+                ...
+    """
+
+    STRATEGIES = ("round_robin", "proportional", "weighted")
+
+    def __init__(
+        self,
+        loaders: Mapping[str, Iterable[T_co]],
+        strategy: str = "round_robin",
+        weights: Optional[Mapping[str, float]] = None,
+        seed: int = 0,
+    ):
+        """
+
+        Args:
+            loaders: dataloaders by names
+            strategy: "round_robin", "proportional" or "weighted"
+            weights: sampling weights by loader names, required for "weighted" strategy
+            seed: base seed for random choices
+        """
+        assert strategy in self.STRATEGIES, f"Unknown strategy {strategy}"
+        assert (
+            strategy != "weighted" or weights is not None
+        ), "weights are required for weighted strategy"
+        assert weights is None or set(weights) == set(
+            loaders
+        ), "weights must be specified for every loader"
+
+        self.loaders = dict(loaders)
+        self.strategy = strategy
+        self.weights = dict(weights) if weights is not None else None
+        self.seed = seed
+        self._passes = 0
+
+    def __len__(self):
+        return sum(len(loader) for loader in self.loaders.values())
+
+    def _choose(self, names: list, remaining: Dict[str, int], rng: random.Random):
+        if self.strategy == "proportional":
+            weights = [remaining[name] for name in names]
+        else:
+            weights = [self.weights[name] for name in names]
+        return rng.choices(names, weights)[0]
+
+    def __iter__(self) -> Iterator[Tuple[str, T_co]]:
+        rng = random.Random(self.seed + self._passes)
+        self._passes += 1
+
+        iterators = {name: iter(loader) for name, loader in self.loaders.items()}
+        remaining = {}
+        if self.strategy == "proportional":
+            remaining = {name: len(loader) for name, loader in self.loaders.items()}
+        names = list(iterators)
+        turn = 0
+
+        while names:
+            if self.strategy == "round_robin":
+                name = names[turn % len(names)]
+            else:
+                name = self._choose(names, remaining, rng)
+
+            try:
+                batch = next(iterators[name])
+            except StopIteration:
+                names.remove(name)
+                continue
+
+            turn = names.index(name) + 1
+            if remaining:
+                remaining[name] = max(remaining[name] - 1, 1)
+            yield name, batch
+
+
 class CacheSingleBatchDL:
+    """
+    Dataloader yielding the same (first) batch of wrapped loader
+
+    Batch is loaded and moved to default device once, on the first pass,
+    so `num_workers` and other loader settings can be changed after wrapping.
+    Yielded tensors are the cached ones, without copying. If training step
+    modifies them in place (detected with tensor version counters),
+    they are restored from on-device copy before the next pass.
+    """
+
     def __init__(self, loader):
         self.loader = loader
-        self.batch = next(iter(loader))
+        self.batch = None
+        self._pristine: List[torch.Tensor] = []
+        self._versions: List[int] = []
+        self._init_done = True
+
+    def _load(self):
+        batch = next(iter(self.loader))
+        self.batch = convert_tensor(batch, idist.device())
+        tensors = _collect_tensors(self.batch)
+        self._pristine = [t.clone() for t in tensors]
+        self._versions = [t._version for t in tensors]
+
+    def _restore(self):
+        tensors = _collect_tensors(self.batch)
+        for i, (tensor, pristine) in enumerate(zip(tensors, self._pristine)):
+            if tensor._version != self._versions[i]:
+                with torch.no_grad():
+                    tensor.copy_(pristine)
+                self._versions[i] = tensor._version
 
     def __iter__(self) -> Iterable[T_co]:
-        yield deepcopy(self.batch)
+        if self.batch is None:
+            self._load()
+        else:
+            self._restore()
+        # Rebuild containers, so their modification doesn't affect cached batch
+        yield apply_to_tensor(self.batch, lambda t: t)
 
     def __len__(self):
         return 1
@@ -102,11 +526,23 @@ class CacheSingleBatchDL:
 
     def __setattr__(self, key, value):
         if "_init_done" in self.__dict__ and key not in self.__dict__:
-            setattr(self.dataloader, key, value)
+            setattr(self.loader, key, value)
         else:
             object.__setattr__(self, key, value)
 
 
+def _collect_tensors(batch) -> List[torch.Tensor]:
+    if isinstance(batch, torch.Tensor):
+        return [batch]
+    if isinstance(batch, (str, bytes)):
+        return []
+    if isinstance(batch, Mapping):
+        batch = batch.values()
+    if isinstance(batch, Iterable):
+        return [t for item in batch for t in _collect_tensors(item)]
+    return []
+
+
 class DataloaderOverrider:
     def __init__(self, mode="disabled"):
         self.mode = mode
@@ -127,14 +563,14 @@ class DataloaderOverrider:
 
         if self.mode == "overfit-batch":
             if "raw_loader" in self.cache:
-                loader.num_workers = 1
                 loader = self.cache["raw_loader"]
             else:
+                # Single batch is loaded once, extra workers only slow down start
+                loader.num_workers = 1
                 loader = CacheSingleBatchDL(loader)
                 self.cache["raw_loader"] = loader
 
             if mode == "train":
-                loader.num_workers = 1
                 loader = DataloaderSchedulerWrapper(
                     loader, single_pass_length=10.0, truncated_length=1
                 )
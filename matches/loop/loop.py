@@ -1,7 +1,9 @@
 import logging
 import os
+import time
 import typing
-from contextlib import contextmanager
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager, nullcontext
 from os import PathLike
 from pathlib import Path
 from typing import (
@@ -10,10 +12,12 @@ from typing import (
     Callable,
     Dict,
     Iterable,
+    Iterator,
     List,
     Optional,
     Protocol,
     Sequence,
+    Set,
     TypeVar,
     Union,
 )
@@ -24,11 +28,25 @@ import torch
 from ignite.metrics import Metric
 from ignite.utils import convert_tensor
 from matches.accelerators import Accelerator
+from matches.loop.compile import CompiledModule
 from matches.loop.iteration import IterationCounter
 from matches.loop.loader_scheduling import DataloaderOverrider
 from matches.loop.metric_manager import MetricManager
+from matches.loop.prefetch import BatchPrefetcher
+from matches.loop.state_io import (
+    CHECKPOINT_FORMATS,
+    AsyncStateWriter,
+    DistributedFormat,
+    Shard,
+    Shards,
+    load_state,
+)
+from matches.loop.timing import StepTimer
+from matches.loop.worker_tuner import WorkerTuner
 from matches.shortcuts.module import module_eval, module_train
+from matches.utils import RNGState
 from torch import nn
+from torch.autograd.profiler import record_function
 from torch.optim import Optimizer
 from torch.utils.data import DataLoader
 
@@ -39,6 +57,8 @@ LOG = logging.getLogger(__name__)
 
 T_batch = TypeVar("T_batch")
 
+_NULL_CONTEXT = nullcontext()
+
 
 @typing.runtime_checkable
 class StateSource(Protocol):
@@ -49,67 +69,349 @@ class StateSource(Protocol):
         pass
 
 
+@typing.runtime_checkable
+class ShardedStateSource(Protocol):
+    """State source partitioned between ranks (eg ZeRO optimizer)
+
+    With "distributed" checkpoint format every rank saves own shard.
+    `load_sharded_state_dict` receives list with own shard of current rank, or
+    shards of all ranks of saved run if world size has changed.
+    """
+
+    def sharded_state_dict(self):
+        pass
+
+    def load_sharded_state_dict(self, shards: List[Any]):
+        pass
+
+
 NON_BLOCKING_COPY = bool(os.environ.get("NBC", "True"))
 
+_PRECISION_DTYPES = {
+    "fp32": None,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+}
+
+
+def _infer_batch_size(batch) -> Optional[int]:
+    """Leading dimension of the first tensor in (possibly nested) batch"""
+    if torch.is_tensor(batch):
+        return batch.shape[0] if batch.dim() > 0 else None
+    if isinstance(batch, typing.Mapping):
+        batch = batch.values()
+    elif isinstance(batch, (str, bytes)) or not isinstance(batch, typing.Iterable):
+        return None
+    for item in batch:
+        size = _infer_batch_size(item)
+        if size is not None:
+            return size
+    return None
+
+
+def _slice_batch(batch, start: int, end: int, batch_size: int):
+    """Slice tensors of (possibly nested) batch having leading dimension `batch_size`"""
+    if torch.is_tensor(batch):
+        if batch.dim() > 0 and batch.shape[0] == batch_size:
+            return batch[start:end]
+        return batch
+    if isinstance(batch, typing.Mapping):
+        return type(batch)(
+            {k: _slice_batch(v, start, end, batch_size) for k, v in batch.items()}
+        )
+    if isinstance(batch, tuple) and hasattr(batch, "_fields"):
+        return type(batch)(*(_slice_batch(v, start, end, batch_size) for v in batch))
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(_slice_batch(v, start, end, batch_size) for v in batch)
+    return batch
+
+
+def _make_grad_scaler(device_type: str):
+    if hasattr(torch.amp, "GradScaler"):
+        return torch.amp.GradScaler(device_type)
+    return torch.cuda.amp.GradScaler(enabled=device_type == "cuda")
+
+
+class _LazyGradScaler:
+    """State source of GradScaler created for training device on first use
+
+    Device is known only after distributed processes are launched, while loop
+    (and scaler state source) can be created before that.
+    """
 
-class StateManager:
     def __init__(self):
+        self.scaler = None
+        self._pending_state: Optional[Dict[str, Any]] = None
+
+    def get(self):
+        if self.scaler is None:
+            self.scaler = _make_grad_scaler(idist.device().type)
+            if self._pending_state is not None:
+                self.scaler.load_state_dict(self._pending_state)
+                self._pending_state = None
+        return self.scaler
+
+    def state_dict(self) -> Dict[str, Any]:
+        if self.scaler is None and self._pending_state is not None:
+            return self._pending_state
+        return self.get().state_dict()
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        if self.scaler is None:
+            self._pending_state = state_dict
+        else:
+            self.scaler.load_state_dict(state_dict)
+
+
+class StateManager:
+    def __init__(self, async_write: bool = False, checkpoint_format: str = "torch"):
+        """
+
+        Args:
+            async_write: write states in background thread, see :obj:`AsyncStateWriter`.
+                Call :meth:`wait` to make sure writes are finished, `Loop.run` does
+                it after `on_train_end`
+            checkpoint_format: "torch" (single file), "dedup" (manifest file and
+                content-addressed blobs shared between checkpoints of the directory,
+                see :obj:`DedupFormat`), "sharded" (directory with file per key,
+                loaded memory-mapped, see :obj:`ShardedFormat`) or "distributed"
+                (directory written by all ranks in parallel with own shards of
+                :obj:`ShardedStateSource` states, see :obj:`DistributedFormat`).
+                `read_state` reads any format and loads only requested keys
+        """
+        assert (
+            checkpoint_format in CHECKPOINT_FORMATS
+        ), f"checkpoint_format must be one of {list(CHECKPOINT_FORMATS)}"
+        assert not (
+            async_write and checkpoint_format == "distributed"
+        ), "async_write is not supported with distributed checkpoint format"
         self._state_sources: Dict[str, StateSource] = {}
+        self._optional_keys: Set[str] = set()
+        self._writer = AsyncStateWriter() if async_write else None
+        self._format = CHECKPOINT_FORMATS[checkpoint_format]()
 
-    def attach(self, key: str, source: StateSource):
+    @property
+    def distributed(self) -> bool:
+        """States are written and read by all ranks together"""
+        return isinstance(self._format, DistributedFormat)
+
+    def attach(self, key: str, source: StateSource, required: bool = True):
+        """
+
+        Args:
+            key: key of source state in checkpoints
+            source: object with `state_dict()/load_state_dict()`
+            required: if False, reading checkpoint without this key leaves
+                source state untouched instead of raising `KeyError`
+        """
         self._state_sources[key] = source
+        if required:
+            self._optional_keys.discard(key)
+        else:
+            self._optional_keys.add(key)
+
+    def detach(self, key: str):
+        self._state_sources.pop(key, None)
+        self._optional_keys.discard(key)
+
+    @contextmanager
+    def substitute(self, source: StateSource, substitute: StateSource):
+        """Save and restore state of attached `source` with `substitute` in context"""
+        keys = [key for key, value in self._state_sources.items() if value is source]
+        for key in keys:
+            self._state_sources[key] = substitute
+        try:
+            yield
+        finally:
+            for key in keys:
+                if self._state_sources.get(key) is substitute:
+                    self._state_sources[key] = source
+
+    def _source_state(self, source: StateSource):
+        if self.distributed and isinstance(source, ShardedStateSource):
+            return Shard(source.sharded_state_dict())
+        return source.state_dict()
+
+    def _load_source_state(self, key: str, state, lazy_optimizers: bool = False):
+        source = self._state_sources[key]
+        if isinstance(state, Shards):
+            if not isinstance(source, ShardedStateSource):
+                raise ValueError(f"State of {key} is sharded, but source is not")
+            source.load_sharded_state_dict(list(state))
+        elif lazy_optimizers and isinstance(source, Optimizer):
+            _load_optimizer_lazily(source, state)
+        else:
+            source.load_state_dict(state)
 
     def state_dict(self, skip_keys: Optional[Sequence[str]] = None):
         skip_keys = skip_keys if skip_keys else []
         return {
-            key: value.state_dict()
+            key: self._source_state(value)
             for key, value in self._state_sources.items()
             if key not in skip_keys
         }
 
     def state_dict_by_key(self, key: str):
-        return {key: self._state_sources[key].state_dict()}
+        return {key: self._source_state(self._state_sources[key])}
 
-    def load_state_dict(self, state_dict, skip_keys: Optional[Sequence[str]] = None):
+    def load_state_dict(
+        self,
+        state_dict,
+        skip_keys: Optional[Sequence[str]] = None,
+        lazy_optimizers: bool = False,
+    ):
         skip_keys = skip_keys if skip_keys else []
-        for k, ss in self._state_sources.items():
-            if k not in skip_keys:
-                ss.load_state_dict(state_dict[k])
+        for k in list(self._state_sources):
+            if k in skip_keys:
+                continue
+            if k not in state_dict and k in self._optional_keys:
+                LOG.info("State of %s is missing in checkpoint, skipping", k)
+                continue
+            self._load_source_state(k, state_dict[k], lazy_optimizers)
 
     def load_state_dict_by_key(self, state_dict, key: str):
-        self._state_sources[key].load_state_dict(state_dict[key])
+        self._load_source_state(key, state_dict[key])
+
+    def _write(self, state_dict, file: Union[str, PathLike]):
+        if len(state_dict) == 0:
+            warn(
+                "state_dict is empty. Did you forget to attach "
+                "model/optimizer/scheduler etc?"
+            )
+        if self._writer is not None:
+            self._writer.write(state_dict, file, save=self._format.save)
+        else:
+            self._format.save(state_dict, file)
 
     def write_state(
         self, file: Union[str, PathLike], skip_keys: Optional[Sequence[str]] = None
     ):
-        with Path(file).open("wb") as f:
-            state_dict = self.state_dict(skip_keys=skip_keys)
-            if len(state_dict) == 0:
-                warn(
-                    "state_dict is empty. Did you forget to attach "
-                    "model/optimizer/scheduler etc?"
-                )
-            torch.save(state_dict, f)
+        self._write(self.state_dict(skip_keys=skip_keys), file)
 
     def write_state_by_key(self, file: Union[str, PathLike], key: str):
-        with Path(file).open("wb") as f:
-            state_dict = self.state_dict_by_key(key=key)
-            if len(state_dict) == 0:
-                warn(
-                    "state_dict is empty. Did you forget to attach "
-                    "model/optimizer/scheduler etc?"
-                )
-            torch.save(state_dict, f)
+        self._write(self.state_dict_by_key(key=key), file)
+
+    def wait(self):
+        """Wait for asynchronous write in flight, if any"""
+        if self._writer is not None:
+            self._writer.wait()
 
     def read_state(
-        self, file: Union[str, PathLike], skip_keys: Optional[Sequence[str]] = None
+        self,
+        file: Union[str, PathLike],
+        skip_keys: Optional[Sequence[str]] = None,
+        lazy_optimizers: bool = False,
     ):
-        with Path(file).open("rb") as f:
-            self.load_state_dict(torch.load(f, map_location="cpu"), skip_keys)
+        """
+
+        Args:
+            file: checkpoint file or directory
+            skip_keys: keys not to restore
+            lazy_optimizers: restore state of attached optimizers right before
+                their first step (or `state_dict` call). Hyperparameters of param
+                groups are restored at once, so changes made to them before the
+                first step (eg by scheduler) are kept. Requires torch>=2.1, otherwise
+                optimizers are restored at once
+        """
+        self.wait()
+        skip_keys = skip_keys if skip_keys else []
+        keys = [key for key in self._state_sources if key not in skip_keys]
+        self.load_state_dict(load_state(file, keys), skip_keys, lazy_optimizers)
 
     def read_state_by_key(self, file: Union[str, PathLike], key: str):
-        with Path(file).open("rb") as f:
-            self.load_state_dict_by_key(torch.load(f, map_location="cpu"), key)
+        self.wait()
+        self.load_state_dict_by_key(load_state(file, [key]), key)
+
+
+def _load_optimizer_lazily(optimizer: Optimizer, state_dict: Dict[str, Any]):
+    # Optimizer hooks appeared in torch 2.0 (step) and 2.1 (state_dict)
+    if not hasattr(optimizer, "register_state_dict_pre_hook"):
+        optimizer.load_state_dict(state_dict)
+        return
+
+    for group, saved_group in zip(optimizer.param_groups, state_dict["param_groups"]):
+        group.update({k: v for k, v in saved_group.items() if k != "params"})
+
+    loaded = False
+
+    def _materialize(*args):
+        # Hooks can't be removed while optimizer iterates over them
+        nonlocal loaded
+        if not loaded:
+            loaded = True
+            # Hyperparameters could be changed since resume (eg by scheduler)
+            param_groups = [
+                {**{k: v for k, v in group.items() if k != "params"}, "params": saved}
+                for group, saved in zip(
+                    optimizer.param_groups,
+                    (g["params"] for g in state_dict["param_groups"]),
+                )
+            ]
+            optimizer.load_state_dict({**state_dict, "param_groups": param_groups})
+
+    optimizer.register_step_pre_hook(_materialize)
+    optimizer.register_state_dict_pre_hook(_materialize)
+
+
+def _notify_after(method: Callable) -> Callable:
+    def _wrapper(self: "_CallbackList", *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._on_change()
+        return result
+
+    _wrapper.__name__ = method.__name__
+    return _wrapper
+
+
+class _CallbackList(list):
+    """List calling `on_change` after every modification"""
+
+    def __init__(self, iterable, on_change: Callable[[], None]):
+        super().__init__(iterable)
+        self._on_change = on_change
+
+
+for _method in (
+    "append",
+    "extend",
+    "insert",
+    "remove",
+    "pop",
+    "clear",
+    "sort",
+    "reverse",
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+):
+    setattr(_CallbackList, _method, _notify_after(getattr(list, _method)))
+
+
+class _ConsumedLoaderState:
+    """State of loader iterated by prefetcher after the last consumed batch"""
+
+    def __init__(self, loader: StateSource, prefetcher: BatchPrefetcher):
+        self.loader = loader
+        self.prefetcher = prefetcher
+
+    def state_dict(self):
+        return self.prefetcher.consumed_state
+
+    def load_state_dict(self, state_dict):
+        self.loader.load_state_dict(state_dict)
+
+
+class _LoopState:
+    def __init__(self):
+        self.epoch_completed = False
+        """Epoch body is finished, `on_epoch_end` handlers are running"""
+
+    def state_dict(self):
+        return {"epoch_completed": self.epoch_completed}
+
+    def load_state_dict(self, state_dict):
+        self.epoch_completed = state_dict["epoch_completed"]
 
 
 class Loop:
@@ -119,9 +421,26 @@ class Loop:
         callbacks: List["Callback"],
         loader_override: str = "disabled",
         attach_iterations: bool = True,
+        prefetch: int = 0,
+        accumulate_steps: int = 1,
+        precision: str = "fp32",
+        step_timer: Optional[StepTimer] = None,
+        batch_size_fn: Optional[Callable[[Any], Optional[int]]] = None,
+        worker_tuner: Optional[WorkerTuner] = None,
+        state_manager: Optional[StateManager] = None,
     ):
+        assert accumulate_steps >= 1, "accumulate_steps must be positive"
+        assert (
+            precision in _PRECISION_DTYPES
+        ), f"precision must be one of {list(_PRECISION_DTYPES)}"
+        if state_manager is None:
+            state_manager = StateManager()
+        self.state_manager = state_manager
+        self.state_manager.attach("rng", RNGState(), required=False)
+        self._loop_state = _LoopState()
+        self.state_manager.attach("loop", self._loop_state, required=False)
+        self._callback_state_keys: List[str] = []
         self.callbacks = callbacks
-        self.state_manager = StateManager()
         self.metrics = MetricManager(self)
         """Object for metrics logging"""
 
@@ -136,11 +455,126 @@ class Loop:
         self._mode: Optional[str] = None
 
         self._modules: List[nn.Module] = []
+        self._compiled_modules: List[CompiledModule] = []
         self._loader_override = DataloaderOverrider(loader_override)
 
+        self.prefetch = prefetch
+        """Default number of batches prefetched in background by `iterate_dataloader`"""
+        self.data_wait_time: float = 0.0
+        """Seconds the current iteration was waiting for its batch"""
+
+        self.accumulate_steps = accumulate_steps
+        """Number of train batches which gradients are accumulated before optimizer step"""
+        self._accumulation_index = 0
+        self._accumulation_boundary = True
+        self._accumulation_window = accumulate_steps
+        self._micro_batch_scale = 1.0
+
+        self.precision = precision
+        """Autocast precision: "fp32" (disabled), "bf16" or "fp16"."""
+        self._lazy_grad_scaler: Optional[_LazyGradScaler] = None
+        self._scaler_update_pending = False
+        self._skipped_steps: Optional[torch.Tensor] = None
+        if precision == "fp16":
+            self._lazy_grad_scaler = _LazyGradScaler()
+            self.attach(grad_scaler=self._lazy_grad_scaler)
+
+        self.step_timer = step_timer
+        """Optional instrumentation measuring durations of train step phases"""
+        self.record_phases = False
+        """Label step phases and callback events with `record_function` for profiler"""
+
+        self.batch_size_fn = batch_size_fn
+        """Function returning number of samples in batch. By default it's leading
+        dimension of the first tensor found in batch"""
+
+        self.worker_tuner = worker_tuner
+        """Optional tuner of train DataLoader workers by measured data wait"""
+
+    @property
+    def _grad_scaler(self):
+        """GradScaler of fp16 training on the current device, `None` otherwise"""
+        if self._lazy_grad_scaler is None:
+            return None
+        return self._lazy_grad_scaler.get()
+
+    @property
+    def callbacks(self) -> List["Callback"]:
+        """Callbacks receiving loop events
+
+        Assigned list is copied: modify `loop.callbacks` itself (append, remove, etc)
+        to add or remove callbacks later, changes of the original list are ignored.
+        """
+        return self._callbacks
+
+    @callbacks.setter
+    def callbacks(self, callbacks: List["Callback"]):
+        self._callbacks = _CallbackList(callbacks, self._on_callbacks_change)
+        self._on_callbacks_change()
+
+    def _on_callbacks_change(self):
+        self._build_dispatch_table()
+        self._attach_callback_states()
+
+    def _attach_callback_states(self):
+        """Attach callbacks having state as `callback/<class name>`"""
+        for key in self._callback_state_keys:
+            self.state_manager.detach(key)
+        self._callback_state_keys = []
+        counts: Dict[str, int] = defaultdict(int)
+        for c in self._callbacks:
+            if isinstance(c, StateSource):
+                name = type(c).__name__
+                key = f"callback/{name}"
+                if counts[name] > 0:
+                    key += f"_{counts[name]}"
+                counts[name] += 1
+                self.state_manager.attach(key, c, required=False)
+                self._callback_state_keys.append(key)
+
+    def _build_dispatch_table(self):
+        """Precompute handlers for every event.
+
+        Callbacks that don't override some event handler are not called for that event at all.
+        """
+        table = defaultdict(list)
+        for c in self._callbacks:
+            handled_events = getattr(c, "handled_events", None)
+            if handled_events is not None:
+                events = handled_events()
+            else:
+                events = [e for e in dir(c) if callable(getattr(c, e, None))]
+            for event in events:
+                if event.startswith("on_"):
+                    table[event].append(getattr(c, event))
+        self._dispatch_table: Dict[str, List[Callable]] = dict(table)
+
     def _emit_event(self, event: str, **event_kwargs):
-        for c in self.callbacks:
-            getattr(c, event)(self, **event_kwargs)
+        handlers = self._dispatch_table.get(event, ())
+        if not handlers:
+            return
+        with self._phase("callbacks", label=event):
+            for handler in handlers:
+                handler(self, **event_kwargs)
+
+    def _phase(self, name: str, label: Optional[str] = None):
+        """Context manager measuring step phase if step timer is set,
+        and labeling it with `record_function` while profiler records
+        """
+        if self.step_timer is None and not self.record_phases:
+            return _NULL_CONTEXT
+        return self._measured_phase(name, label or name)
+
+    @contextmanager
+    def _measured_phase(self, name: str, label: str):
+        timer_phase = (
+            self.step_timer.phase(name) if self.step_timer is not None else _NULL_CONTEXT
+        )
+        profiler_range = (
+            record_function(f"matches/{label}") if self.record_phases else _NULL_CONTEXT
+        )
+        with timer_phase, profiler_range:
+            yield
 
     def attach(
         self,
@@ -181,6 +615,37 @@ class Loop:
         for k, v in kwargs.items():
             self.attach(k, v)
 
+    def compile(
+        self, module: nn.Module, name: Optional[str] = None, **compile_kwargs
+    ) -> CompiledModule:
+        """Compile module with `torch.compile` and track compilation cost
+
+        Returned object should be used for forward calls. Original module stays
+        untouched and should be attached to loop as usual, so checkpoints don't depend
+        on compilation.
+
+        Examples::
+
+            loop.attach(model=model)
+            compiled_model = loop.compile(model, mode="max-autotune")
+
+            for x, y in loop.iterate_dataloader(train_loader, mode="train"):
+                loss = criterion(compiled_model(x), y)
+
+        Args:
+            module: module to compile
+            name: name used in logged metrics. Module class name by default
+            **compile_kwargs: passed to `torch.compile`, eg `mode`, `dynamic`, `backend`
+
+        Returns:
+            :obj:`CompiledModule` logging compile time and recompilations to `Loop.metrics`
+        """
+        compiled = CompiledModule(
+            self, module, name or type(module).__name__, **compile_kwargs
+        )
+        self._compiled_modules.append(compiled)
+        return compiled
+
     def iterate_epochs(self, epochs) -> Iterable[int]:
         """Iterate over epochs
 
@@ -202,17 +667,27 @@ class Loop:
                 total_epochs=epochs,
             ):
                 yield int(self.iterations.current_epoch)
+                self._loop_state.epoch_completed = True
             self.iterations.current_epoch.inc()
+            self._loop_state.epoch_completed = False
+            self.iterations.global_epochs.inc()
             self._in_epoch = False
 
     def iterate_dataloader(
-        self, dataloader: DataLoader[T_batch], mode="valid", move_to_default_device=True
+        self,
+        dataloader: DataLoader[T_batch],
+        mode="valid",
+        move_to_default_device=True,
+        prefetch: Optional[int] = None,
     ) -> Iterable[T_batch]:
         """Iterate dataloader batches.
 
         Depending on chosen mode following is true inside loop over this generator:
 
         * Emits callback events `on_iteration_start/end`
+        * Counts train batches and samples (see `Loop.batch_size_fn`) and logs throughput
+          `throughput/global_samples_per_sec` and `throughput/global_batches_per_sec`
+          (summed over processes) after train pass
         * Moves all torch.Tensor objects in batch to default device
         * Handles set_grad_enabled an train/eval of attached :obj:`nn.Module`:
 
@@ -221,12 +696,20 @@ class Loop:
             * mode="valid" trigger eval() on all `torch.nn.Modules` attached to
               `Loop`. Gradients are also disabled.
 
+        * Enables autocast if `Loop.precision` is "bf16" or "fp16"
+        * Replaces train DataLoader with tuned copy if `Loop.worker_tuner` is set
+
 
         Args:
             dataloader: dataloader to iterate
             mode: "train" or "valid"
             move_to_default_device: Controls whether all tensor in batches are automatically moved
                 to current device. Default `True`.
+            prefetch: Number of batches fetched (and moved to device) ahead in background
+                thread. `0` disables prefetching. Default is taken from `Loop.prefetch`.
+                Checkpoints written during the pass save position of attached
+                dataloader (eg :obj:`ResumableLoader`) after consumed batches, not
+                after prefetched ones.
 
         Yields:
             Batches from dataloader.
@@ -238,24 +721,239 @@ class Loop:
         ), "Dataloader can be run in train mode only inside epoch loop"
 
         # dataloader = self._loader_override(dataloader, mode)
+        original_dataloader = dataloader
+        tuned = self.worker_tuner is not None and mode == "train"
+        if tuned:
+            dataloader = self.worker_tuner.loader(self, dataloader)
 
         with self._wrap_in_events(
             "on_dataloader_start", "on_dataloader_end", dataloader=dataloader
         ), self.mode(mode):
             self._in_dataloader = True
-            for batch_no, batch in enumerate(dataloader):
-                with self._wrap_in_events(
-                    "on_iteration_start", "on_iteration_end", batch_no=batch_no
-                ):
-                    if move_to_default_device:
-                        batch = convert_tensor(
-                            batch, idist.device(), non_blocking=NON_BLOCKING_COPY
+            if mode == "train" and self.accumulate_steps > 1:
+                # Pass starts new accumulation window, gradients left by interrupted
+                # window of previous pass must not leak into it
+                self._accumulation_index = 0
+                for module in self._modules:
+                    module.zero_grad(set_to_none=True)
+            prefetch = self.prefetch if prefetch is None else prefetch
+            pass_contexts = ExitStack()
+            if prefetch > 0:
+                stateful = isinstance(dataloader, StateSource)
+                batches = BatchPrefetcher(
+                    dataloader,
+                    prefetch,
+                    device=idist.device() if move_to_default_device else None,
+                    non_blocking=NON_BLOCKING_COPY,
+                    snapshot=dataloader.state_dict if stateful else None,
+                )
+                if stateful:
+                    # Position of attached loader is advanced by prefetching,
+                    # checkpoints must have position of consumed batches
+                    pass_contexts.enter_context(
+                        self.state_manager.substitute(
+                            dataloader, _ConsumedLoaderState(dataloader, batches)
                         )
-                    yield batch
-                    if self._mode == "train":
-                        self.iterations.current_batch.inc()
+                    )
+            else:
+                batches = iter(dataloader)
+
+            try:
+                num_batches = len(dataloader)
+            except TypeError:
+                num_batches = None
+
+            pass_start = time.perf_counter()
+            pass_batches = 0
+            pass_samples = 0
+            # Data wait after the first batch, which includes workers startup
+            first_batch_time = pass_start
+            pass_wait = 0.0
+            try:
+                for batch_no, batch in enumerate(
+                    self._measure_data_wait(batches, timed=mode == "train")
+                ):
+                    if batch_no == 0:
+                        first_batch_time = time.perf_counter()
+                    else:
+                        pass_wait += self.data_wait_time
+                    with self._wrap_in_events(
+                        "on_iteration_start", "on_iteration_end", batch_no=batch_no
+                    ):
+                        if move_to_default_device and prefetch == 0:
+                            with self._phase("transfer"):
+                                batch = convert_tensor(
+                                    batch,
+                                    idist.device(),
+                                    non_blocking=NON_BLOCKING_COPY,
+                                )
+                        if self._mode == "train":
+                            batch_size = self._batch_size(batch)
+                            self._accumulation_boundary = (
+                                self._accumulation_index + 1 >= self.accumulate_steps
+                                or batch_no + 1 == num_batches
+                            )
+                            self._accumulation_window = self.accumulate_steps
+                            if num_batches is not None:
+                                window_start = batch_no - self._accumulation_index
+                                self._accumulation_window = min(
+                                    self.accumulate_steps, num_batches - window_start
+                                )
+                        with self._grad_sync(self._accumulation_boundary):
+                            if self.step_timer is not None:
+                                self.step_timer.start_forward()
+                            yield batch
+                        if self._mode == "train":
+                            self._update_grad_scaler()
+                            self._count_train_batch(batch_size)
+                            pass_batches += 1
+                            pass_samples += batch_size or 0
+                    if self.step_timer is not None and mode == "train":
+                        self.step_timer.end_iteration(self)
+            finally:
+                pass_contexts.close()
+                if isinstance(batches, BatchPrefetcher):
+                    batches.close()
+                if mode == "train":
+                    self._accumulation_boundary = True
+                    self._accumulation_index = 0
+                    self._accumulation_window = self.accumulate_steps
+                    self._finish_scaler_steps()
+                    if self.step_timer is not None:
+                        self.step_timer.cancel_iteration()
             self._in_dataloader = False
 
+            if mode == "train":
+                self._log_throughput(
+                    time.perf_counter() - pass_start, pass_batches, pass_samples
+                )
+                for compiled in self._compiled_modules:
+                    compiled.log_call_time()
+                if tuned and pass_batches > 1:
+                    self.worker_tuner.update(
+                        self,
+                        original_dataloader,
+                        pass_wait,
+                        time.perf_counter() - first_batch_time,
+                    )
+
+    def _batch_size(self, batch) -> Optional[int]:
+        if self.batch_size_fn is not None:
+            return self.batch_size_fn(batch)
+        return _infer_batch_size(batch)
+
+    def _count_train_batch(self, batch_size: Optional[int]):
+        world_size = idist.get_world_size()
+        self.iterations.current_batch.inc()
+        # Estimation assuming equal batches on all processes.
+        # Corrected in the end of dataloader pass
+        self.iterations.global_batches.inc(world_size)
+        if batch_size is not None:
+            self.iterations.current_samples.inc(batch_size)
+            self.iterations.global_samples.inc(batch_size * world_size)
+
+        if self._accumulation_boundary:
+            self._accumulation_index = 0
+        else:
+            self._accumulation_index += 1
+
+    def _log_throughput(self, elapsed: float, batches: int, samples: int):
+        world_size = idist.get_world_size()
+        global_batches, global_samples = batches, samples
+        if world_size > 1:
+            # Collectives run on every process, even on ones without batches
+            totals = idist.all_reduce(torch.tensor([batches, samples]))
+            global_batches, global_samples = (int(t) for t in totals)
+            elapsed = float(idist.all_reduce(elapsed, op="MAX"))
+            self.iterations.global_batches.inc(global_batches - batches * world_size)
+            self.iterations.global_samples.inc(global_samples - samples * world_size)
+
+        if global_batches == 0 or elapsed <= 0:
+            return
+        self.metrics.log("throughput/global_batches_per_sec", global_batches / elapsed)
+        if global_samples > 0:
+            self.metrics.log(
+                "throughput/global_samples_per_sec", global_samples / elapsed
+            )
+
+    def _measure_data_wait(
+        self, batches: Iterator[T_batch], timed: bool
+    ) -> Iterable[T_batch]:
+        timer = self.step_timer if timed else None
+        while True:
+            if timer is not None:
+                timer.start_iteration()
+            start = time.perf_counter()
+            try:
+                with self._phase("data_wait"):
+                    batch = next(batches)
+            except StopIteration:
+                return
+            self.data_wait_time = time.perf_counter() - start
+            yield batch
+
+    @property
+    def accumulation_boundary(self) -> bool:
+        """Whether optimizer step will be performed on current batch.
+
+        Always `True` if gradient accumulation is disabled or outside train dataloader.
+        """
+        return self._accumulation_boundary
+
+    def iterate_micro_batches(
+        self, batch: T_batch, micro_batch_size: Optional[int]
+    ) -> Iterable[T_batch]:
+        """Splits batch into micro-batches of at most `micro_batch_size` samples
+
+        Allows training with batches which don't fit into memory (see
+        :func:`matches.shortcuts.batch_size.find_max_batch_size`).
+        Loss passed to :meth:`backward` inside iteration is scaled by
+        micro-batch share of the batch, so accumulated gradients of mean losses
+        equal to gradients of the whole batch. Gradient all-reduce of attached DDP
+        modules is done only on the last micro-batch.
+
+        Tensors having leading dimension equal to batch size are sliced, everything
+        else is passed to every micro-batch as is.
+
+        Examples::
+
+            for batch in loop.iterate_dataloader(train_loader, mode="train"):
+                for x, y in loop.iterate_micro_batches(batch, micro_batch_size):
+                    loop.backward(criterion(model(x), y))
+                loop.optimizer_step(optimizer)
+
+        Args:
+            batch: batch to split
+            micro_batch_size: maximum micro-batch size, `None` disables splitting
+        """
+        batch_size = self._batch_size(batch)
+        if (
+            micro_batch_size is None
+            or batch_size is None
+            or batch_size <= micro_batch_size
+        ):
+            yield batch
+            return
+
+        try:
+            for start in range(0, batch_size, micro_batch_size):
+                end = min(start + micro_batch_size, batch_size)
+                self._micro_batch_scale = (end - start) / batch_size
+                with self._grad_sync(end == batch_size):
+                    yield _slice_batch(batch, start, end, batch_size)
+        finally:
+            self._micro_batch_scale = 1.0
+
+    @contextmanager
+    def _grad_sync(self, enabled: bool):
+        """Disables gradient all-reduce of attached DDP modules if `enabled` is False"""
+        with ExitStack() as stack:
+            if not enabled:
+                for module in self._modules:
+                    if isinstance(module, nn.parallel.DistributedDataParallel):
+                        stack.enter_context(module.no_sync())
+            yield
+
     @contextmanager
     def _wrap_in_events(self, enter_event_name, exit_event_name, **kwargs):
         """CM for emits enter_event_name before block, and emits exit_event_name
@@ -276,6 +974,12 @@ class Loop:
         Calls backward and emits event. Most likely will have more logic down the road.
         So it's recommended to use it even now
 
+        If gradient accumulation is enabled, loss is divided by number of batches in
+        accumulation window: `Loop.accumulate_steps`, or less for the last window of
+        dataloader pass, if dataloader has length.
+        Inside :meth:`iterate_micro_batches` loss is scaled by micro-batch share.
+        In "fp16" precision loss is scaled by grad scaler. Backward is run outside autocast.
+
         Args:
             loss: loss to call backward on
             **backward_kwargs:
@@ -283,13 +987,21 @@ class Loop:
         Returns:
               None
         """
-        loss.backward(**backward_kwargs)
+        if self._accumulation_window > 1:
+            loss = loss / self._accumulation_window
+        if self._micro_batch_scale != 1.0:
+            loss = loss * self._micro_batch_scale
+        if self._grad_scaler is not None:
+            loss = self._grad_scaler.scale(loss)
+        with self._autocast(enabled=False), self._phase("backward"):
+            loss.backward(**backward_kwargs)
         self._emit_event("on_after_backward")
 
     @contextmanager
     def mode(self, mode="valid"):
         """
-        Contextmanager managing gradients and train/eval mode of attached modules
+        Contextmanager managing gradients and train/eval mode of attached modules.
+        Also enables autocast if `Loop.precision` is not "fp32".
 
         Args:
             mode: train/valid
@@ -301,15 +1013,76 @@ class Loop:
             if is_eval:
                 with torch.set_grad_enabled(False), module_train(
                     *self._modules, train=False
-                ):
+                ), self._autocast():
                     yield
             else:
-                yield
+                with self._autocast():
+                    yield
         except GeneratorExit:
             pass
 
         self._mode = old_mode
 
+    def _autocast(self, enabled: bool = True):
+        dtype = _PRECISION_DTYPES[self.precision]
+        if dtype is None:
+            return nullcontext()
+        return torch.autocast(idist.device().type, dtype=dtype, enabled=enabled)
+
+    def _step_with_events(
+        self,
+        optimizer: Optimizer,
+        closure: Optional[Callable[[], float]],
+        zero_grad: Union[bool, str],
+    ):
+        scaler = self._grad_scaler
+        if scaler is not None:
+            # Callbacks (eg grad clipping) must see real gradients
+            with self._phase("optimizer_step"):
+                scaler.unscale_(optimizer)
+
+        self._emit_event("on_before_optimizer_step", optimizer=optimizer)
+        with self._phase("optimizer_step"):
+            if scaler is not None:
+                if closure is None:
+                    scaler.step(optimizer)
+                else:
+                    scaler.step(optimizer, closure=closure)
+                # Skipped steps are summed on device and subtracted from
+                # global_steps at the end of pass, to avoid sync on every step
+                for found_inf in scaler._found_inf_per_device(optimizer).values():
+                    if self._skipped_steps is None:
+                        self._skipped_steps = found_inf.float()
+                    else:
+                        self._skipped_steps += found_inf.to(self._skipped_steps)
+                # Scale is updated once per iteration, after all optimizers stepped
+                self._scaler_update_pending = True
+            else:
+                optimizer.step(closure)
+
+            if zero_grad:
+                optimizer.zero_grad(zero_grad == "set_to_none")
+        self._emit_event("on_after_optimizer_step", optimizer=optimizer)
+        self.iterations.global_steps.inc()
+
+        if not self._in_dataloader:
+            self._finish_scaler_steps()
+
+    def _update_grad_scaler(self):
+        if self._scaler_update_pending:
+            self._grad_scaler.update()
+            self._scaler_update_pending = False
+
+    def _finish_scaler_steps(self):
+        """Update grad scaler and exclude skipped steps from global_steps"""
+        self._update_grad_scaler()
+        if self._skipped_steps is not None:
+            skipped = int(self._skipped_steps.item())
+            self._skipped_steps = None
+            if skipped > 0:
+                self.iterations.global_steps.inc(-skipped)
+                LOG.debug("%d optimizer steps skipped on non-finite gradients", skipped)
+
     def optimizer_step(
         self,
         optimizer: Optimizer,
@@ -323,6 +1096,12 @@ class Loop:
         * Counts how much global_steps are done (differs from iterations/batches
           if you implement eg grad accumulation). This counter can be used as
           MetricsIterationType
+        * If gradient accumulation is enabled, does nothing until the last batch of
+          accumulation window (see :attr:`accumulation_boundary`)
+        * In "fp16" precision gradients are unscaled before `on_before_optimizer_step`,
+          so callbacks can clip them. Step is skipped on inf/nan gradients, such steps
+          are subtracted from global_steps at the end of dataloader pass. Loss scale
+          is updated once per iteration, after steps of all optimizers
 
         Args:
             optimizer: Optimizer to perform step
@@ -332,12 +1111,10 @@ class Loop:
         Returns:
               None
         """
-        self._emit_event("on_before_optimizer_step", optimizer=optimizer)
-        optimizer.step(closure)
-        if zero_grad:
-            optimizer.zero_grad(zero_grad == "set_to_none")
-        self._emit_event("on_after_optimizer_step", optimizer=optimizer)
-        self.iterations.global_steps.inc()
+        if not self._accumulation_boundary:
+            return
+
+        self._step_with_events(optimizer, closure, zero_grad)
 
     def zero_grad_backward_step(
         self,
@@ -354,6 +1131,8 @@ class Loop:
         * Counts how much global_steps are done (differs from iterations/batches
           if you implement eg grad accumulation). This counter can be used as
           MetricsIterationType
+        * If gradient accumulation is enabled, grad is zeroed only on the first batch
+          of accumulation window, and step is done only on the last one
 
         Args:
             loss: loss to call backward on
@@ -365,23 +1144,93 @@ class Loop:
         Returns:
               None
         """
-        optimizer.zero_grad(set_to_none=set_to_none)
+        if self._accumulation_index == 0:
+            optimizer.zero_grad(set_to_none=set_to_none)
 
-        loss.backward(**backward_kwargs)
-        self._emit_event("on_after_backward")
+        self.backward(loss, **backward_kwargs)
 
-        self._emit_event("on_before_optimizer_step", optimizer=optimizer)
-        optimizer.step(closure)
-        self._emit_event("on_after_optimizer_step", optimizer=optimizer)
+        if not self._accumulation_boundary:
+            return None
 
-        self.iterations.global_steps.inc()
+        self._step_with_events(optimizer, closure, zero_grad=False)
 
         return None
 
+    def resume(
+        self, file: Union[str, PathLike], skip_keys: Optional[Sequence[str]] = None
+    ):
+        """Restore training state from checkpoint written by `Loop.state_manager`
+
+        Restores everything attached to loop:
+
+        * models, optimizers, schedulers etc. State of optimizers is loaded
+          right before their first step, so first forward pass isn't delayed
+        * iteration counters, so `iterate_epochs` continues from saved epoch
+          (or the next one, if checkpoint was written in `on_epoch_end`)
+        * position of attached resumable loaders (:obj:`ResumableLoader`,
+          :obj:`DataloaderSchedulerWrapper`)
+        * states of Python, NumPy, torch and CUDA random generators
+        * state of callbacks having `state_dict()/load_state_dict()` (eg best
+          metric values of :obj:`BestModelSaver`, :obj:`BestMetricsReporter`)
+
+        Random generators and callbacks missing in checkpoint are skipped.
+
+        Examples::
+
+            loop.attach(model=model, optimizer=optimizer, train_loader=train_loader)
+            if (loop.logdir / "last.pth").exists():
+                loop.resume(loop.logdir / "last.pth")
+
+        Args:
+            file: checkpoint file or directory
+            skip_keys: keys not to restore
+        """
+        self._loop_state.epoch_completed = False
+        self.state_manager.read_state(file, skip_keys, lazy_optimizers=True)
+        if self._loop_state.epoch_completed:
+            # Saved at the end of epoch, before its counters were incremented
+            self.iterations.current_epoch.inc()
+            self.iterations.global_epochs.inc()
+            self._loop_state.epoch_completed = False
+        LOG.info(
+            "Resumed from %s at epoch %d, batch %d",
+            file,
+            self.iterations.current_epoch,
+            self.iterations.current_batch,
+        )
+
     def run(self, training_procedure: typing.Callable, *args, **kwargs):
-        self._emit_event("on_train_start")
-        training_procedure(self, *args, **kwargs)
-        self._emit_event("on_train_end")
+        completed = False
+        try:
+            self._emit_event("on_train_start")
+            training_procedure(self, *args, **kwargs)
+            self._emit_event("on_train_end")
+            completed = True
+        finally:
+            self._drain_callbacks(raise_errors=completed)
+            if completed:
+                self.state_manager.wait()
+            else:
+                try:
+                    self.state_manager.wait()
+                except Exception:
+                    LOG.exception("Checkpoint write failed")
+
+    def _drain_callbacks(self, raise_errors: bool):
+        """Stop background workers of callbacks having `drain()` (eg :obj:`AsyncCallback`)
+
+        On failed run their errors are logged, so original exception is propagated
+        """
+        for callback in self._callbacks:
+            drain = getattr(callback, "drain", None)
+            if drain is None:
+                continue
+            try:
+                drain()
+            except Exception:
+                if raise_errors:
+                    raise
+                LOG.exception("Callback %s failed while draining", callback)
 
     def launch(self, program: typing.Callable, accelerator: Accelerator, **kwargs):
         """Launch training program on chosen accelerator
@@ -1,5 +1,6 @@
 import logging
 import math
+import threading
 from dataclasses import dataclass
 from typing import TYPE_CHECKING, Dict, List, Union
 
@@ -14,6 +15,16 @@ if TYPE_CHECKING:
 
 LOG = logging.getLogger(__name__)
 
+_COUNTED_ITERATION_TYPES = (
+    IterationType.EPOCHS,
+    IterationType.BATCHES,
+    IterationType.SAMPLES,
+    IterationType.GLOBAL_EPOCHS,
+    IterationType.GLOBAL_BATCHES,
+    IterationType.GLOBAL_STEPS,
+    IterationType.GLOBAL_SAMPLES,
+)
+
 
 @dataclass
 class MetricEntry:
@@ -36,23 +47,37 @@ def _log_non_finit(name: str, value: float):
 class MetricManager:
     r"""
     Collects metrics on batch and epochs
+
+    Logging and collecting entries is thread-safe, so entries can be consumed
+    by callbacks running in background thread.
     """
 
     def __init__(self, loop: "Loop"):
         self._loop = loop
         self._new_entries: List[MetricEntry] = []
+        self._lock = threading.Lock()
         self.latest: Dict[str, MetricEntry] = {}
 
     def reset(self):
-        self._new_entries = []
-        self.latest = {}
+        with self._lock:
+            self._new_entries = []
+            self.latest = {}
 
     def collect_new_entries(self, reset=True) -> List[MetricEntry]:
-        result = self._new_entries
-        if reset:
-            self._new_entries = []
+        with self._lock:
+            result = self._new_entries
+            if reset:
+                self._new_entries = []
+            else:
+                result = list(result)
         return result
 
+    def discard_entries(self, entries: List[MetricEntry]):
+        """Remove given entries from new entries, if they are still there"""
+        ids = {id(e) for e in entries}
+        with self._lock:
+            self._new_entries = [e for e in self._new_entries if id(e) not in ids]
+
     def _guess_iteration_type(self):
         if self._loop._in_dataloader:
             return IterationType.BATCHES
@@ -83,7 +108,8 @@ class MetricManager:
               `MetricIterationType.EPOCHS` or `"epochs"`.
             * Also `MetricIterationType.SAMPLES` or `"samples"` is available and equals to
               number of processed training samples. It can be useful eg when you want to
-              compare data efficiency of different models.
+              compare data efficiency of different models. `"global_samples"` is the same
+              number summed over all processes.
             * If you want to set some specific iteration number you can pass integer instead
               of enum or str. Metric manager will assume this is some custom iteration mode.
             * Anyway, metric values are stored with all possible iteration values and passes
@@ -110,18 +136,16 @@ class MetricManager:
 
         _log_non_finit(name, value)
 
-        iteration_values = {
-            IterationType.EPOCHS: self._loop.iterations.current_epoch,
-            IterationType.BATCHES: self._loop.iterations.current_batch,
-        }
+        iterations = self._loop.iterations
+        iteration_values = {t: int(iterations[t]) for t in _COUNTED_ITERATION_TYPES}
 
         if iteration_type == IterationType.CUSTOM:
             iteration_values[IterationType.CUSTOM] = iteration
 
         entry = MetricEntry(name, value, iteration_type, iteration_values)
-        self._new_entries.append(entry)
-
-        self.latest[name] = entry
+        with self._lock:
+            self._new_entries.append(entry)
+            self.latest[name] = entry
 
     # TODO Raise warn when adding metric with same name on same iteration twice
     # TODO Raise warn if value in latest has different iteration type
@@ -0,0 +1,154 @@
+import queue
+import threading
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+import torch
+from ignite.utils import apply_to_type, convert_tensor
+
+T_batch = TypeVar("T_batch")
+
+_END = object()
+
+
+class _WorkerFailure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+class BatchPrefetcher(Generic[T_batch]):
+    """
+    Iterator fetching batches from iterable in a background thread
+
+    Keeps up to `size` batches fetched and (optionally) moved to `device` ahead of
+    consumer. On CUDA devices copy is issued on a separate stream, so it overlaps
+    with computations of the current step.
+
+    Prefetcher must be closed with :meth:`close` if iteration is stopped early.
+
+    Iterables tracking their position (eg :obj:`ResumableLoader`) are advanced by
+    fetching, ahead of consumer. With `snapshot` set to their `state_dict`, state
+    taken right after every fetch is kept with the batch, and :attr:`consumed_state`
+    is state after the last batch returned to consumer.
+    """
+
+    _POLL_INTERVAL = 0.1
+
+    def __init__(
+        self,
+        iterable: Iterable[T_batch],
+        size: int,
+        device: Optional[torch.device] = None,
+        non_blocking: bool = True,
+        snapshot: Optional[Callable[[], Any]] = None,
+    ):
+        """
+
+        Args:
+            iterable: source of batches, usually dataloader
+            size: how many batches can be fetched ahead
+            device: move all tensors in batch to this device. No moving if `None`
+            non_blocking: passed to `convert_tensor`
+            snapshot: function returning state of iterable, called after every fetch
+        """
+        assert size > 0, "Prefetch size must be positive"
+
+        self.device = torch.device(device) if device is not None else None
+        self.non_blocking = non_blocking
+        self._snapshot = snapshot
+        self.consumed_state = snapshot() if snapshot is not None else None
+
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=size)
+        self._stop = threading.Event()
+        self._stream = None
+        if self.device is not None and self.device.type == "cuda":
+            self._stream = torch.cuda.Stream(self.device)
+
+        self._thread = threading.Thread(
+            target=self._worker, args=(iterable,), daemon=True
+        )
+        self._thread.start()
+
+    def _transfer(self, batch: T_batch) -> Tuple[T_batch, Any]:
+        if self.device is None:
+            return batch, None
+        if self._stream is None:
+            return convert_tensor(batch, self.device, self.non_blocking), None
+
+        with torch.cuda.stream(self._stream):
+            batch = convert_tensor(batch, self.device, self.non_blocking)
+            event = torch.cuda.Event()
+            event.record(self._stream)
+        return batch, event
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=self._POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _worker(self, iterable: Iterable[T_batch]):
+        try:
+            for batch in iterable:
+                state = self._snapshot() if self._snapshot is not None else None
+                if not self._put((*self._transfer(batch), state)):
+                    return
+        except BaseException as e:
+            self._put(_WorkerFailure(e))
+            return
+        self._put(_END)
+
+    def _wait_transfer(self, batch: T_batch, event) -> T_batch:
+        if event is None:
+            return batch
+
+        stream = torch.cuda.current_stream(self.device)
+        stream.wait_event(event)
+
+        def _record(t: torch.Tensor):
+            # Tensor was allocated on side stream,
+            # caching allocator must know it's used on the current one
+            t.record_stream(stream)
+            return t
+
+        return apply_to_type(batch, torch.Tensor, _record)
+
+    def __iter__(self) -> Iterator[T_batch]:
+        return self
+
+    def __next__(self) -> T_batch:
+        if self._stop.is_set():
+            raise StopIteration
+
+        item = self._queue.get()
+        if item is _END:
+            self.close()
+            raise StopIteration
+        if isinstance(item, _WorkerFailure):
+            self.close()
+            raise item.exc
+
+        batch, event, self.consumed_state = item
+        return self._wait_transfer(batch, event)
+
+    def close(self):
+        """Stops background thread and drops prefetched batches"""
+        self._stop.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        if self._thread is not threading.current_thread():
+            self._thread.join()
@@ -0,0 +1,479 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import zipfile
+from copy import deepcopy
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import ignite.distributed as idist
+import numpy as np
+import torch
+
+LOG = logging.getLogger(__name__)
+
+PathLike = Union[str, os.PathLike]
+SaveFn = Callable[[Dict[str, Any], PathLike], None]
+
+
+def atomic_save(obj: Any, file: PathLike):
+    """`torch.save` to temporary file renamed to `file` after successful write"""
+    file = Path(file)
+    tmp_file = file.with_name(f".{file.name}.{os.getpid()}.tmp")
+    try:
+        with tmp_file.open("wb") as f:
+            torch.save(obj, f)
+        os.replace(tmp_file, file)
+    finally:
+        if tmp_file.exists():
+            tmp_file.unlink()
+
+
+class AsyncStateWriter:
+    """
+    Writes state dicts to files in background thread
+
+    On :meth:`write` tensors of state dict are copied to CPU buffers, which are
+    allocated on the first write and reused while shapes and dtypes don't change
+    (buffers for CUDA tensors are pinned). Serialization runs in background thread,
+    writing to temporary file which is atomically renamed, so file is never
+    left partially written.
+
+    At most one write is in flight: next :meth:`write` waits for the previous one.
+    """
+
+    def __init__(self):
+        self._buffers: Dict[Tuple[Any, ...], torch.Tensor] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    def _buffer_for(self, path: Tuple[Any, ...], tensor: torch.Tensor) -> torch.Tensor:
+        buffer = self._buffers.get(path)
+        if (
+            buffer is None
+            or buffer.shape != tensor.shape
+            or buffer.dtype != tensor.dtype
+        ):
+            buffer = torch.empty(
+                tensor.shape,
+                dtype=tensor.dtype,
+                pin_memory=tensor.is_cuda,
+            )
+            self._buffers[path] = buffer
+        return buffer
+
+    def _snapshot(self, value, path: Tuple[Any, ...] = ()):
+        if isinstance(value, torch.Tensor):
+            buffer = self._buffer_for(path, value)
+            buffer.copy_(value.detach(), non_blocking=value.is_cuda)
+            return buffer
+        if isinstance(value, dict):
+            return type(value)(
+                (k, self._snapshot(v, path + (k,))) for k, v in value.items()
+            )
+        if isinstance(value, (list, tuple)) and not hasattr(value, "_fields"):
+            return type(value)(
+                self._snapshot(v, path + (i,)) for i, v in enumerate(value)
+            )
+        return deepcopy(value)
+
+    def snapshot(self, state_dict: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy of state dict with tensors in reused CPU buffers"""
+        snapshot = self._snapshot(state_dict)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return snapshot
+
+    def _write(self, state_dict: Dict[str, Any], file: Path, save: SaveFn):
+        try:
+            save(state_dict, file)
+        except BaseException as e:
+            LOG.error("Asynchronous write of %s failed", file)
+            self._error = e
+
+    def write(
+        self, state_dict: Dict[str, Any], file: PathLike, save: SaveFn = atomic_save
+    ):
+        """Snapshot state dict and start writing it to file with `save`.
+        Returns immediately after snapshot"""
+        self.wait()
+        snapshot = self.snapshot(state_dict)
+        self._thread = threading.Thread(
+            target=self._write,
+            args=(snapshot, Path(file), save),
+            name="matches-state-writer",
+        )
+        self._thread.start()
+
+    @property
+    def pending(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def wait(self):
+        """Wait for write in flight. Re-raises exception occurred in writer"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+
+_FORMAT_KEY = "__matches_format__"
+_BLOB_REF = "__matches_blob__"
+BLOB_DIR = "blobs"
+_MANIFESTS_FILE = "manifests.json"
+_INDEX_FILE = "index.json"
+_UNSAFE_CHARS = re.compile(r"[^\w.-]")
+
+
+def _tensor_bytes(tensor: torch.Tensor) -> np.ndarray:
+    return tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy()
+
+
+def _dtype(name: str) -> torch.dtype:
+    return getattr(torch, name[len("torch.") :])
+
+
+class TorchFormat:
+    """Single file written by `torch.save`"""
+
+    def save(self, state_dict: Dict[str, Any], file: PathLike):
+        atomic_save(state_dict, file)
+
+
+class DedupFormat:
+    """
+    Content-addressed checkpoint: manifest file plus shared blob directory
+
+    Every tensor is stored once in `blobs` directory next to checkpoint file,
+    in file named by hash of its content. Checkpoint file itself is a small
+    manifest referencing blobs, so unchanged tensors (eg frozen backbone)
+    are written once and shared by all checkpoints in the directory
+    (eg `last.pth` and `best.pth`).
+
+    Blobs not referenced by any manifest written to the directory are removed
+    after every save (see :func:`gc_blobs`).
+    """
+
+    def _store(self, tensor: torch.Tensor, blob_dir: Path) -> Dict[str, Any]:
+        # Every save hashes current bytes: in-place updates through `.data`
+        # (EMA, clamping) don't change version counter of tensor
+        data = _tensor_bytes(tensor)
+        hasher = hashlib.sha256(memoryview(data))
+        hasher.update(f"{tensor.dtype}{tuple(tensor.shape)}".encode())
+        digest = hasher.hexdigest()
+
+        blob = blob_dir / digest
+        if not blob.exists():
+            tmp_blob = blob_dir / f".{digest}.{os.getpid()}.tmp"
+            data.tofile(tmp_blob)
+            os.replace(tmp_blob, blob)
+
+        return {
+            _BLOB_REF: digest,
+            "dtype": str(tensor.dtype),
+            "shape": list(tensor.shape),
+        }
+
+    def save(self, state_dict: Dict[str, Any], file: PathLike):
+        file = Path(file)
+        blob_dir = file.parent / BLOB_DIR
+        blob_dir.mkdir(parents=True, exist_ok=True)
+
+        def _replace(value):
+            if isinstance(value, torch.Tensor):
+                return self._store(value, blob_dir)
+            if isinstance(value, dict):
+                return type(value)((k, _replace(v)) for k, v in value.items())
+            if isinstance(value, (list, tuple)) and not hasattr(value, "_fields"):
+                return type(value)(_replace(v) for v in value)
+            return value
+
+        manifest = {_FORMAT_KEY: "dedup", "state": _replace(state_dict)}
+        atomic_save(manifest, file)
+
+        manifests_file = blob_dir / _MANIFESTS_FILE
+        manifests = _read_manifest_names(blob_dir)
+        if file.name not in manifests:
+            manifests.append(file.name)
+            with manifests_file.open("w") as f:
+                json.dump(manifests, f)
+        gc_blobs(file.parent)
+
+
+def _replace_path(src: Path, dst: Path):
+    old = None
+    if dst.is_dir():
+        old = dst.with_name(f".{dst.name}.{os.getpid()}.old")
+        os.replace(dst, old)
+    elif dst.exists():
+        dst.unlink()
+    os.replace(src, dst)
+    if old is not None:
+        shutil.rmtree(old)
+
+
+def _key_file_name(index: int, key: str) -> str:
+    return f"{index}_{_UNSAFE_CHARS.sub('_', key)}.pt"
+
+
+class ShardedFormat:
+    """
+    Checkpoint directory with one `torch.save` file per key and JSON index
+
+    Only files of requested keys are read, so restoring subset of keys (eg only
+    model for evaluation) doesn't load the rest. With torch>=2.1 files are
+    memory-mapped, so tensors are not copied to memory before `load_state_dict`.
+
+    Directory is written under temporary name and renamed after all keys are saved.
+    """
+
+    def save(self, state_dict: Dict[str, Any], file: PathLike):
+        file = Path(file)
+        tmp_dir = file.with_name(f".{file.name}.{os.getpid()}.tmp")
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir()
+        try:
+            names = {}
+            for i, (key, value) in enumerate(state_dict.items()):
+                names[key] = _key_file_name(i, key)
+                torch.save(value, tmp_dir / names[key])
+            with (tmp_dir / _INDEX_FILE).open("w") as f:
+                json.dump({_FORMAT_KEY: "sharded", "keys": names}, f)
+            _replace_path(tmp_dir, file)
+        finally:
+            if tmp_dir.exists():
+                shutil.rmtree(tmp_dir)
+
+
+class Shard:
+    """State of sharded source owned by current rank, see :obj:`DistributedFormat`"""
+
+    def __init__(self, state: Any):
+        self.state = state
+
+
+class Shards(list):
+    """Shards of sharded source needed by current rank, ordered by saved rank
+
+    If world size is the same as in saved run, it's only the shard of current rank,
+    otherwise shards of all saved ranks.
+    """
+
+
+def _barrier():
+    if idist.get_world_size() > 1:
+        idist.barrier()
+
+
+def _check_all_ranks(error: Optional[BaseException], file: Path):
+    """Raise on all ranks if any of them failed. Must be called on all ranks"""
+    failed = error is not None
+    if idist.get_world_size() > 1:
+        failed = bool(idist.all_reduce(int(failed), op="MAX"))
+    if error is not None:
+        raise error
+    if failed:
+        raise RuntimeError(f"Writing checkpoint {file} failed on other rank")
+
+
+class DistributedFormat:
+    """
+    Checkpoint directory written by all ranks in parallel
+
+    Replicated keys are saved by rank 0 to one file per key like
+    :obj:`ShardedFormat`: state of some sources (eg callbacks running on rank 0
+    only) is up to date only there. :obj:`Shard` values (states of sharded
+    sources, eg optimizer partitioned between ranks) are saved by every rank
+    in parallel to its own `shard_<rank>.pt` file. Rank 0 writes JSON index
+    after all ranks finished.
+
+    On load every rank reads replicated keys and its own shard. If world size
+    has changed, all shards of a key are read, so sharded source can take its
+    part. Shards are passed as :obj:`Shards`.
+
+    :meth:`save` must be called on all ranks, and checkpoint directory must be
+    on filesystem shared by all ranks. If writing fails on any rank, temporary
+    directory is removed and all ranks raise.
+    """
+
+    def save(self, state_dict: Dict[str, Any], file: PathLike):
+        file = Path(file)
+        rank, world_size = idist.get_rank(), idist.get_world_size()
+        tmp_dir = file.with_name(f".{file.name}.tmp")
+        if rank == 0:
+            if tmp_dir.exists():
+                shutil.rmtree(tmp_dir)
+            tmp_dir.mkdir()
+        _barrier()
+
+        error = None
+        names, shard = {}, {}
+        try:
+            for i, (key, value) in enumerate(state_dict.items()):
+                if isinstance(value, Shard):
+                    shard[key] = value.state
+                else:
+                    names[key] = _key_file_name(i, key)
+                    if rank == 0:
+                        torch.save(value, tmp_dir / names[key])
+            if shard:
+                torch.save(shard, tmp_dir / f"shard_{rank}.pt")
+        except Exception as e:
+            error = e
+
+        try:
+            _check_all_ranks(error, file)
+            if rank == 0:
+                index = {
+                    _FORMAT_KEY: "distributed",
+                    "keys": names,
+                    "sharded_keys": list(shard),
+                    "world_size": world_size,
+                }
+                try:
+                    with (tmp_dir / _INDEX_FILE).open("w") as f:
+                        json.dump(index, f)
+                    _replace_path(tmp_dir, file)
+                except Exception as e:
+                    error = e
+            # Also waits for rank 0 to finish the checkpoint
+            _check_all_ranks(error, file)
+        finally:
+            if rank == 0 and tmp_dir.exists():
+                shutil.rmtree(tmp_dir)
+
+
+CHECKPOINT_FORMATS = {
+    "torch": TorchFormat,
+    "dedup": DedupFormat,
+    "sharded": ShardedFormat,
+    "distributed": DistributedFormat,
+}
+
+
+def _read_manifest_names(blob_dir: Path) -> List[str]:
+    manifests_file = blob_dir / _MANIFESTS_FILE
+    if not manifests_file.exists():
+        return []
+    with manifests_file.open() as f:
+        return json.load(f)
+
+
+def _blob_refs(value, refs: Set[str]):
+    if isinstance(value, dict):
+        if _BLOB_REF in value:
+            refs.add(value[_BLOB_REF])
+            return
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            _blob_refs(item, refs)
+
+
+def _is_manifest(obj) -> bool:
+    return isinstance(obj, dict) and obj.get(_FORMAT_KEY) == "dedup"
+
+
+def gc_blobs(directory: PathLike) -> int:
+    """Remove blobs of `directory` not referenced by its dedup checkpoints
+
+    Returns:
+        Number of removed blobs
+    """
+    blob_dir = Path(directory) / BLOB_DIR
+    refs: Set[str] = set()
+    for name in _read_manifest_names(blob_dir):
+        manifest_file = Path(directory) / name
+        if manifest_file.is_file():
+            manifest = torch.load(manifest_file, map_location="cpu")
+            if _is_manifest(manifest):
+                _blob_refs(manifest["state"], refs)
+
+    removed = 0
+    for blob in blob_dir.iterdir():
+        if blob.name != _MANIFESTS_FILE and blob.name not in refs:
+            blob.unlink()
+            removed += 1
+    return removed
+
+
+def _resolve_blobs(value, blob_dir: Path):
+    if isinstance(value, dict):
+        if _BLOB_REF in value:
+            data = np.fromfile(blob_dir / value[_BLOB_REF], dtype=np.uint8)
+            tensor = torch.from_numpy(data).view(_dtype(value["dtype"]))
+            return tensor.reshape(value["shape"])
+        return type(value)((k, _resolve_blobs(v, blob_dir)) for k, v in value.items())
+    if isinstance(value, (list, tuple)) and not hasattr(value, "_fields"):
+        return type(value)(_resolve_blobs(v, blob_dir) for v in value)
+    return value
+
+
+def _load_keys(state: Dict[str, Any], keys: Optional[Sequence[str]]):
+    if keys is None:
+        return state
+    return {key: state[key] for key in keys if key in state}
+
+
+# `torch.load(mmap=...)` appeared in torch 2.1
+MMAP_SUPPORTED = "mmap" in inspect.signature(torch.load).parameters
+
+
+def _torch_load(file: Path, mmap: bool):
+    if mmap and MMAP_SUPPORTED and zipfile.is_zipfile(file):
+        return torch.load(file, map_location="cpu", mmap=True)
+    with file.open("rb") as f:
+        return torch.load(f, map_location="cpu")
+
+
+def load_state(
+    file: PathLike, keys: Optional[Sequence[str]] = None, mmap: bool = False
+) -> Dict[str, Any]:
+    """Read state dict written in any of :data:`CHECKPOINT_FORMATS`
+
+    Args:
+        file: checkpoint file or directory
+        keys: keys to read, all by default. Keys missing in checkpoint are skipped
+        mmap: memory-map single file checkpoints (torch>=2.1)
+
+    Files of directory formats are memory-mapped if torch supports it, so only
+    bytes of requested keys are read from disk. Sharded keys of
+    :obj:`DistributedFormat` checkpoint are read as :obj:`Shards`: own shard of
+    current rank if world size is unchanged, shards of all ranks otherwise.
+    """
+    file = Path(file)
+    if file.is_dir():
+        with (file / _INDEX_FILE).open() as f:
+            index = json.load(f)
+        names, sharded_keys = index["keys"], index.get("sharded_keys", [])
+        keys = list(names) + sharded_keys if keys is None else keys
+        state = {
+            key: _torch_load(file / names[key], mmap=True)
+            for key in keys
+            if key in names
+        }
+        if any(key in sharded_keys for key in keys):
+            ranks = range(index["world_size"])
+            if idist.get_world_size() == index["world_size"]:
+                ranks = [idist.get_rank()]
+            shards = [
+                _torch_load(file / f"shard_{rank}.pt", mmap=True) for rank in ranks
+            ]
+            for key in keys:
+                if key in sharded_keys:
+                    state[key] = Shards(shard[key] for shard in shards)
+        return state
+
+    obj = _torch_load(file, mmap)
+    if _is_manifest(obj):
+        state = _load_keys(obj["state"], keys)
+        return _resolve_blobs(state, file.parent / BLOB_DIR)
+    return _load_keys(obj, keys)
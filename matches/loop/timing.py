@@ -0,0 +1,147 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Deque, Dict, Optional, Sequence
+
+import ignite.distributed as idist
+import numpy as np
+import torch
+
+from .iteration import IterationType
+
+if TYPE_CHECKING:
+    from matches.loop import Loop
+
+PHASES = (
+    "data_wait",
+    "transfer",
+    "forward",
+    "backward",
+    "optimizer_step",
+    "callbacks",
+)
+
+
+class StepTimer:
+    """
+    Measures durations of train step phases and logs their rolling percentiles
+
+    Phases:
+
+    * `data_wait` -- waiting for batch from dataloader (or prefetcher)
+    * `transfer` -- moving batch to device (zero with prefetching, it's done in background)
+    * `forward` -- user code from getting batch to first `backward`/`optimizer_step`
+    * `backward` -- `Loop.backward` call
+    * `optimizer_step` -- optimizer (and grad scaler) step and zero grad
+    * `callbacks` -- all callback handlers emitted during iteration
+    * `total` -- whole iteration
+
+    Only train dataloader iterations are measured. Percentiles over last `window`
+    iterations are logged as batch metrics `time/<phase>/p<percentile>` (seconds)
+    every `log_every` iterations.
+
+    Examples::
+
+        loop = Loop(logdir, callbacks, step_timer=StepTimer(log_every=50))
+    """
+
+    def __init__(
+        self,
+        window: int = 100,
+        log_every: int = 100,
+        percentiles: Sequence[int] = (50, 90, 99),
+        sync_device: bool = False,
+    ):
+        """
+
+        Args:
+            window: number of last iterations used for percentiles
+            log_every: log percentiles every `log_every` iterations
+            percentiles: percentiles to log
+            sync_device: synchronize CUDA device on phase boundaries. Makes measurements
+                of asynchronous device work precise, but slows training down
+        """
+        self.log_every = log_every
+        self.percentiles = tuple(percentiles)
+        self.sync_device = sync_device
+
+        self._history: Dict[str, Deque[float]] = {
+            phase: deque(maxlen=window) for phase in PHASES + ("total",)
+        }
+        self._current: Dict[str, float] = {}
+        self._iteration_start: Optional[float] = None
+        self._forward_start: Optional[float] = None
+        self._iterations = 0
+
+    @property
+    def active(self) -> bool:
+        """Whether iteration is being measured now"""
+        return self._iteration_start is not None
+
+    def _now(self) -> float:
+        if self.sync_device and idist.device().type == "cuda":
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def start_iteration(self):
+        self._current = dict.fromkeys(PHASES, 0.0)
+        self._forward_start = None
+        self._iteration_start = self._now()
+
+    def cancel_iteration(self):
+        """Stop measuring current iteration without recording it"""
+        self._iteration_start = None
+        self._forward_start = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """Measure block as phase `name` of current iteration"""
+        if not self.active:
+            yield
+            return
+
+        self._finish_forward()
+        start = self._now()
+        try:
+            yield
+        finally:
+            self._current[name] += self._now() - start
+
+    def start_forward(self):
+        if self.active:
+            self._forward_start = self._now()
+
+    def _finish_forward(self):
+        if self._forward_start is not None:
+            self._current["forward"] += self._now() - self._forward_start
+            self._forward_start = None
+
+    def end_iteration(self, loop: "Loop"):
+        if not self.active:
+            return
+
+        self._finish_forward()
+        self._current["total"] = self._now() - self._iteration_start
+        self._iteration_start = None
+
+        for phase, duration in self._current.items():
+            self._history[phase].append(duration)
+
+        self._iterations += 1
+        if self._iterations % self.log_every == 0:
+            self.log(loop)
+
+    def summary(self) -> Dict[str, Dict[int, float]]:
+        """Percentiles of phase durations over current window"""
+        return {
+            phase: dict(zip(self.percentiles, np.percentile(values, self.percentiles)))
+            for phase, values in self._history.items()
+            if len(values) > 0
+        }
+
+    def log(self, loop: "Loop"):
+        for phase, percentiles in self.summary().items():
+            for p, value in percentiles.items():
+                loop.metrics.log(
+                    f"time/{phase}/p{p}", value, iteration=IterationType.BATCHES
+                )
@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+import weakref
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional, Union
+from warnings import warn
+
+import ignite.distributed as idist
+from torch.utils.data import DataLoader
+
+from matches.utils import dump_json
+
+from .loader_scheduling import clone_dataloader, is_clonable
+
+if TYPE_CHECKING:
+    from matches.loop import Loop
+
+LOG = logging.getLogger(__name__)
+
+
+class _TunedLoader:
+    # Doesn't reference original loader, it's a weak key of `WorkerTuner._loaders`
+    def __init__(self, key: str, settings: Dict[str, Any]):
+        self.key = key
+        self.settings = settings
+        self.current: Optional[DataLoader] = None
+
+    def drop_current(self):
+        """Forget tuned copy and stop its persistent workers"""
+        if self.current is not None:
+            iterator = getattr(self.current, "_iterator", None)
+            if iterator is not None and hasattr(iterator, "_shutdown_workers"):
+                iterator._shutdown_workers()
+            self.current._iterator = None
+            self.current = None
+
+
+def _loader_key(loader: DataLoader) -> str:
+    try:
+        length = len(loader.dataset)
+    except TypeError:
+        length = None
+    return f"{type(loader.dataset).__name__}/{length}/{loader.batch_size}"
+
+
+class WorkerTuner:
+    """
+    Tunes `num_workers` and `prefetch_factor` of train DataLoader by measured data wait
+
+    After every train dataloader pass share of time spent waiting for batches
+    (first batch excluded, it includes workers startup) is compared with
+    `max_wait_ratio`. If it's higher, number of workers is doubled (up to
+    `max_workers`), then prefetch factor is doubled. Loader is recreated
+    with new settings before the next pass. Tuning of loader stops once wait ratio is
+    below threshold, and chosen settings are saved to `state_file` to be used
+    from the start in the next run.
+
+    Wait ratio and number of workers are logged as `data/wait_ratio` and
+    `data/num_workers`.
+
+    Only clonable (see :func:`~matches.loop.loader_scheduling.is_clonable`)
+    :obj:`DataLoader` objects passed to `Loop.iterate_dataloader` in "train" mode
+    are tuned, inside loop they are replaced with tuned copies.
+    Copies are kept while original loader is alive, workers of outdated copy are
+    shut down when it's recreated.
+
+    Examples::
+
+        loop = Loop(logdir, callbacks, worker_tuner=WorkerTuner(max_wait_ratio=0.05))
+    """
+
+    def __init__(
+        self,
+        max_wait_ratio: float = 0.1,
+        max_workers: Optional[int] = None,
+        max_prefetch_factor: int = 8,
+        state_file: Optional[Union[str, Path]] = None,
+    ):
+        """
+
+        Args:
+            max_wait_ratio: acceptable share of train pass time spent waiting for data
+            max_workers: maximum number of workers, number of CPUs available
+                to process divided by number of local processes by default. Default
+                is computed on first use, so tuner can be created before distributed
+                processes are launched
+            max_prefetch_factor: maximum prefetch factor
+            state_file: JSON file to persist chosen settings. By default it's
+                `worker_tuner.json` in loop logdir. Set path shared between runs
+                to reuse settings in new logdirs
+        """
+        self.max_wait_ratio = max_wait_ratio
+        self._max_workers = max_workers
+        self.max_prefetch_factor = max_prefetch_factor
+        self.state_file = state_file
+
+        self._loaders: "weakref.WeakKeyDictionary[DataLoader, _TunedLoader]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._saved: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @property
+    def max_workers(self) -> int:
+        if self._max_workers is None:
+            if hasattr(os, "sched_getaffinity"):
+                cpus = len(os.sched_getaffinity(0))
+            else:
+                cpus = os.cpu_count() or 1
+            self._max_workers = max(1, cpus // idist.get_nproc_per_node())
+        return self._max_workers
+
+    def _state_path(self, loop: "Loop") -> Path:
+        if self.state_file is not None:
+            return Path(self.state_file)
+        return loop.logdir / "worker_tuner.json"
+
+    def _load_saved(self, loop: "Loop") -> Dict[str, Dict[str, Any]]:
+        if self._saved is None:
+            path = self._state_path(loop)
+            self._saved = {}
+            if path.exists():
+                with open(path) as f:
+                    self._saved = json.load(f)
+        return self._saved
+
+    def _save(self, loop: "Loop", tuned: _TunedLoader):
+        saved = self._load_saved(loop)
+        saved[tuned.key] = tuned.settings
+        if idist.get_rank() == 0:
+            path = self._state_path(loop)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            dump_json(saved, path)
+
+    def loader(self, loop: "Loop", dataloader):
+        """Tuned replacement of dataloader"""
+        if not isinstance(dataloader, DataLoader):
+            return dataloader
+        if not is_clonable(dataloader):
+            warn(
+                f"{type(dataloader).__name__} overrides DataLoader.__init__ "
+                "and can't be tuned"
+            )
+            return dataloader
+
+        tuned = self._loaders.get(dataloader)
+        if tuned is None:
+            key = _loader_key(dataloader)
+            settings = self._load_saved(loop).get(key)
+            if settings is None:
+                settings = {
+                    "num_workers": dataloader.num_workers,
+                    "prefetch_factor": dataloader.prefetch_factor or 2,
+                    "converged": False,
+                }
+            else:
+                LOG.info("Using saved dataloader settings %s", settings)
+            tuned = _TunedLoader(key, dict(settings))
+            self._loaders[dataloader] = tuned
+
+        if tuned.current is None:
+            num_workers = tuned.settings["num_workers"]
+            tuned.current = clone_dataloader(
+                dataloader,
+                num_workers=num_workers,
+                prefetch_factor=tuned.settings["prefetch_factor"],
+                persistent_workers=num_workers > 0,
+            )
+        return tuned.current
+
+    def update(self, loop: "Loop", dataloader, wait_time: float, elapsed: float):
+        """Adjust settings of dataloader by data wait in the last pass
+
+        Args:
+            loop: loop
+            dataloader: dataloader passed to :meth:`loader`
+            wait_time: time spent waiting for batches
+            elapsed: pass duration
+        """
+        if not isinstance(dataloader, DataLoader):
+            return
+        tuned = self._loaders.get(dataloader)
+        if tuned is None or elapsed <= 0:
+            return
+
+        wait_ratio = wait_time / elapsed
+        if idist.get_world_size() > 1:
+            wait_ratio = float(idist.all_reduce(wait_ratio, op="MAX"))
+        settings = tuned.settings
+        loop.metrics.log("data/wait_ratio", wait_ratio)
+        loop.metrics.log("data/num_workers", settings["num_workers"])
+
+        if settings["converged"]:
+            return
+        if wait_ratio <= self.max_wait_ratio:
+            settings["converged"] = True
+        elif settings["num_workers"] < self.max_workers:
+            settings["num_workers"] = min(
+                max(1, settings["num_workers"] * 2), self.max_workers
+            )
+            tuned.drop_current()
+        elif settings["prefetch_factor"] < self.max_prefetch_factor:
+            settings["prefetch_factor"] = min(
+                settings["prefetch_factor"] * 2, self.max_prefetch_factor
+            )
+            tuned.drop_current()
+        else:
+            LOG.warning(
+                "Data wait ratio %.2f is above %.2f with maximum workers and prefetch",
+                wait_ratio,
+                self.max_wait_ratio,
+            )
+            settings["converged"] = True
+
+        if tuned.current is None:
+            LOG.info(
+                "Data wait ratio %.2f, recreating dataloader with %s",
+                wait_ratio,
+                settings,
+            )
+        self._save(loop, tuned)
@@ -0,0 +1,239 @@
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import ignite.distributed as idist
+import torch
+from ignite.utils import convert_tensor
+from torch import nn
+from torch.utils.data import Dataset
+from torch.utils.data.dataloader import default_collate
+
+from matches.data.cache import flatten_sample
+from matches.loop import Loop
+from matches.utils import dump_json
+
+LOG = logging.getLogger(__name__)
+
+_CACHE_FILE = "batch_size.json"
+_OOM_MESSAGES = ("out of memory", "can't allocate memory")
+
+
+def _read_proc_kib(path: str, field: str) -> Optional[int]:
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class _CudaMemory:
+    def __init__(self, device: torch.device):
+        self.device = device
+
+    def default_budget(self) -> int:
+        return int(torch.cuda.get_device_properties(self.device).total_memory * 0.9)
+
+    def reset(self):
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(self.device)
+
+    def peak(self) -> int:
+        return torch.cuda.max_memory_allocated(self.device)
+
+
+class _ProcessMemory:
+    """Peak resident set size of process (Linux)"""
+
+    def default_budget(self) -> int:
+        rss = _read_proc_kib("/proc/self/status", "VmRSS")
+        available = _read_proc_kib("/proc/meminfo", "MemAvailable")
+        assert (
+            rss is not None and available is not None
+        ), "Can't read process memory, set memory_budget explicitly"
+        return int((rss + available) * 0.9)
+
+    def reset(self):
+        # Resets peak RSS (VmHWM), Linux 4.0+
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+    def peak(self) -> int:
+        peak = _read_proc_kib("/proc/self/status", "VmHWM")
+        if peak is None:
+            peak = _read_proc_kib("/proc/self/status", "VmRSS")
+        return peak or 0
+
+
+def _is_oom(e: BaseException) -> bool:
+    return isinstance(e, RuntimeError) and any(m in str(e) for m in _OOM_MESSAGES)
+
+
+def _cache_key(
+    model: nn.Module, sample: Any, device: torch.device, budget: Optional[int]
+) -> str:
+    # Default budget depends on currently available memory, it's not a part of key
+    _, tensors = flatten_sample(sample)
+    signature = {
+        "model": type(model).__name__,
+        "parameters": [
+            [name, list(p.shape), str(p.dtype), p.requires_grad]
+            for name, p in model.named_parameters()
+        ],
+        "input": [[list(t.shape), str(t.dtype)] for t in tensors],
+        "device": device.type,
+        "world_size": idist.get_world_size(),
+        "budget": budget,
+    }
+    dumped = json.dumps(signature, sort_keys=True)
+    return hashlib.sha1(dumped.encode()).hexdigest()
+
+
+def find_max_batch_size(
+    loop: Loop,
+    step_fn: Callable[[Any], Any],
+    dataset: Dataset,
+    model: nn.Module,
+    *,
+    start: int = 1,
+    max_batch_size: Optional[int] = None,
+    memory_budget: Optional[int] = None,
+    collate_fn: Callable = default_collate,
+    use_cache: bool = True,
+) -> int:
+    """
+    Finds the largest batch size which train step fits into memory budget
+
+    Batch size is doubled until step fails with out-of-memory error or exceeds
+    budget, then it's refined with binary search. Memory is peak CUDA memory
+    allocated on CUDA devices, and peak process RSS on CPU.
+
+    Result is cached in `loop.logdir / "batch_size.json"` by model parameters
+    signature, sample shapes, device type and explicitly set budget, so repeated
+    runs skip the search. In distributed run every probe is agreed between
+    processes (batch size fits only if it fits on all of them), so all processes
+    try the same batch sizes and return the same result. Cache is read and written
+    by process with rank 0.
+
+    Combine with :meth:`Loop.iterate_micro_batches` to train with larger batch::
+
+        micro_batch_size = find_max_batch_size(loop, train_step, train_ds, model)
+        for batch in loop.iterate_dataloader(train_loader, mode="train"):
+            for micro_batch in loop.iterate_micro_batches(batch, micro_batch_size):
+                train_step(micro_batch)
+            loop.optimizer_step(optimizer)
+
+    Args:
+        loop: loop providing logdir for cache
+        step_fn: function doing forward and backward for batch (already moved
+            to default device). It must not update model weights
+        dataset: dataset to take samples from
+        model: trained model, its gradients are cleared after every trial and
+            buffers (eg BatchNorm running statistics) are restored after search
+        start: initial batch size, smaller sizes are tried if it doesn't fit
+        max_batch_size: upper bound of batch size
+        memory_budget: memory limit in bytes. By default it's 90% of CUDA device
+            memory or 90% of process RSS plus available system memory
+        collate_fn: function making batch from list of samples
+        use_cache: read and update cached result
+
+    Returns:
+        Maximum batch size
+    """
+    device = idist.device()
+    world_size = idist.get_world_size()
+    memory = _CudaMemory(device) if device.type == "cuda" else _ProcessMemory()
+
+    cache_path = Path(loop.logdir) / _CACHE_FILE
+    key = _cache_key(model, dataset[0], device, memory_budget)
+    cache = {}
+    cached = 0
+    if idist.get_rank() == 0 and cache_path.exists():
+        with open(cache_path) as f:
+            cache = json.load(f)
+        if use_cache:
+            cached = cache.get(key, 0)
+    if world_size > 1:
+        cached = int(idist.broadcast(cached, src=0))
+    if cached:
+        LOG.info("Using cached max batch size %d", cached)
+        return cached
+
+    if memory_budget is None:
+        memory_budget = memory.default_budget()
+
+    def fits(batch_size: int) -> bool:
+        samples = [dataset[i % len(dataset)] for i in range(batch_size)]
+        batch = convert_tensor(collate_fn(samples), device)
+        memory.reset()
+        try:
+            step_fn(batch)
+            peak = memory.peak()
+        except RuntimeError as e:
+            if not _is_oom(e):
+                raise
+            peak = None
+        finally:
+            model.zero_grad(set_to_none=True)
+            del batch
+        result = peak is not None and peak <= memory_budget
+        LOG.debug("Batch size %d fits: %s (peak memory %s)", batch_size, result, peak)
+        if world_size > 1:
+            # Same decision on all processes keeps their searches (and collectives
+            # inside step_fn) in lockstep
+            result = bool(idist.all_reduce(int(result), op="MIN"))
+        return result
+
+    started = time.perf_counter()
+    # Probes update buffers (eg BatchNorm running stats), they are restored after
+    buffers = [(b, b.detach().to("cpu", copy=True)) for b in model.buffers()]
+    try:
+        largest_fitting, smallest_failing = 0, None
+        batch_size = start if max_batch_size is None else min(start, max_batch_size)
+        # Exponential growth
+        while smallest_failing is None:
+            if not fits(batch_size):
+                smallest_failing = batch_size
+            elif batch_size == max_batch_size:
+                largest_fitting = batch_size
+                break
+            else:
+                largest_fitting = batch_size
+                batch_size *= 2
+                if max_batch_size is not None:
+                    batch_size = min(batch_size, max_batch_size)
+        # Binary search
+        if smallest_failing is not None:
+            while smallest_failing - largest_fitting > 1:
+                batch_size = (largest_fitting + smallest_failing) // 2
+                if fits(batch_size):
+                    largest_fitting = batch_size
+                else:
+                    smallest_failing = batch_size
+    finally:
+        with torch.no_grad():
+            for buffer, saved in buffers:
+                buffer.copy_(saved)
+
+    if largest_fitting == 0:
+        raise RuntimeError("Batch size 1 doesn't fit into memory budget")
+
+    LOG.info(
+        "Found max batch size %d in %.1f s",
+        largest_fitting,
+        time.perf_counter() - started,
+    )
+    if use_cache and idist.get_rank() == 0:
+        cache[key] = largest_fitting
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        dump_json(cache, cache_path)
+    return largest_fitting
@@ -27,6 +27,21 @@ class MetricBestSetup:
             return True
         return False
 
+    def state_dict(self) -> Dict[str, Union[float, int, None]]:
+        return {
+            "best_value": float(self.best_value),
+            # Epoch index can be counter of loop, which is not plain int
+            "best_epoch_idx": (
+                None if self.best_epoch_idx is None else int(self.best_epoch_idx)
+            ),
+            "total_epochs_num": self.total_epochs_num,
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Union[float, int, None]]):
+        self.best_value = state_dict["best_value"]
+        self.best_epoch_idx = state_dict["best_epoch_idx"]
+        self.total_epochs_num = state_dict["total_epochs_num"]
+
     def to_dict(self) -> Dict[str, Union[str, float, int]]:
         return {
             "metric_name": self.name,
@@ -1,7 +1,60 @@
 from contextlib import contextmanager
-from typing import Dict, List
+from typing import List, Optional, Tuple
+from weakref import WeakKeyDictionary
 
 from torch import nn
+from torch.nn.modules import module as _torch_module
+
+# Flattened submodules/parameters are cached per root module.
+# Cache is invalidated on any submodule or parameter registration in the process
+# (tracked with torch global registration hooks). Torch has no hooks for deletion
+# (`del module.child`), call `invalidate_module_cache()` after such changes.
+_structure_version = 0
+_TRACK_STRUCTURE = hasattr(
+    _torch_module, "register_module_module_registration_hook"
+) and hasattr(_torch_module, "register_module_parameter_registration_hook")
+
+
+def _on_structure_change(*args):
+    global _structure_version
+    _structure_version += 1
+
+
+if _TRACK_STRUCTURE:
+    _torch_module.register_module_module_registration_hook(_on_structure_change)
+    _torch_module.register_module_parameter_registration_hook(_on_structure_change)
+
+
+class _FlatModule:
+    # Must not reference root module, it's a weak key of the cache
+    def __init__(self, module: nn.Module):
+        self.version = _structure_version
+        self.submodules: List[nn.Module] = list(module.modules())[1:]
+        self.parameters: List[nn.Parameter] = list(module.parameters())
+
+
+_flat_cache: "WeakKeyDictionary[nn.Module, _FlatModule]" = WeakKeyDictionary()
+
+
+def _flatten(module: nn.Module) -> _FlatModule:
+    flat = _flat_cache.get(module)
+    if flat is None or flat.version != _structure_version or not _TRACK_STRUCTURE:
+        flat = _FlatModule(module)
+        _flat_cache[module] = flat
+    return flat
+
+
+def invalidate_module_cache(module: Optional[nn.Module] = None):
+    """
+    Drops cached flattened structure of module (or all modules if `None`)
+
+    Required only after removing submodules or parameters, other structure
+    changes are tracked automatically.
+    """
+    if module is None:
+        _flat_cache.clear()
+    else:
+        _flat_cache.pop(module, None)
 
 
 @contextmanager
@@ -16,15 +69,15 @@ def no_grad_for_module(mod: nn.Module):
     Returns: None
 
     """
-    old_state = {}
+    parameters = _flatten(mod).parameters
+    old_state = [p.requires_grad for p in parameters]
     try:
-        for name, tensor in mod.named_parameters():
-            old_state[name] = tensor.requires_grad
-            tensor.requires_grad_(False)
+        for p in parameters:
+            p.requires_grad_(False)
         yield
     finally:
-        for name, tensor in mod.named_parameters():
-            tensor.requires_grad_(old_state[name])
+        for p, requires_grad in zip(parameters, old_state):
+            p.requires_grad_(requires_grad)
 
 
 @contextmanager
@@ -40,20 +93,19 @@ def module_train(*modules: nn.Module, train=True):
     Returns: None
 
     """
-    old_states: List[Dict[str, bool]] = []
+    old_states: List[Tuple[List[nn.Module], List[bool]]] = []
 
     try:
         for module in modules:
-            old_state = {}
-            for name, child in module.named_modules():
-                old_state[name] = child.training
+            children = [module, *_flatten(module).submodules]
+            old_states.append((children, [child.training for child in children]))
+            for child in children:
                 child.training = train
-            old_states.append(old_state)
         yield
     finally:
-        for module, old_state in zip(modules, old_states):
-            for name, child in module.named_modules():
-                child.training = old_state[name]
+        for children, old_state in old_states:
+            for child, training in zip(children, old_state):
+                child.training = training
 
 
 def module_eval(mod: nn.Module):
@@ -1,11 +1,14 @@
 import typing
 from enum import Enum
-from typing import Optional, Protocol, Union
+from typing import Any, Dict, List, Optional, Protocol, Union
 
 import torch
 from matches.loop import Loop
 from torch.optim.optimizer import Optimizer
 
+if typing.TYPE_CHECKING:
+    from torch.distributed.optim import ZeroRedundancyOptimizer
+
 
 class SchedulerScopeType(Enum):
     EPOCH = "epoch"
@@ -93,3 +96,56 @@ def scheduler_step_epoch(
 def simple_gd_step(loop: Loop, optimizer: Optimizer, loss: torch.Tensor):
     loop.backward(loss)
     loop.optimizer_step(optimizer)
+
+
+class ZeroOptimizerState:
+    """
+    Sharded state source of :obj:`ZeroRedundancyOptimizer`
+
+    With `StateManager(checkpoint_format="distributed")` every rank saves
+    state of parameters it owns, without consolidating full optimizer
+    state on one rank. On load every rank reads its own shard. If world
+    size differs from the saved run, shards of all saved ranks are merged
+    and every rank takes state of its current partition.
+
+    Examples::
+
+        optimizer = ZeroRedundancyOptimizer(model.parameters(), torch.optim.Adam)
+        loop.attach(optimizer=ZeroOptimizerState(optimizer))
+    """
+
+    def __init__(self, optimizer: "ZeroRedundancyOptimizer"):
+        self.optimizer = optimizer
+
+    def _param_indices(self) -> Dict[torch.Tensor, int]:
+        params = (p for group in self.optimizer.param_groups for p in group["params"])
+        return {p: i for i, p in enumerate(params)}
+
+    def sharded_state_dict(self) -> Dict[str, Any]:
+        indices = self._param_indices()
+        param_groups = []
+        for group in self.optimizer.param_groups:
+            param_group = {k: v for k, v in group.items() if k != "params"}
+            param_group["params"] = [indices[p] for p in group["params"]]
+            param_groups.append(param_group)
+        return {
+            "state": {
+                indices[p]: state for p, state in self.optimizer.optim.state.items()
+            },
+            "param_groups": param_groups,
+        }
+
+    def load_sharded_state_dict(self, shards: List[Dict[str, Any]]):
+        state: Dict[int, Any] = {}
+        for shard in shards:
+            state.update(shard["state"])
+        self.optimizer.load_state_dict(
+            {"state": state, "param_groups": shards[0]["param_groups"]}
+        )
+
+    def state_dict(self):
+        # Requires `consolidate_state_dict` called on all ranks before
+        return self.optimizer.state_dict()
+
+    def load_state_dict(self, state_dict):
+        self.optimizer.load_state_dict(state_dict)
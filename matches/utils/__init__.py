@@ -1,4 +1,5 @@
 from .utils import (
+    RNGState,
     dump_json,
     makedir,
     seed_everything,
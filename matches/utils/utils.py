@@ -1,15 +1,18 @@
 import json
+import logging
 import os
 import random
 from datetime import datetime
 from functools import wraps
 from os import PathLike
 from pathlib import Path
-from typing import Any, Callable, Dict, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Union
 
 import numpy as np
 import torch
-from ignite.distributed import get_world_size
+from ignite.distributed import get_rank, get_world_size
+
+LOG = logging.getLogger(__name__)
 
 
 def single_process_only() -> Callable:
@@ -43,6 +46,63 @@ def seed_everything(seed: int) -> int:
     return seed
 
 
+class RNGState:
+    """
+    State source of Python, NumPy, torch and CUDA random generators
+
+    Attached to every `Loop`, so resumed run continues random streams. Single
+    file checkpoints are written by rank 0 and hold only its state: it's restored
+    on rank 0, other ranks keep their current state (restoring rank 0 state there
+    would make all ranks draw the same random numbers). With "distributed"
+    checkpoint format every rank restores its own state.
+    """
+
+    def state_dict(self) -> Dict[str, Any]:
+        name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+        state = {
+            "python": random.getstate(),
+            "numpy": [
+                name,
+                torch.from_numpy(keys.astype(np.int64)),
+                pos,
+                has_gauss,
+                cached_gaussian,
+            ],
+            "torch": torch.get_rng_state(),
+        }
+        if torch.cuda.is_available():
+            state["cuda"] = torch.cuda.get_rng_state_all()
+        return state
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        if get_world_size() > 1 and get_rank() > 0:
+            LOG.warning(
+                "Checkpoint holds random generators state of rank 0 only, "
+                "not restoring it on rank %d. Use distributed checkpoint format "
+                "to restore states of all ranks",
+                get_rank(),
+            )
+            return
+        self._restore(state_dict)
+
+    def _restore(self, state_dict: Dict[str, Any]):
+        version, internal_state, gauss = state_dict["python"]
+        random.setstate((version, tuple(internal_state), gauss))
+        name, keys, pos, has_gauss, cached_gaussian = state_dict["numpy"]
+        np.random.set_state(
+            (name, keys.numpy().astype(np.uint32), pos, has_gauss, cached_gaussian)
+        )
+        torch.set_rng_state(state_dict["torch"])
+        if "cuda" in state_dict and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(state_dict["cuda"])
+
+    def sharded_state_dict(self) -> Dict[str, Any]:
+        return self.state_dict()
+
+    def load_sharded_state_dict(self, shards: List[Dict[str, Any]]):
+        self._restore(shards[get_rank() % len(shards)])
+
+
 def setup_cudnn_reproducibility(
     deterministic: bool = None, benchmark: bool = None
 ) -> None:
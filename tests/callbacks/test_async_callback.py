@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+from matches.callbacks import AsyncCallback, Callback
+from matches.loop import Loop
+
+FAKE_TRAIN_DL = [f"train_{i}" for i in range(5)]
+
+
+class SlowRecorder(Callback):
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.history = []
+        self.threads = set()
+
+    def on_iteration_end(self, loop: "Loop", batch_no: int):
+        time.sleep(self.delay)
+        self.threads.add(threading.current_thread())
+        self.history.append(("iteration", batch_no))
+
+    def on_epoch_end(self, loop: "Loop", epoch_no: int, total_epochs: int):
+        self.history.append(("epoch", epoch_no, loop.metrics.latest["value"].value))
+
+
+class FailingCallback(Callback):
+    def on_iteration_end(self, loop: "Loop", batch_no: int):
+        raise KeyError("sink is broken")
+
+
+def _train(loop: Loop):
+    for epoch in loop.iterate_epochs(2):
+        for _ in loop.iterate_dataloader(FAKE_TRAIN_DL, mode="train"):
+            pass
+        loop.metrics.log("value", epoch)
+
+
+def test_events_processed_in_order_and_drained(tmpdir):
+    recorder = SlowRecorder(delay=0.01)
+    loop = Loop(tmpdir, [AsyncCallback(recorder, max_queue_size=2)])
+    loop.run(_train)
+
+    expected = []
+    for epoch in range(2):
+        expected += [("iteration", i) for i in range(len(FAKE_TRAIN_DL))]
+        expected.append(("epoch", epoch, epoch))
+
+    assert recorder.history == expected
+    assert threading.main_thread() not in recorder.threads
+
+
+def test_drop_oldest_keeps_epoch_events(tmpdir):
+    recorder = SlowRecorder(delay=0.05)
+    callback = AsyncCallback(recorder, max_queue_size=1, backpressure="drop-oldest")
+    Loop(tmpdir, [callback]).run(_train)
+
+    assert callback.dropped_events > 0
+    assert [h for h in recorder.history if h[0] == "epoch"] == [
+        ("epoch", 0, 0),
+        ("epoch", 1, 1),
+    ]
+
+
+def test_worker_exception_surfaces_in_main_thread(tmpdir):
+    loop = Loop(tmpdir, [AsyncCallback(FailingCallback())])
+
+    with pytest.raises(KeyError):
+        loop.run(_train)
+
+
+class EntriesRecorder(Callback):
+    def __init__(self):
+        self.entries = []
+        self.batches = []
+
+    def _collect(self, loop: "Loop"):
+        entries = loop.metrics.collect_new_entries()
+        self.entries += [e.value for e in entries if e.name == "value"]
+
+    def on_iteration_end(self, loop: "Loop", batch_no: int):
+        time.sleep(0.01)
+        self.batches.append(int(loop.iterations.current_batch))
+        self._collect(loop)
+
+    def on_epoch_end(self, loop: "Loop", epoch_no: int, total_epochs: int):
+        self._collect(loop)
+
+
+def test_entries_and_counters_frozen_at_emission(tmpdir):
+    recorder = EntriesRecorder()
+    loop = Loop(tmpdir, [AsyncCallback(recorder)])
+
+    def train(loop: Loop):
+        for epoch in loop.iterate_epochs(2):
+            for batch_no, _ in enumerate(
+                loop.iterate_dataloader(FAKE_TRAIN_DL, mode="train")
+            ):
+                loop.metrics.log("value", epoch * 10 + batch_no)
+
+    loop.run(train)
+
+    # Entries survive `metrics.reset()` at epoch start and are not duplicated
+    assert recorder.entries == [0, 1, 2, 3, 4, 10, 11, 12, 13, 14]
+    assert recorder.batches == list(range(1, 11))
+
+
+def test_worker_stopped_when_training_fails(tmpdir):
+    callback = AsyncCallback(SlowRecorder(delay=0.01))
+    loop = Loop(tmpdir, [callback])
+
+    def train(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for _ in loop.iterate_dataloader(FAKE_TRAIN_DL, mode="train"):
+                pass
+            raise ValueError("training failed")
+
+    with pytest.raises(ValueError):
+        loop.run(train)
+    assert callback._thread is None
@@ -0,0 +1,51 @@
+import pytest
+import torch
+
+from matches.callbacks import ProfilerCallback
+from matches.loop import Loop
+
+
+def test_profiler_writes_traces(tmpdir):
+    model = torch.nn.Linear(3, 1)
+    optim = torch.optim.SGD(model.parameters(), lr=0.1)
+    profiler = ProfilerCallback(wait=1, warmup=1, active=2)
+    loop = Loop(tmpdir, [profiler])
+    loop.attach(model=model)
+    recording = []
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for x in loop.iterate_dataloader([torch.randn(4, 3)] * 6, mode="train"):
+                recording.append(loop.record_phases)
+                loop.backward(model(x).mean())
+                loop.optimizer_step(optim)
+
+    loop.run(run)
+
+    assert recording == [False, True, True, True, False, False]
+    assert not loop.record_phases
+
+    output = loop.logdir / "profiler"
+    traces = list(output.glob("trace_rank0_step*.json"))
+    assert len(traces) == 1
+    assert "matches/backward" in traces[0].read_text()
+    assert len(list(output.glob("key_averages_rank0_step*.txt"))) == 1
+
+
+def test_profiler_stopped_when_training_fails(tmpdir):
+    profiler = ProfilerCallback(wait=0, warmup=0, active=3)
+    loop = Loop(tmpdir, [profiler])
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for x in loop.iterate_dataloader([torch.randn(4, 3)] * 6, mode="train"):
+                if loop.iterations.current_batch == 1:
+                    raise ValueError("Training failed")
+
+    with pytest.raises(ValueError):
+        loop.run(run)
+
+    assert profiler.profiler is None
+    assert not loop.record_phases
+    # Interrupted cycle is written
+    assert len(list((loop.logdir / "profiler").glob("trace_rank0_step*.json"))) == 1
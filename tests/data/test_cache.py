@@ -0,0 +1,71 @@
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from matches.data import CachedDataset
+from matches.loop import Loop
+
+
+class _Decoding(Dataset):
+    def __init__(self, n: int = 16):
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        image = torch.full((3, 4, 4), float(index))
+        return {"image": image, "mask": np.ones(2, dtype=np.uint8)}, index
+
+
+def test_cache_roundtrip_and_transform():
+    dataset = CachedDataset(
+        _Decoding(), max_bytes=1 << 20, transform=lambda s: (s[0], s[1] * 10)
+    )
+
+    for _ in range(2):
+        sample, label = dataset[3]
+        assert torch.equal(sample["image"], torch.full((3, 4, 4), 3.0))
+        assert isinstance(sample["mask"], np.ndarray)
+        assert label == 30
+    assert (dataset.hits, dataset.misses) == (1, 1)
+
+
+def test_cache_clock_eviction(tmpdir):
+    slot_bytes = CachedDataset(_Decoding(), max_bytes=1 << 20).slot_bytes
+    dataset = CachedDataset(_Decoding(), max_bytes=3 * slot_bytes)
+
+    for index in [0, 1, 2, 0, 3]:
+        dataset[index]
+    assert dataset.cached_samples == 3
+
+    # 0 got second chance, 1 wasn't hit and was evicted
+    loop = Loop(tmpdir, [])
+    dataset.log_metrics(loop)
+    assert loop.metrics.latest["data/cache/hit_rate"].value == 1 / 5
+    for index in [0, 2, 3, 1]:
+        dataset[index]
+    assert (dataset.hits, dataset.misses) == (3, 1)
+
+
+def test_cache_shared_between_workers():
+    dataset = CachedDataset(_Decoding(), max_bytes=1 << 20)
+    loader = DataLoader(dataset, batch_size=4, num_workers=2, shuffle=True)
+
+    for _ in range(3):
+        labels = torch.cat([label for _, label in loader])
+        assert sorted(labels.tolist()) == list(range(16))
+
+    assert dataset.misses == 16
+    assert dataset.hits == 32
+
+
+def test_cache_clock_sweeps_all_referenced():
+    slot_bytes = CachedDataset(_Decoding(), max_bytes=1 << 20).slot_bytes
+    dataset = CachedDataset(_Decoding(), max_bytes=2 * slot_bytes)
+
+    for index in [0, 1, 0, 1, 2, 3]:
+        dataset[index]
+    # Every slot was hit: hand clears them and evicts 0, then evicts 1
+    assert sorted(dataset._index_of.tolist()) == [2, 3]
+    assert dataset.cached_samples == 2
@@ -0,0 +1,51 @@
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from matches.data import MemmapCachedDataset
+
+
+class _Decoding(Dataset):
+    def __init__(self, n: int = 10, scale: float = 1.0):
+        self.n = n
+        self.scale = scale
+        self.loaded = 0
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        self.loaded += 1
+        return torch.full((2, 3), index * self.scale), index
+
+
+def test_memmap_cache_built_on_first_epoch(tmpdir):
+    dataset = MemmapCachedDataset(_Decoding(), tmpdir, key="v1", shard_size=4)
+    loader = DataLoader(dataset, batch_size=3, num_workers=2)
+
+    first = [x for x, _ in loader]
+    assert dataset.complete
+
+    # Next run reads only the cache
+    source = _Decoding()
+    dataset = MemmapCachedDataset(source, tmpdir, key="v1", shard_size=4)
+    second = [x for x, _ in DataLoader(dataset, batch_size=3)]
+    assert source.loaded == 0
+    assert all(torch.equal(a, b) for a, b in zip(first, second))
+    assert dataset[7][1] == 7
+
+
+def test_memmap_cache_invalidated_by_key(tmpdir):
+    dataset = MemmapCachedDataset(_Decoding(), tmpdir, key={"scale": 1.0})
+    dataset[1]
+
+    dataset = MemmapCachedDataset(_Decoding(scale=2.0), tmpdir, key={"scale": 2.0})
+    assert not dataset.written.any()
+    assert dataset[1][0][0, 0] == 2.0
+
+
+def test_memmap_cache_read_is_copy_on_write(tmpdir):
+    dataset = MemmapCachedDataset(_Decoding(), tmpdir)
+    dataset[2]
+    dataset[2][0].add_(100)
+
+    assert MemmapCachedDataset(_Decoding(), tmpdir)[2][0][0, 0] == 2.0
@@ -0,0 +1,66 @@
+import torch
+from torch.utils.data import DataLoader
+
+from matches.data import BucketBatchSampler
+from matches.loop import Loop
+
+
+def _lengths(n: int = 200):
+    return torch.randint(1, 100, (n,), generator=torch.Generator().manual_seed(0))
+
+
+def _padding_ratio(lengths, batches):
+    tokens = sum(int(lengths[b].sum()) for b in batches)
+    padded = sum(int(lengths[b].max()) * len(b) for b in batches)
+    return 1 - tokens / padded
+
+
+def test_bucketing_reduces_padding(tmpdir):
+    lengths = _lengths()
+    sampler = BucketBatchSampler(lengths, batch_size=8, num_buckets=10)
+    batches = list(sampler)
+
+    assert sorted(i for b in batches for i in b) == list(range(len(lengths)))
+    uniform = torch.randperm(len(lengths)).split(8)
+    assert _padding_ratio(lengths, batches) < _padding_ratio(lengths, uniform) / 2
+
+    loop = Loop(tmpdir, [])
+    sampler.log_metrics(loop)
+    logged = loop.metrics.latest["data/bucketing/padding_ratio"].value
+    assert abs(logged - _padding_ratio(lengths, batches)) < 1e-9
+
+
+def test_bucketing_is_reproducible_per_epoch():
+    sampler = BucketBatchSampler(_lengths(), batch_size=8, seed=3)
+    first = list(sampler)
+    assert list(BucketBatchSampler(_lengths(), batch_size=8, seed=3)) == first
+
+    sampler.set_epoch(1)
+    assert list(sampler) != first
+
+
+def test_bucketing_token_budget():
+    lengths = _lengths()
+    sampler = BucketBatchSampler(lengths, max_tokens=256)
+    for batch in sampler:
+        assert len(batch) == 1 or len(batch) * int(lengths[batch].max()) <= 256
+
+
+def test_bucketing_sharding():
+    lengths = _lengths(203)
+    shards = [
+        list(BucketBatchSampler(lengths, batch_size=8, num_replicas=3, rank=rank))
+        for rank in range(3)
+    ]
+
+    assert len({len(shard) for shard in shards}) == 1
+    covered = {i for shard in shards for batch in shard for i in batch}
+    assert covered == set(range(203))
+
+
+def test_bucketing_with_dataloader():
+    lengths = _lengths(50)
+    sampler = BucketBatchSampler(lengths, batch_size=4)
+    loader = DataLoader(range(50), batch_sampler=sampler)
+    assert sum(len(batch) for batch in loader) == 50
+    assert len(loader) == len(sampler)
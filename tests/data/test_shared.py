@@ -0,0 +1,58 @@
+import pickle
+from uuid import uuid4
+
+import ignite.distributed as idist
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from matches.data import NodeSharedDataset
+
+
+class _Decoding(Dataset):
+    def __init__(self, n: int = 10):
+        self.n = n
+        self.loaded = 0
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        self.loaded += 1
+        return torch.full((3,), float(index)), index
+
+
+def test_node_shared_dataset(tmpdir):
+    dataset = NodeSharedDataset(_Decoding(), name=uuid4().hex, shm_dir=tmpdir)
+
+    assert len(dataset) == 10
+    image, label = dataset[4]
+    assert torch.equal(image, torch.full((3,), 4.0)) and label == 4
+
+    # Samples are copies
+    image.add_(1)
+    assert dataset[4][0][0] == 4.0
+
+    # Spawned workers reattach by path
+    restored = pickle.loads(pickle.dumps(dataset))
+    assert restored[9][1] == 9
+
+    loader = DataLoader(dataset, batch_size=4, num_workers=2)
+    labels = torch.cat([y for _, y in loader])
+    assert labels.tolist() == list(range(10))
+
+    dataset.unlink()
+    assert len(tmpdir.listdir()) == 0
+
+
+def _shared_on_ranks(local_rank: int, name: str, shm_dir: str):
+    source = _Decoding()
+    dataset = NodeSharedDataset(source, name=name, shm_dir=shm_dir)
+    loaded = idist.all_reduce(torch.tensor([source.loaded]))
+    assert loaded.item() == 1 + len(dataset)
+    assert dataset[idist.get_rank()][1] == idist.get_rank()
+    idist.barrier()
+
+
+def test_node_shared_dataset_distributed(tmpdir):
+    with idist.Parallel(backend="gloo", nproc_per_node=2) as parallel:
+        parallel.run(_shared_on_ranks, uuid4().hex, str(tmpdir))
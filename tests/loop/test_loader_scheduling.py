@@ -0,0 +1,217 @@
+from collections import Counter
+from copy import deepcopy
+
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from matches.loop import InterleavedLoader, Loop, ResumableLoader
+from matches.loop.loader_scheduling import (
+    DataloaderOverrider,
+    DataloaderSchedulerWrapper,
+    clone_dataloader,
+)
+
+
+def _loaders():
+    return {"a": [f"a_{i}" for i in range(4)], "b": [f"b_{i}" for i in range(2)]}
+
+
+def test_interleaved_round_robin():
+    loader = InterleavedLoader(_loaders())
+
+    assert len(loader) == 6
+    assert [batch for _, batch in loader] == ["a_0", "b_0", "a_1", "b_1", "a_2", "a_3"]
+
+
+@pytest.mark.parametrize("strategy", ["proportional", "weighted"])
+def test_interleaved_random_strategies_are_reproducible(strategy):
+    loader = InterleavedLoader(_loaders(), strategy, weights={"a": 1.0, "b": 3.0})
+    first_pass = list(loader)
+    second_pass = list(loader)
+
+    for items in (first_pass, second_pass):
+        assert Counter(name for name, _ in items) == {"a": 4, "b": 2}
+        assert [b for n, b in items if n == "a"] == _loaders()["a"]
+
+    again = InterleavedLoader(_loaders(), strategy, weights={"a": 1.0, "b": 3.0})
+    assert list(again) == first_pass
+
+
+@pytest.mark.parametrize("strategy", ["round_robin", "weighted"])
+def test_interleaved_unsized_loaders(strategy):
+    loaders = {name: iter(batches) for name, batches in _loaders().items()}
+    loader = InterleavedLoader(loaders, strategy, weights={"a": 1.0, "b": 3.0})
+
+    assert Counter(name for name, _ in loader) == {"a": 4, "b": 2}
+
+
+def test_interleaved_in_loop(tmpdir):
+    loaders = {
+        "x": DataLoader(TensorDataset(torch.randn(6, 2)), batch_size=2),
+        "y": DataLoader(TensorDataset(torch.randn(3, 2)), batch_size=3),
+    }
+    loop = Loop(tmpdir, [])
+    tasks = []
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            loader = InterleavedLoader(loaders, "proportional")
+            for task, (x,) in loop.iterate_dataloader(loader, mode="train"):
+                tasks.append(task)
+                assert x.shape[1] == 2
+
+    loop.run(run)
+
+    assert sorted(tasks) == ["x", "x", "x", "y"]
+    assert loop.iterations.current_batch == 4
+    assert loop.iterations.current_samples == 9
+
+
+class _CountingDataset(TensorDataset):
+    def __init__(self, n: int):
+        super().__init__(torch.arange(n))
+        self.loaded = 0
+
+    def __getitem__(self, index):
+        self.loaded += 1
+        return super().__getitem__(index)
+
+
+def _consume(iterator, n):
+    return [next(iterator)[0].tolist() for _ in range(n)]
+
+
+def test_resumable_loader_skips_without_loading():
+    dataset = _CountingDataset(20)
+    generator = torch.Generator().manual_seed(1)
+    loader = ResumableLoader(
+        DataLoader(dataset, batch_size=4, shuffle=True, generator=generator)
+    )
+
+    iterator = iter(loader)
+    _consume(iterator, 2)
+    state = deepcopy(loader.state_dict())
+    expected = [batch[0].tolist() for batch in iterator]
+
+    restored = ResumableLoader(DataLoader(dataset, batch_size=4, shuffle=True))
+    restored.load_state_dict(state)
+    dataset.loaded = 0
+    assert [batch[0].tolist() for batch in restored] == expected
+    assert dataset.loaded == 12
+
+
+def test_resumable_loader_resumes_after_finished_pass():
+    def make_loader():
+        generator = torch.Generator().manual_seed(1)
+        loader = DataLoader(
+            _CountingDataset(8), batch_size=4, shuffle=True, generator=generator
+        )
+        return ResumableLoader(loader)
+
+    loader = make_loader()
+    first_epoch = [batch[0].tolist() for batch in loader]
+    state = deepcopy(loader.state_dict())
+    second_epoch = [batch[0].tolist() for batch in loader]
+    assert second_epoch != first_epoch
+
+    restored = make_loader()
+    restored.load_state_dict(state)
+    assert [batch[0].tolist() for batch in restored] == second_epoch
+
+
+@pytest.mark.parametrize("resumable", [True, False])
+def test_scheduler_wrapper_resume(resumable):
+    def make_wrapper():
+        loader = DataLoader(
+            _CountingDataset(20),
+            batch_size=2,
+            shuffle=True,
+            generator=torch.Generator().manual_seed(0),
+        )
+        return DataloaderSchedulerWrapper(
+            loader, single_pass_length=3, truncated_length=8, resumable=resumable
+        )
+
+    wrapper = make_wrapper()
+    list(wrapper)
+    list(wrapper)
+    iterator = iter(wrapper)
+    _consume(iterator, 1)
+    state = deepcopy(wrapper.state_dict())
+    expected = [batch[0].tolist() for batch in iterator]
+    expected += [batch[0].tolist() for batch in wrapper]
+
+    restored = make_wrapper()
+    restored.load_state_dict(state)
+    actual = [batch[0].tolist() for batch in restored]
+    actual += [batch[0].tolist() for batch in restored]
+    assert actual == expected
+
+
+def test_clone_dataloader():
+    loader = DataLoader(_CountingDataset(10), batch_size=3, drop_last=True)
+    clone = clone_dataloader(loader, num_workers=0)
+
+    assert clone.batch_sampler is loader.batch_sampler
+    assert len(clone) == 3
+
+
+class _TaggedLoader(DataLoader):
+    def __iter__(self):
+        return (("tagged", batch) for batch in super().__iter__())
+
+
+class _CustomInitLoader(DataLoader):
+    def __init__(self, dataset, tag: str):
+        super().__init__(dataset, batch_size=2, num_workers=1)
+        self.tag = tag
+
+
+def test_clone_dataloader_keeps_subclass(caplog):
+    loader = _TaggedLoader(_CountingDataset(4), batch_size=2)
+    clone = clone_dataloader(loader, num_workers=0)
+    assert type(clone) is _TaggedLoader
+    assert [tag for tag, _ in clone] == ["tagged", "tagged"]
+
+    # Subclass with own constructor is used as is
+    custom = _CustomInitLoader(_CountingDataset(4), tag="x")
+    with pytest.raises(TypeError):
+        clone_dataloader(custom)
+    assert DataloaderSchedulerWrapper(custom).dataloader is custom
+    assert "can't be recreated" in caplog.text
+
+
+def test_scheduler_wrapper_falsy_and_empty_batches():
+    wrapper = DataloaderSchedulerWrapper(
+        [0, 1, 0], single_pass_length=4, truncated_length=3
+    )
+    assert list(wrapper) == [0, 1, 0, 0]
+
+    empty = DataloaderSchedulerWrapper([], single_pass_length=2, truncated_length=0)
+    assert list(empty) == []
+
+
+def test_scheduler_wrapper_keeps_workers():
+    loader = DataLoader(_CountingDataset(8), batch_size=2, num_workers=1)
+    wrapper = DataloaderSchedulerWrapper(loader, single_pass_length=0.5)
+
+    assert wrapper.dataloader.persistent_workers
+    for _ in range(4):
+        assert len(list(wrapper)) == 2
+    assert wrapper.worker_starts == 1
+    assert wrapper.worker_startup_time > 0
+
+
+def test_overfit_batch_reuses_cached_tensors():
+    loader = DataLoader(_CountingDataset(8), batch_size=2, num_workers=2)
+    train_loader = DataloaderOverrider("overfit-batch")(loader, mode="train")
+
+    batches = list(train_loader)
+    assert len(batches) == 10
+    assert loader.num_workers == 1
+    assert all(batch[0] is batches[0][0] for batch in batches)
+
+    # In-place modification is reverted before the next pass
+    batches[-1][0].add_(100)
+    assert next(iter(train_loader))[0].tolist() == [0, 1]
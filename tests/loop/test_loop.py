@@ -1,13 +1,20 @@
+import gc
 import inspect
+import os
+import time
+import weakref
 from typing import List
 
+import ignite.distributed as idist
 import pytest
+import torch
 from pytest import fixture
-from torch.optim import Optimizer
-from torch.utils.data import DataLoader
+from torch import nn
+from torch.optim import SGD, Optimizer
+from torch.utils.data import DataLoader, TensorDataset
 
-from matches.callbacks import Callback
-from matches.loop import Loop
+from matches.callbacks import BestModelSaver, Callback, LastModelSaverCallback
+from matches.loop import IterationType, Loop, ResumableLoader, StepTimer, WorkerTuner
 
 
 class EventHistoryCallback(Callback):
@@ -143,3 +150,584 @@ def test_exception_handled_correctly(loop, history):
 def test_postphone_exception_in_callback():
     # TODO implement exception postphoning behaviour
     pass
+
+
+def test_prefetch_keeps_events_and_order(tmpdir, history):
+    loop = Loop(tmpdir, [history], prefetch=2)
+
+    def run(loop: Loop):
+        for epoch in loop.iterate_epochs(2):
+            for i, batch in enumerate(loop.iterate_dataloader(FAKE_TRAIN_DL, mode="train")):
+                history.history.append(batch)
+                assert loop.data_wait_time >= 0
+                if epoch == 1 and i == 1:
+                    break
+
+            for batch in loop.iterate_dataloader(FAKE_VALID_DL):
+                history.history.append(batch)
+
+    loop.run(run)
+
+    assert_has_correct_event_history(history.history)
+    batches = [e for e in history.history if not e.startswith("on")]
+    assert batches == FAKE_TRAIN_DL + FAKE_VALID_DL + FAKE_TRAIN_DL[:2] + FAKE_VALID_DL
+
+
+def test_prefetch_propagates_loader_exception(tmpdir, history):
+    def broken_loader():
+        yield "train_0"
+        raise KeyError()
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for batch in loop.iterate_dataloader(broken_loader(), mode="train", prefetch=1):
+                history.history.append(batch)
+
+    with pytest.raises(KeyError):
+        Loop(tmpdir, [history]).run(run)
+
+    assert "train_0" in history.history
+
+
+class IterationEndCounter(Callback):
+    def __init__(self):
+        self.calls = 0
+
+    def on_iteration_end(self, loop: "Loop", batch_no: int):
+        self.calls += 1
+
+
+def test_dispatch_only_overridden_events(tmpdir):
+    counter = IterationEndCounter()
+    assert counter.handled_events() == {"on_iteration_end"}
+
+    loop = Loop(tmpdir, [Callback()])
+    loop.callbacks.append(counter)
+    assert loop._dispatch_table == {"on_iteration_end": [counter.on_iteration_end]}
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for _ in loop.iterate_dataloader(FAKE_TRAIN_DL, mode="train"):
+                pass
+
+    loop.run(run)
+    assert counter.calls == len(FAKE_TRAIN_DL)
+
+    loop.callbacks.remove(counter)
+    assert loop._dispatch_table == {}
+
+
+class _DuckCallback:
+    on_disk = True
+
+    def on_train_start(self, loop: "Loop"):
+        pass
+
+
+def test_dispatch_table_follows_loop_callbacks_only(tmpdir):
+    duck = _DuckCallback()
+    callbacks = [duck]
+    loop = Loop(tmpdir, callbacks)
+    # Non-callable attributes aren't handlers
+    assert loop._dispatch_table == {"on_train_start": [duck.on_train_start]}
+
+    # Assigned list is copied
+    callbacks.append(IterationEndCounter())
+    assert loop.callbacks == [duck]
+    assert "on_iteration_end" not in loop._dispatch_table
+
+    loop.callbacks[0] = IterationEndCounter()
+    assert list(loop._dispatch_table) == ["on_iteration_end"]
+
+
+def test_gradient_accumulation(tmpdir):
+    torch.manual_seed(0)
+    data = [(torch.randn(4, 3), torch.randn(4, 1)) for _ in range(5)]
+
+    def make_model():
+        torch.manual_seed(1)
+        return torch.nn.Linear(3, 1)
+
+    # Reference: manual accumulation over windows [0, 1], [2, 3], [4]
+    reference = make_model()
+    ref_optim = torch.optim.SGD(reference.parameters(), lr=0.1)
+    for window in (data[0:2], data[2:4], data[4:5]):
+        ref_optim.zero_grad()
+        for x, y in window:
+            loss = torch.nn.functional.mse_loss(reference(x), y)
+            (loss / len(window)).backward()
+        ref_optim.step()
+
+    model = make_model()
+    optim = torch.optim.SGD(model.parameters(), lr=0.1)
+    loop = Loop(tmpdir, [], accumulate_steps=2)
+    loop.attach(model=model)
+    boundaries = []
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for x, y in loop.iterate_dataloader(data, mode="train"):
+                boundaries.append(loop.accumulation_boundary)
+                loss = torch.nn.functional.mse_loss(model(x), y)
+                loop.zero_grad_backward_step(loss, optim)
+
+    loop.run(run)
+
+    assert boundaries == [False, True, False, True, True]
+    assert loop.iterations.global_steps == 3
+    assert loop.accumulation_boundary
+    assert torch.allclose(model.weight, reference.weight)
+    assert torch.allclose(model.bias, reference.bias)
+
+
+def test_gradient_accumulation_restarts_after_interrupted_pass(tmpdir):
+    model = torch.nn.Linear(3, 1)
+    optim = torch.optim.SGD(model.parameters(), lr=0.1)
+    loop = Loop(tmpdir, [], accumulate_steps=2)
+    loop.attach(model=model)
+    data = [(torch.randn(4, 3), torch.randn(4, 1)) for _ in range(4)]
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for x, y in loop.iterate_dataloader(data, mode="train"):
+                loss = torch.nn.functional.mse_loss(model(x), y)
+                loop.zero_grad_backward_step(loss, optim)
+                break
+            assert model.weight.grad is not None
+
+            boundaries = []
+            for x, y in loop.iterate_dataloader(data, mode="train"):
+                if not boundaries:
+                    # Gradients of interrupted window are dropped
+                    assert model.weight.grad is None
+                boundaries.append(loop.accumulation_boundary)
+                loss = torch.nn.functional.mse_loss(model(x), y)
+                loop.zero_grad_backward_step(loss, optim)
+            assert boundaries == [False, True, False, True]
+
+    loop.run(run)
+    assert loop.iterations.global_steps == 2
+
+
+def test_bf16_autocast_on_cpu(tmpdir):
+    model = torch.nn.Linear(3, 1)
+    optim = torch.optim.SGD(model.parameters(), lr=0.1)
+    loop = Loop(tmpdir, [], precision="bf16")
+    loop.attach(model=model)
+    dtypes = []
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for x in loop.iterate_dataloader([torch.randn(4, 3)] * 2, mode="train"):
+                out = model(x)
+                dtypes.append(out.dtype)
+                loop.backward(out.float().mean())
+                loop.optimizer_step(optim)
+            for x in loop.iterate_dataloader([torch.randn(4, 3)]):
+                dtypes.append(model(x).dtype)
+
+    loop.run(run)
+
+    assert dtypes == [torch.bfloat16] * 3
+    assert model.weight.dtype == torch.float32
+    assert loop.iterations.global_steps == 2
+
+
+def test_fp16_skips_step_on_overflow(tmpdir):
+    model = torch.nn.Linear(3, 1)
+    optim = torch.optim.SGD(model.parameters(), lr=0.1)
+    loop = Loop(tmpdir, [], precision="fp16")
+    loop.attach(model=model)
+    assert "grad_scaler" in loop.state_manager.state_dict()
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            scales = [1.0, float("inf"), 1.0]
+            for scale in loop.iterate_dataloader(
+                scales, mode="train", move_to_default_device=False
+            ):
+                weight = model.weight.detach().clone()
+                loop.backward(model(torch.ones(2, 3)).float().mean() * 1e-3 * scale)
+                loop.optimizer_step(optim)
+                assert torch.equal(weight, model.weight) == (scale == float("inf"))
+
+    loop.run(run)
+
+    assert loop.iterations.global_steps == 2
+
+
+def test_fp16_grad_scaler_created_for_training_device(tmpdir, monkeypatch):
+    # CUDA is present, but training runs on CPU (eg gloo backend)
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: True)
+    monkeypatch.setattr(idist, "device", lambda: torch.device("cpu"))
+    loop = Loop(tmpdir, [], precision="fp16")
+    saved = torch.amp.GradScaler("cpu", init_scale=4.0).state_dict()
+    loop.state_manager.load_state_dict_by_key({"grad_scaler": saved}, "grad_scaler")
+    assert loop._lazy_grad_scaler.scaler is None
+
+    model = torch.nn.Linear(3, 1)
+    loop.backward(model(torch.ones(2, 3)).mean())
+    assert loop._grad_scaler._device == "cpu"
+    assert loop._grad_scaler.get_scale() == 4.0
+
+
+def test_fp16_updates_scale_once_per_iteration(tmpdir):
+    generator, discriminator = torch.nn.Linear(3, 3), torch.nn.Linear(3, 1)
+    optimizers = [
+        torch.optim.SGD(generator.parameters(), lr=0.1),
+        torch.optim.SGD(discriminator.parameters(), lr=0.1),
+    ]
+    loop = Loop(tmpdir, [], precision="fp16")
+    updates = []
+    update = loop._grad_scaler.update
+    loop._grad_scaler.update = lambda: updates.append(update())
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for _ in loop.iterate_dataloader(
+                [1, 2, 3], mode="train", move_to_default_device=False
+            ):
+                for optimizer in optimizers:
+                    x = generator(torch.ones(2, 3))
+                    loss = discriminator(x).float().mean() * 1e-4
+                    loop.backward(loss)
+                    loop.optimizer_step(optimizer)
+
+    loop.run(run)
+
+    assert len(updates) == 3
+    assert loop.iterations.global_steps == 6
+
+
+def test_compile_tracks_compilation(tmpdir):
+    model = torch.nn.Linear(3, 1)
+    loop = Loop(tmpdir, [])
+    loop.attach(model=model)
+    compiled = loop.compile(model, name="linear", backend="eager")
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            # Last short batch triggers recompilation
+            batches = [torch.randn(4, 3)] * 3 + [torch.randn(3, 3)]
+            for x in loop.iterate_dataloader(batches, mode="train"):
+                compiled(x)
+
+    loop.run(run)
+
+    assert compiled.compile_time > 0
+    assert compiled.recompilations == 1
+    assert compiled.in_features == 3
+    assert set(loop.state_manager.state_dict()["model"]) == {"weight", "bias"}
+    assert {"compile/linear/compile_time", "compile/linear/recompilations"} <= set(
+        loop.metrics.latest
+    )
+    assert loop.metrics.latest["compile/linear/call_time"].value > 0
+
+
+def test_step_timer_logs_phase_percentiles(tmpdir, history):
+    model = torch.nn.Linear(3, 1)
+    optim = torch.optim.SGD(model.parameters(), lr=0.1)
+    timer = StepTimer(log_every=2, percentiles=(50, 90))
+    loop = Loop(tmpdir, [history], step_timer=timer)
+    loop.attach(model=model)
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for x in loop.iterate_dataloader([torch.randn(4, 3)] * 4, mode="train"):
+                loop.backward(model(x).mean())
+                loop.optimizer_step(optim)
+            for x in loop.iterate_dataloader([torch.randn(4, 3)]):
+                model(x)
+
+    loop.run(run)
+
+    summary = timer.summary()
+    assert set(summary) == {
+        "data_wait",
+        "transfer",
+        "forward",
+        "backward",
+        "optimizer_step",
+        "callbacks",
+        "total",
+    }
+    assert len(timer._history["total"]) == 4
+    for phase in ("forward", "backward", "optimizer_step", "callbacks", "total"):
+        assert summary[phase][50] > 0
+    assert summary["total"][90] >= summary["backward"][90]
+    assert loop.metrics.latest["time/backward/p50"].iteration_type == IterationType.BATCHES
+
+
+def test_samples_and_throughput_counters(tmpdir):
+    loop = Loop(tmpdir, [])
+    batches = [(torch.randn(4, 3), torch.zeros(4)), (torch.randn(4, 3), torch.zeros(4))]
+    batches.append({"x": torch.randn(3, 3)})
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(2):
+            for _ in loop.iterate_dataloader(batches, mode="train"):
+                loop.metrics.log("samples_seen", 0, iteration="samples")
+            for _ in loop.iterate_dataloader(batches):
+                pass
+
+    loop.run(run)
+
+    iterations = loop.iterations
+    assert iterations.current_samples == 22
+    assert iterations.global_samples == 22
+    assert iterations.global_batches == 6
+    assert iterations.global_epochs == 2
+    assert loop.metrics.latest["samples_seen"].iteration == 19
+    assert loop.metrics.latest["throughput/global_samples_per_sec"].value > 0
+    assert loop.metrics.latest["throughput/global_batches_per_sec"].value > 0
+
+
+def _throughput_on_ranks(_, logdir: str):
+    rank = idist.get_rank()
+    loop = Loop(f"{logdir}/{rank}", [])
+
+    def run(loop: Loop, batches: List[torch.Tensor], epochs: int):
+        for _ in loop.iterate_epochs(epochs):
+            for _ in loop.iterate_dataloader(batches, mode="train"):
+                time.sleep(0.01)
+
+    loop.run(run, [torch.randn(4, 3)] * (3 if rank == 0 else 1), 1)
+    assert loop.iterations.global_batches == 4
+    assert loop.iterations.global_samples == 16
+    latest = loop.metrics.latest
+    assert latest["throughput/global_samples_per_sec"].value == pytest.approx(
+        4 * latest["throughput/global_batches_per_sec"].value
+    )
+
+    # Rank 1 has no batches, but takes part in reduction
+    loop.run(run, [torch.randn(4, 3)] * (2 if rank == 0 else 0), 2)
+    assert loop.iterations.global_batches == 6
+    assert loop.iterations.global_samples == 24
+
+
+def test_throughput_is_global_in_distributed_run(tmpdir):
+    with idist.Parallel(backend="gloo", nproc_per_node=2) as parallel:
+        parallel.run(_throughput_on_ranks, str(tmpdir))
+
+
+def test_custom_batch_size_fn(tmpdir):
+    loop = Loop(tmpdir, [], batch_size_fn=len)
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for _ in loop.iterate_dataloader(FAKE_TRAIN_DL, mode="train"):
+                pass
+
+    loop.run(run)
+
+    assert loop.iterations.current_samples == sum(map(len, FAKE_TRAIN_DL))
+
+
+class _SlowDataset(torch.utils.data.Dataset):
+    def __len__(self):
+        return 8
+
+    def __getitem__(self, index):
+        time.sleep(0.01)
+        return torch.tensor([index])
+
+
+def test_worker_tuner_adds_workers_and_persists(tmpdir):
+    state_file = tmpdir / "tuner.json"
+    loader = DataLoader(_SlowDataset(), batch_size=2)
+    tuner = WorkerTuner(max_wait_ratio=0.01, max_workers=2, state_file=state_file)
+    loop = Loop(tmpdir, [], worker_tuner=tuner)
+
+    workers = []
+
+    def run(loop: Loop):
+        for _ in loop.iterate_epochs(3):
+            for batch in loop.iterate_dataloader(loader, mode="train"):
+                pass
+            workers.append(loop.metrics.latest["data/num_workers"].value)
+
+    loop.run(run)
+
+    assert workers == [0, 1, 2]
+    assert loader.num_workers == 0
+
+    # Next run starts with saved settings
+    tuner = WorkerTuner(state_file=state_file)
+    assert tuner.loader(loop, loader).num_workers == 2
+
+
+def test_worker_tuner_default_max_workers_per_local_process(monkeypatch):
+    # Created before processes are launched, like loop in DDP examples
+    tuner = WorkerTuner()
+    monkeypatch.setattr(idist, "get_nproc_per_node", lambda: 2)
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else 1
+    assert tuner.max_workers == max(1, cpus // 2)
+
+
+def test_worker_tuner_releases_loaders(tmpdir):
+    tuner = WorkerTuner(max_wait_ratio=0.0, max_workers=2)
+    loop = Loop(tmpdir, [])
+    loader = DataLoader(TensorDataset(torch.arange(8)), batch_size=2, num_workers=1)
+
+    first = tuner.loader(loop, loader)
+    assert len(list(first)) == 4
+    assert first._iterator is not None
+    tuner.update(loop, loader, wait_time=1.0, elapsed=1.0)
+    # Persistent workers of outdated copy are stopped
+    assert first._iterator is None
+    second = tuner.loader(loop, loader)
+    assert second is not first and second.num_workers == 2
+
+    copy = weakref.ref(second)
+    del loader, second
+    gc.collect()
+    assert len(tuner._loaders) == 0
+    assert copy() is None
+
+
+def _resumable_training(tmpdir, lr: float):
+    torch.manual_seed(0)
+    model = nn.Linear(2, 1)
+    optimizer = SGD(model.parameters(), lr=lr, momentum=0.9)
+    loader = ResumableLoader(
+        DataLoader(TensorDataset(torch.randn(8, 2)), batch_size=2, shuffle=True)
+    )
+    saver = BestModelSaver("valid/loss")
+    loop = Loop(tmpdir, [saver, LastModelSaverCallback()])
+    loop.attach(model=model, optimizer=optimizer, train_loader=loader)
+    return loop, model, optimizer, saver, loader
+
+
+def test_resume_restores_training_state(tmpdir):
+    loop, model, optimizer, saver, loader = _resumable_training(tmpdir, lr=0.1)
+
+    def train(loop: Loop):
+        for epoch in loop.iterate_epochs(2):
+            for (x,) in loop.iterate_dataloader(loader, mode="train"):
+                loop.backward(model(x).sum())
+                loop.optimizer_step(optimizer)
+            loop.metrics.log("valid/loss", [1.0, 2.0][epoch])
+
+    loop.run(train)
+    expected_optimizer = optimizer.state_dict()
+    expected_random = torch.rand(3)
+
+    loop, model, optimizer, saver, loader = _resumable_training(tmpdir, lr=0.5)
+    loop.resume(tmpdir / "last.pth")
+
+    assert loop.iterations.current_epoch == 2
+    assert saver.metric_best_setup.best_value == 1.0
+    assert saver.metric_best_setup.best_epoch_idx == 0
+    assert torch.equal(torch.rand(3), expected_random)
+
+    # Optimizer state is loaded on the first use, hyperparameters at once
+    assert optimizer.param_groups[0]["lr"] == 0.1
+    assert len(optimizer.state) == 0
+    restored_optimizer = optimizer.state_dict()
+    for index, state in expected_optimizer["state"].items():
+        assert torch.equal(
+            restored_optimizer["state"][index]["momentum_buffer"],
+            state["momentum_buffer"],
+        )
+
+
+def test_resume_keeps_hyperparameters_changed_before_first_step(tmpdir):
+    loop, model, optimizer, _, loader = _resumable_training(tmpdir, lr=0.1)
+
+    def train(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for (x,) in loop.iterate_dataloader(loader, mode="train"):
+                loop.backward(model(x).sum())
+                loop.optimizer_step(optimizer)
+            loop.metrics.log("valid/loss", 1.0)
+
+    loop.run(train)
+
+    loop, model, optimizer, _, loader = _resumable_training(tmpdir, lr=0.5)
+    loop.resume(tmpdir / "last.pth")
+    assert optimizer.param_groups[0]["lr"] == 0.1
+    # Eg warmup or scheduler step
+    optimizer.param_groups[0]["lr"] = 0.01
+
+    model(torch.ones(1, 2)).sum().backward()
+    optimizer.step()
+    assert optimizer.param_groups[0]["lr"] == 0.01
+    assert len(optimizer.state) == 2
+
+
+def test_resume_after_epoch_end_continues_data_order(tmpdir):
+    batches = []
+
+    def train(loop: Loop, model, optimizer, loader, epochs: int):
+        for epoch in loop.iterate_epochs(epochs):
+            for (x,) in loop.iterate_dataloader(loader, mode="train"):
+                batches.append(x)
+                loop.backward(model(x).sum())
+                loop.optimizer_step(optimizer)
+            loop.metrics.log("valid/loss", float(epoch))
+
+    loop, model, optimizer, _, loader = _resumable_training(tmpdir / "full", lr=0.1)
+    loop.run(train, model, optimizer, loader, 3)
+    expected = batches[8:]
+
+    loop, model, optimizer, _, loader = _resumable_training(tmpdir / "part", lr=0.1)
+    loop.run(train, model, optimizer, loader, 2)
+    loop, model, optimizer, _, loader = _resumable_training(tmpdir / "part", lr=0.1)
+    loop.resume(tmpdir / "part" / "last.pth")
+    batches.clear()
+    loop.run(train, model, optimizer, loader, 3)
+
+    # Last epoch sees the same batches as in uninterrupted training
+    assert len(batches) == len(expected) == 4
+    for batch, expected_batch in zip(batches, expected):
+        assert torch.equal(batch, expected_batch)
+
+
+def test_mid_pass_checkpoint_with_prefetch_resumes_after_consumed_batch(tmpdir):
+    def make_loader():
+        return ResumableLoader(
+            DataLoader(TensorDataset(torch.arange(16)), batch_size=2, shuffle=True)
+        )
+
+    torch.manual_seed(0)
+    loader = make_loader()
+    loop = Loop(tmpdir, [], prefetch=3)
+    loop.attach(train_loader=loader)
+    seen = []
+
+    def train(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            for (x,) in loop.iterate_dataloader(loader, mode="train"):
+                seen.append(x)
+                if len(seen) == 3:
+                    time.sleep(0.1)  # Prefetcher fills the queue
+                    loop.state_manager.write_state(tmpdir / "mid.pth")
+
+    loop.run(train)
+    assert torch.load(tmpdir / "mid.pth")["train_loader"]["position"] == 3
+
+    loader = make_loader()
+    loop = Loop(tmpdir, [], prefetch=3)
+    loop.attach(train_loader=loader)
+    loop.state_manager.read_state(tmpdir / "mid.pth", skip_keys=["iterations"])
+    resumed = [x for (x,) in loop.iterate_dataloader(loader)]
+    assert len(resumed) == 5
+    for batch, expected in zip(resumed, seen[3:]):
+        assert torch.equal(batch, expected)
+
+
+def test_resume_from_checkpoint_without_optional_states(tmpdir):
+    loop, model, optimizer, saver, loader = _resumable_training(tmpdir, lr=0.1)
+    torch.save(
+        {
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "iterations": {"epochs": 3},
+            "train_loader": loader.state_dict(),
+        },
+        tmpdir / "old.pth",
+    )
+
+    loop.resume(tmpdir / "old.pth")
+    assert loop.iterations.current_epoch == 3
+    assert saver.metric_best_setup.best_value == float("inf")
@@ -0,0 +1,347 @@
+import ignite.distributed as idist
+import pytest
+import torch
+from torch import nn
+from torch.distributed.optim import ZeroRedundancyOptimizer
+
+from matches.callbacks import BestMetricsReporter, LastModelSaverCallback
+from matches.loop import Loop, state_io
+from matches.loop.loop import StateManager
+from matches.loop.state_io import BLOB_DIR, gc_blobs, load_state
+from matches.shortcuts.optimizer import ZeroOptimizerState
+from matches.utils import RNGState
+
+
+def test_async_write_snapshots_state(tmpdir):
+    model = nn.Linear(3, 2)
+    state_manager = StateManager(async_write=True)
+    state_manager.attach("model", model)
+
+    expected = model.weight.detach().clone()
+    state_manager.write_state(tmpdir / "last.pth")
+    with torch.no_grad():
+        model.weight.add_(1)
+    state_manager.wait()
+
+    saved = torch.load(tmpdir / "last.pth")
+    assert torch.equal(saved["model"]["weight"], expected)
+    assert [path.basename for path in tmpdir.listdir()] == ["last.pth"]
+
+    # Buffers are reused between writes
+    buffers = dict(state_manager._writer._buffers)
+    state_manager.write_state(tmpdir / "best.pth")
+    state_manager.wait()
+    assert all(state_manager._writer._buffers[k] is v for k, v in buffers.items())
+
+    state_manager.read_state(tmpdir / "last.pth")
+    assert torch.equal(model.weight, expected)
+
+
+def test_async_write_error_is_reraised(tmpdir):
+    state_manager = StateManager(async_write=True)
+    state_manager.attach("model", nn.Linear(3, 2))
+
+    state_manager.write_state(tmpdir / "missing" / "last.pth")
+    with pytest.raises(FileNotFoundError):
+        state_manager.wait()
+
+
+def test_loop_waits_for_write_on_train_end(tmpdir):
+    loop = Loop(tmpdir, [], state_manager=StateManager(async_write=True))
+    loop.attach(model=nn.Linear(3, 2))
+
+    loop.run(lambda loop: loop.state_manager.write_state(tmpdir / "last.pth"))
+
+    assert not loop.state_manager._writer.pending
+    assert (tmpdir / "last.pth").exists()
+
+
+def _blobs(directory):
+    return {p.basename for p in (directory / BLOB_DIR).listdir()} - {"manifests.json"}
+
+
+@pytest.mark.parametrize("async_write", [False, True])
+def test_dedup_checkpoints_share_blobs(tmpdir, async_write):
+    backbone, head = nn.Linear(4, 4), nn.Linear(4, 2)
+    state_manager = StateManager(async_write=async_write, checkpoint_format="dedup")
+    state_manager.attach("backbone", backbone)
+    state_manager.attach("head", head)
+    flags = nn.Module()
+    flags.register_buffer("mask", torch.tensor([True, False]))
+    state_manager.attach("flags", flags)
+
+    state_manager.write_state(tmpdir / "last.pth")
+    state_manager.wait()
+    first = _blobs(tmpdir)
+    # bool tensor and 4 parameters
+    assert len(first) == 5
+
+    # Only changed head is written, the rest is shared with previous checkpoint
+    with torch.no_grad():
+        head.weight.add_(1)
+    state_manager.write_state(tmpdir / "best.pth")
+    state_manager.wait()
+    assert len(_blobs(tmpdir) - first) == 1
+
+    # Unreferenced blob of initial head weight is removed, best.pth one is kept
+    expected = head.weight.detach().clone()
+    with torch.no_grad():
+        head.weight.add_(1)
+    state_manager.write_state(tmpdir / "last.pth")
+    state_manager.wait()
+    assert len(_blobs(tmpdir)) == 6
+
+    with torch.no_grad():
+        head.weight.zero_()
+    state_manager.read_state(tmpdir / "best.pth")
+    assert torch.equal(head.weight, expected)
+
+
+def test_dedup_gc_removes_unreferenced_blobs(tmpdir):
+    model = nn.Linear(3, 2)
+    state_manager = StateManager(checkpoint_format="dedup")
+    state_manager.attach("model", model)
+
+    state_manager.write_state(tmpdir / "last.pth")
+    with torch.no_grad():
+        model.weight.mul_(2)
+    state_manager.write_state(tmpdir / "last.pth")
+    assert len(_blobs(tmpdir)) == 2
+
+    (tmpdir / "last.pth").remove()
+    assert gc_blobs(tmpdir) == 2
+    assert _blobs(tmpdir) == set()
+
+
+def test_dedup_saves_updates_through_data(tmpdir):
+    model = nn.Linear(3, 2)
+    state_manager = StateManager(checkpoint_format="dedup")
+    state_manager.attach("model", model)
+
+    state_manager.write_state(tmpdir / "last.pth")
+    # Doesn't bump version counter of parameter
+    model.weight.data.add_(100)
+    state_manager.write_state(tmpdir / "last.pth")
+
+    expected = model.weight.detach().clone()
+    with torch.no_grad():
+        model.weight.zero_()
+    state_manager.read_state(tmpdir / "last.pth")
+    assert torch.equal(model.weight, expected)
+
+
+def test_read_state_reads_torch_format(tmpdir):
+    model = nn.Linear(3, 2)
+    StateManager().attach("model", model)
+    torch.save({"model": model.state_dict()}, tmpdir / "last.pth")
+
+    state_manager = StateManager(checkpoint_format="dedup")
+    restored = nn.Linear(3, 2)
+    state_manager.attach("model", restored)
+    state_manager.read_state(tmpdir / "last.pth")
+    assert torch.equal(restored.weight, model.weight)
+
+
+def test_sharded_checkpoint_reads_only_requested_keys(tmpdir):
+    model, other = nn.Linear(3, 2), nn.Linear(5, 5)
+    state_manager = StateManager(checkpoint_format="sharded")
+    state_manager.attach("model", model)
+    state_manager.attach("callback/Saver", other)
+
+    state_manager.write_state(tmpdir / "last.pth")
+    with torch.no_grad():
+        model.weight.add_(1)
+    # Overwrites previous directory
+    state_manager.write_state(tmpdir / "last.pth")
+    checkpoint = tmpdir / "last.pth"
+    assert sorted(p.basename for p in checkpoint.listdir()) == [
+        "0_model.pt",
+        "1_callback_Saver.pt",
+        "index.json",
+    ]
+    assert [p.basename for p in tmpdir.listdir()] == ["last.pth"]
+
+    # Files of other keys are not read
+    (checkpoint / "1_callback_Saver.pt").remove()
+    expected = model.weight.detach().clone()
+    with torch.no_grad():
+        model.weight.zero_()
+    state_manager.read_state_by_key(checkpoint, "model")
+    assert torch.equal(model.weight, expected)
+
+    with torch.no_grad():
+        model.weight.zero_()
+    state_manager.read_state(checkpoint, skip_keys=["callback/Saver"])
+    assert torch.equal(model.weight, expected)
+
+
+def _zero_state_manager():
+    torch.manual_seed(0)
+    model = nn.Sequential(nn.Linear(4, 4), nn.Linear(4, 2))
+    optimizer = ZeroRedundancyOptimizer(model.parameters(), torch.optim.Adam, lr=0.1)
+    state_manager = StateManager(checkpoint_format="distributed")
+    state_manager.attach("model", model)
+    state_manager.attach("optimizer", ZeroOptimizerState(optimizer))
+    return state_manager, model, optimizer
+
+
+def _consolidated(optimizer):
+    optimizer.consolidate_state_dict(to=0)
+    if idist.get_rank() == 0:
+        return optimizer.state_dict()
+
+
+def _save_on_ranks(_, logdir):
+    state_manager, model, optimizer = _zero_state_manager()
+    model(torch.ones(3, 4)).sum().backward()
+    optimizer.step()
+
+    state_manager.write_state(f"{logdir}/last.pth")
+    expected = _consolidated(optimizer)
+    if idist.get_rank() == 0:
+        expected = {"model": model.state_dict(), "optimizer": expected}
+        torch.save(expected, f"{logdir}/expected.pth")
+
+
+def _load_on_ranks(_, logdir):
+    state_manager, model, optimizer = _zero_state_manager()
+    state_manager.read_state(f"{logdir}/last.pth")
+
+    restored = _consolidated(optimizer)
+    if idist.get_rank() == 0:
+        expected = torch.load(f"{logdir}/expected.pth")
+        for key, value in expected["model"].items():
+            assert torch.equal(model.state_dict()[key], value)
+        assert restored["param_groups"] == expected["optimizer"]["param_groups"]
+        for index, state in expected["optimizer"]["state"].items():
+            for name, value in state.items():
+                assert torch.equal(restored["state"][index][name], value)
+
+
+def test_distributed_checkpoint_with_zero_optimizer(tmpdir):
+    with idist.Parallel(backend="gloo", nproc_per_node=2) as parallel:
+        parallel.run(_save_on_ranks, str(tmpdir))
+
+    checkpoint = tmpdir / "last.pth"
+    assert sorted(p.basename for p in checkpoint.listdir()) == [
+        "0_model.pt",
+        "index.json",
+        "shard_0.pt",
+        "shard_1.pt",
+    ]
+
+    # Same and different world size
+    for nproc in (2, 1):
+        with idist.Parallel(backend="gloo", nproc_per_node=nproc) as parallel:
+            parallel.run(_load_on_ranks, str(tmpdir))
+
+
+def _load_own_shard_on_ranks(_, logdir):
+    read = []
+    load = state_io._torch_load
+
+    def _recording_load(file, mmap):
+        read.append(file.name)
+        return load(file, mmap)
+
+    state_io._torch_load = _recording_load
+    try:
+        _load_on_ranks(_, logdir)
+    finally:
+        state_io._torch_load = load
+    assert sorted(read) == ["0_model.pt", f"shard_{idist.get_rank()}.pt"]
+
+
+def test_distributed_checkpoint_reads_own_shard(tmpdir):
+    with idist.Parallel(backend="gloo", nproc_per_node=2) as parallel:
+        parallel.run(_save_on_ranks, str(tmpdir))
+        parallel.run(_load_own_shard_on_ranks, str(tmpdir))
+
+
+class _FailingOnRank:
+    def __init__(self, rank: int):
+        self.rank = rank
+
+    def state_dict(self):
+        return {}
+
+    def load_state_dict(self, state_dict):
+        pass
+
+    def sharded_state_dict(self):
+        if idist.get_rank() == self.rank:
+            return {"unpicklable": lambda: None}
+        return {}
+
+    def load_sharded_state_dict(self, shards):
+        pass
+
+
+def _failing_save_on_ranks(_, logdir):
+    state_manager = StateManager(checkpoint_format="distributed")
+    state_manager.attach("model", nn.Linear(2, 2))
+    state_manager.attach("failing", _FailingOnRank(rank=1))
+    with pytest.raises(Exception) as error:
+        state_manager.write_state(f"{logdir}/last.pth")
+    if idist.get_rank() == 0:
+        assert isinstance(error.value, RuntimeError)
+        assert "failed on other rank" in str(error.value)
+
+
+def test_distributed_checkpoint_failure_raises_on_all_ranks(tmpdir):
+    with idist.Parallel(backend="gloo", nproc_per_node=2) as parallel:
+        parallel.run(_failing_save_on_ranks, str(tmpdir))
+    assert tmpdir.listdir() == []
+
+
+def _rng_on_ranks(_, logdir):
+    rank = idist.get_rank()
+    state_manager = StateManager()
+    state_manager.attach("rng", RNGState())
+
+    torch.manual_seed(100 + rank)
+    if rank == 0:
+        state_manager.write_state(f"{logdir}/last.pth")
+    expected = torch.rand(2)
+    idist.barrier()
+
+    torch.manual_seed(200 + rank)
+    state_manager.read_state(f"{logdir}/last.pth")
+    if rank > 0:
+        # Rank 0 state isn't copied to other ranks
+        expected = torch.rand(2, generator=torch.Generator().manual_seed(200 + rank))
+    assert torch.equal(torch.rand(2), expected)
+
+
+def test_single_file_rng_state_restored_on_rank_zero_only(tmpdir):
+    with idist.Parallel(backend="gloo", nproc_per_node=2) as parallel:
+        parallel.run(_rng_on_ranks, str(tmpdir))
+
+
+def _train_with_rank_zero_callbacks(_, logdir):
+    # Replicated keys of both reporters would go to different ranks round-robin
+    reporters = [
+        BestMetricsReporter({"valid/loss": "min"}, summary_formats=[])
+        for _ in range(2)
+    ]
+    state_manager = StateManager(checkpoint_format="distributed")
+    callbacks = [*reporters, LastModelSaverCallback()]
+    loop = Loop(logdir, callbacks, state_manager=state_manager)
+
+    def train(loop: Loop):
+        for _ in loop.iterate_epochs(1):
+            loop.metrics.log("valid/loss", 0.5)
+
+    loop.run(train)
+
+
+def test_distributed_checkpoint_saves_rank_zero_states(tmpdir):
+    with idist.Parallel(backend="gloo", nproc_per_node=2) as parallel:
+        parallel.run(_train_with_rank_zero_callbacks, str(tmpdir))
+
+    # Reporters are updated on rank 0 only
+    keys = ["callback/BestMetricsReporter", "callback/BestMetricsReporter_1"]
+    state = load_state(tmpdir / "last.pth", keys)
+    for key in keys:
+        assert state[key]["epochs_elapsed_num"] == 1
+        assert state[key]["metrics"]["valid/loss"]["best_value"] == 0.5
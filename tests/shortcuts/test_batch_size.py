@@ -0,0 +1,118 @@
+import ignite.distributed as idist
+import torch
+from torch import nn
+from torch.utils.data import TensorDataset
+
+from matches.loop import Loop
+from matches.shortcuts import batch_size
+from matches.shortcuts.batch_size import find_max_batch_size
+
+
+def _dataset():
+    return TensorDataset(torch.randn(64, 4), torch.randn(64, 1))
+
+
+def test_find_max_batch_size_with_oom_and_cache(tmpdir):
+    loop = Loop(tmpdir, [])
+    model = nn.Linear(4, 1)
+    tried = []
+
+    def step(batch):
+        x, y = batch
+        tried.append(len(x))
+        if len(x) > 37:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        nn.functional.mse_loss(model(x), y).backward()
+
+    assert find_max_batch_size(loop, step, _dataset(), model, memory_budget=2**40) == 37
+    assert tried[:7] == [1, 2, 4, 8, 16, 32, 64]
+    assert model.weight.grad is None
+
+    tried.clear()
+    assert find_max_batch_size(loop, step, _dataset(), model, memory_budget=2**40) == 37
+    assert tried == []
+
+
+def test_find_max_batch_size_respects_maximum(tmpdir):
+    loop = Loop(tmpdir, [])
+    model = nn.Linear(4, 1)
+
+    def step(batch):
+        nn.functional.mse_loss(model(batch[0]), batch[1]).backward()
+
+    size = find_max_batch_size(
+        loop, step, _dataset(), model, max_batch_size=48, memory_budget=2**40
+    )
+    assert size == 48
+
+
+def test_find_max_batch_size_restores_buffers(tmpdir):
+    loop = Loop(tmpdir, [])
+    model = nn.Sequential(nn.Linear(4, 4), nn.BatchNorm1d(4), nn.Linear(4, 1))
+    expected = {k: v.clone() for k, v in model.state_dict().items()}
+
+    def step(batch):
+        nn.functional.mse_loss(model(batch[0]), batch[1]).backward()
+
+    find_max_batch_size(
+        loop, step, _dataset(), model, start=2, max_batch_size=8, memory_budget=2**40
+    )
+    for key, value in model.state_dict().items():
+        assert torch.equal(value, expected[key]), key
+
+
+def test_cache_ignores_default_budget(tmpdir, monkeypatch):
+    loop = Loop(tmpdir, [])
+    model = nn.Linear(4, 1)
+    tried = []
+
+    def step(batch):
+        tried.append(len(batch[0]))
+        nn.functional.mse_loss(model(batch[0]), batch[1]).backward()
+
+    for budget in [2**40, 2**40 + 2**30]:
+        monkeypatch.setattr(
+            batch_size._ProcessMemory, "default_budget", lambda self, b=budget: b
+        )
+        assert find_max_batch_size(loop, step, _dataset(), model, max_batch_size=8) == 8
+    assert tried == [1, 2, 4, 8]
+
+
+def _search_on_ranks(local_rank: int, logdir: str):
+    loop = Loop(logdir, [])
+    model = nn.Linear(4, 1)
+    limit = 37 if idist.get_rank() == 0 else 20
+    tried = []
+
+    def step(batch):
+        tried.append(len(batch[0]))
+        if len(batch[0]) > limit:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        nn.functional.mse_loss(model(batch[0]), batch[1]).backward()
+
+    size = find_max_batch_size(loop, step, _dataset(), model, memory_budget=2**40)
+    assert size == 20
+    assert tried == [1, 2, 4, 8, 16, 32, 24, 20, 22, 21]
+
+
+def test_find_max_batch_size_distributed(tmpdir):
+    with idist.Parallel(backend="gloo", nproc_per_node=2) as parallel:
+        parallel.run(_search_on_ranks, str(tmpdir))
+
+
+def test_micro_batches_accumulate_full_batch_gradient(tmpdir):
+    loop = Loop(tmpdir, [])
+    model = nn.Linear(4, 1)
+    x, y = torch.randn(10, 4), torch.randn(10, 1)
+
+    nn.functional.mse_loss(model(x), y).backward()
+    expected = model.weight.grad.clone()
+    model.zero_grad()
+
+    chunks = []
+    for mx, my in loop.iterate_micro_batches((x, y), micro_batch_size=4):
+        chunks.append(len(mx))
+        loop.backward(nn.functional.mse_loss(model(mx), my))
+
+    assert chunks == [4, 4, 2]
+    assert torch.allclose(model.weight.grad, expected, atol=1e-6)
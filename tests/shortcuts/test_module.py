@@ -0,0 +1,63 @@
+import gc
+import weakref
+
+import torch
+from torch import nn
+
+from matches.shortcuts.module import (
+    invalidate_module_cache,
+    module_train,
+    no_grad_for_module,
+)
+
+
+def make_model() -> nn.Module:
+    model = nn.Sequential(nn.Linear(2, 2), nn.Sequential(nn.Dropout(), nn.Linear(2, 2)))
+    model[1][1].eval()
+    model[0].weight.requires_grad_(False)
+    return model
+
+
+def test_module_train_restores_modes():
+    model = make_model()
+    with module_train(model, train=False):
+        assert not any(m.training for m in model.modules())
+    assert [m.training for m in model.modules()] == [True, True, True, True, False]
+
+
+def test_cache_tracks_structure_change():
+    model = make_model()
+    with module_train(model, train=False):
+        pass
+
+    model.append(nn.Dropout())
+    with module_train(model, train=False):
+        assert not model[2].training
+    assert model[2].training
+
+    del model[2]
+    invalidate_module_cache(model)
+    head = nn.Dropout()
+    model.head = head
+    with module_train(model, train=False):
+        assert not head.training
+
+
+def test_no_grad_for_module():
+    model = make_model()
+    model.extra = nn.Parameter(torch.zeros(1))
+    with no_grad_for_module(model):
+        assert not any(p.requires_grad for p in model.parameters())
+    assert not model[0].weight.requires_grad
+    assert sum(p.requires_grad for p in model.parameters()) == 4
+
+
+def test_cache_does_not_keep_module_alive():
+    model = make_model()
+    with module_train(model, train=False), no_grad_for_module(model):
+        pass
+
+    ref = weakref.ref(model)
+    del model
+    gc.collect()
+    assert ref() is None